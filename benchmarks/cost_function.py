@@ -0,0 +1,87 @@
+import argparse
+import time
+
+import cv2
+import numpy
+
+import budgetpiano.homography
+import budgetpiano.refinement
+from budgetpiano.piano import _get_piano
+
+
+def legacy_cost_function(params, *args):
+    homography = params.reshape((3, 3))
+    source = args[0]
+    cost = 0.0
+    for template in args[1:]:
+        destination = cv2.warpPerspective(source, homography, (template.shape[1], template.shape[0]))
+        if numpy.allclose(destination, 0) or numpy.allclose(template, 0):
+            cost += 2.0
+        else:
+            cosine_similarity = numpy.dot(
+                destination.astype(float).ravel() / numpy.linalg.norm(destination.astype(float)),
+                template.astype(float).ravel() / numpy.linalg.norm(template.astype(float)),
+            )
+            dissimilarity_measure = (2.0 - (1.0 + cosine_similarity)) / 2.0
+            cost += dissimilarity_measure
+    return cost
+
+
+def get_scene(white_key_width_px, frame_size):
+    template = _get_piano(white_key_width_px)
+    height, width = template.shape[:2]
+    template_corners = numpy.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    frame_width, frame_height = frame_size
+    frame_corners = numpy.float32(
+        [
+            [0.1 * frame_width, 0.4 * frame_height],
+            [0.9 * frame_width, 0.38 * frame_height],
+            [0.92 * frame_width, 0.6 * frame_height],
+            [0.08 * frame_width, 0.62 * frame_height],
+        ]
+    )
+    homography = cv2.getPerspectiveTransform(frame_corners, template_corners).astype(numpy.float64)
+    frame = numpy.full((frame_height, frame_width, 3), 60, numpy.uint8)
+    cv2.warpPerspective(
+        template, numpy.linalg.inv(homography), frame_size, dst=frame, borderMode=cv2.BORDER_TRANSPARENT
+    )
+    return frame, template, homography
+
+
+def get_calls_per_second(function, params, args, duration):
+    nof_calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        function(params, *args)
+        nof_calls += 1
+    return nof_calls / (time.perf_counter() - start)
+
+
+def main(white_key_width_px, frame_size, duration):
+    frame, template, homography = get_scene(white_key_width_px, frame_size)
+    params = homography.ravel()
+    key_mask = numpy.zeros(template.shape[:2], numpy.uint8)
+    key_mask[template.shape[0] // 2 :, :] = 255
+
+    candidates = {
+        "legacy": (legacy_cost_function, (frame, template)),
+        "prepared": (budgetpiano.homography.cost_function, (frame, budgetpiano.refinement.PreparedTemplate(template))),
+        "prepared-masked": (
+            budgetpiano.homography.cost_function,
+            (frame, budgetpiano.refinement.PreparedTemplate(template, key_mask)),
+        ),
+    }
+    print(f"template {template.shape[1]}x{template.shape[0]}, frame {frame_size[0]}x{frame_size[1]}")
+    for name, (function, args) in candidates.items():
+        calls_per_second = get_calls_per_second(function, params, args, duration)
+        print(f"{name:>16}: cost {function(params, *args):.6f}, {calls_per_second:8.1f} calls/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--white-key-width", type=int, default=20, help="White key width of the template in pixels")
+    parser.add_argument("--frame-width", type=int, default=1920)
+    parser.add_argument("--frame-height", type=int, default=1080)
+    parser.add_argument("--duration", type=float, default=2.0, help="Seconds to run each candidate")
+    args = parser.parse_args()
+    main(args.white_key_width, (args.frame_width, args.frame_height), args.duration)
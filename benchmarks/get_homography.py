@@ -0,0 +1,81 @@
+import argparse
+import time
+
+import cv2
+import numpy
+
+import budgetpiano.matcher
+from budgetpiano.piano import _get_piano
+
+
+def legacy_filter_matches(matcher, matches):
+    nof_neighbours = 2
+    is_significantly_smaller_ratio = 0.7
+    good_matches = []
+    for match in matches:
+        if len(match) < nof_neighbours:
+            continue
+        best_match, second_best_match = match
+        if best_match.distance < is_significantly_smaller_ratio * second_best_match.distance:
+            is_too_close = False
+            for good_match in good_matches:
+                good_point = numpy.asarray(matcher.train_keypoints[good_match.trainIdx].pt)
+                best_point = numpy.asarray(matcher.train_keypoints[best_match.trainIdx].pt)
+                distance = cv2.norm(best_point - good_point)
+                if distance < 1:
+                    is_too_close = True
+            if not is_too_close:
+                good_matches.append(best_match)
+    return good_matches
+
+
+def get_scene(white_key_width_px, seed=0):
+    rng = numpy.random.default_rng(seed)
+    template = _get_piano(white_key_width_px)
+    noise = cv2.GaussianBlur((rng.random(template.shape[:2]) * 255).astype(numpy.uint8), (0, 0), 1)
+    template = cv2.addWeighted(template, 0.7, cv2.cvtColor(noise, cv2.COLOR_GRAY2BGR), 0.3, 0)
+    height, width = template.shape[:2]
+    corners = numpy.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    jitter = rng.normal(0, 0.02 * height, corners.shape).astype(numpy.float32)
+    homography = cv2.getPerspectiveTransform(corners, corners + jitter + 0.05 * height)
+    query = cv2.warpPerspective(template, homography, (width + height // 5, height + height // 5))
+    return template, query
+
+
+def get_matches_per_second(function, matches, duration):
+    nof_calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        function(matches)
+        nof_calls += 1
+    return nof_calls * len(matches) / (time.perf_counter() - start)
+
+
+def main(white_key_widths, duration):
+    print(f"{'keypoints':>10} {'legacy':>14} {'vectorized':>14} identical")
+    for white_key_width_px in white_key_widths:
+        template, query = get_scene(white_key_width_px)
+        image_matcher = budgetpiano.matcher.ImageMatcher(template)
+        query_keypoints, query_descriptors = image_matcher.sift.detectAndCompute(query, None)
+        matches = image_matcher.matcher.knnMatch(query_descriptors, k=2)
+
+        legacy = legacy_filter_matches(image_matcher, matches)
+        vectorized = image_matcher._filter_matches(matches)
+        is_identical = [(m.queryIdx, m.trainIdx) for m in legacy] == [(m.queryIdx, m.trainIdx) for m in vectorized]
+
+        legacy_rate = get_matches_per_second(lambda m: legacy_filter_matches(image_matcher, m), matches, duration)
+        vectorized_rate = get_matches_per_second(image_matcher._filter_matches, matches, duration)
+        print(
+            f"{len(image_matcher.train_keypoints):>10} {legacy_rate:>10.0f} m/s",
+            f"{vectorized_rate:>10.0f} m/s {is_identical}",
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        "--white-key-widths", type=int, nargs="+", default=[10, 20, 40, 80], help="Template sizes to benchmark"
+    )
+    parser.add_argument("--duration", type=float, default=1.0, help="Seconds to run each candidate")
+    args = parser.parse_args()
+    main(args.white_key_widths, args.duration)
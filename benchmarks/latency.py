@@ -0,0 +1,270 @@
+import argparse
+import json
+import logging
+import pathlib
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy
+
+import budgetpiano.cli
+import budgetpiano.matcher
+import budgetpiano.midi_output
+import budgetpiano.session
+import budgetpiano.synthetic
+import budgetpiano.tracking
+from budgetpiano.piano import _get_piano
+
+DEFAULT_BUDGETS = dict(p50_ms=150.0, p95_ms=250.0, p99_ms=350.0, missed_fraction=0.1, false_fraction=0.1)
+
+
+class ScriptedCamera:
+    # Stands in for a cv2.VideoCapture and hands out pre-rendered frames at the pace of a real camera, starting
+    # with the first read. Frames the reader is too slow for are not skipped, like with a camera's own buffer.
+    def __init__(self, frames, fps):
+        self.frames = frames
+        self.fps = fps
+        self.frame_no = 0
+        self.start_time = None
+
+    def isOpened(self):
+        return self.frame_no < len(self.frames)
+
+    def read(self, image=None):
+        if self.frame_no >= len(self.frames):
+            return False, None
+        if self.start_time is None:
+            self.start_time = time.monotonic()
+        delay = self.start_time + self.frame_no / self.fps - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        frame = self.frames[self.frame_no]
+        if image is not None and image.shape == frame.shape:
+            numpy.copyto(image, frame)
+        else:
+            image = frame.copy()
+        self.frame_no += 1
+        return True, image
+
+    def get(self, property_id):
+        if property_id == cv2.CAP_PROP_FPS:
+            return self.fps
+        if property_id == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.frame_no)
+        return 0.0
+
+    def release(self):
+        self.frame_no = len(self.frames)
+
+
+def get_scripted_presses(layout, first_press, duration, interval, length, rng):
+    # One press at a time on a random key, so that every note the pipeline sends can be told apart.
+    presses = []
+    for start in numpy.arange(first_press, duration - length, interval).tolist():
+        key_no = int(rng.integers(len(layout.midi)))
+        presses.append(
+            budgetpiano.synthetic.Press(
+                start,
+                start + length,
+                *budgetpiano.synthetic.get_key_press_point(layout, key_no),
+                int(layout.midi[key_no]),
+            )
+        )
+    return presses
+
+
+def write_session(path, template, layout, frame, stabilizer_backend):
+    # The ground truth of the first frame as a saved session, so that cli.main skips the dialogs. Its first frame
+    # is the stabilizer's reference, so the homography is already in stabilized coordinates.
+    homography_tracker = budgetpiano.tracking.HomographyTracker(template, layout)
+    residual = homography_tracker.get_residual(frame.image, frame.homography)
+    budgetpiano.session.save_session(
+        path,
+        budgetpiano.session.Session(template, layout, frame.homography, residual, stabilizer_backend, None, None),
+    )
+
+
+def match_notes(presses, start_time, messages, arrival_times, max_early=0.3, max_latency=1.0):
+    # Pairs every press with the first note on of its key that arrives between the moment the finger lands and
+    # max_latency seconds after it lifts. Presses without a note are missed, notes without a press are false. False
+    # notes of a pressed key up to max_early seconds before it is pressed, as from a finger sliding in, are also
+    # counted as early.
+    note_ons = [
+        (arrival_time, message.note)
+        for message, arrival_time in zip(messages, arrival_times)
+        if message.type == "note_on" and message.velocity > 0
+    ]
+    is_matched = numpy.zeros(len(note_ons), bool)
+    latencies = []
+    nof_missed = 0
+    for press in presses:
+        press_time = start_time + press.start
+        candidates = [
+            i
+            for i, (arrival_time, note) in enumerate(note_ons)
+            if not is_matched[i]
+            and note == press.note
+            and press_time <= arrival_time <= start_time + press.end + max_latency
+        ]
+        if not candidates:
+            nof_missed += 1
+            continue
+        is_matched[candidates[0]] = True
+        latencies.append(note_ons[candidates[0]][0] - press_time)
+    is_early = numpy.zeros(len(note_ons), bool)
+    for press in presses:
+        press_time = start_time + press.start
+        is_early |= numpy.array(
+            [
+                note == press.note and press_time - max_early <= arrival_time < press_time
+                for arrival_time, note in note_ons
+            ],
+            bool,
+        )
+    return numpy.asarray(latencies), nof_missed, int((~is_matched).sum()), int((~is_matched & is_early).sum())
+
+
+def get_failures(results, budgets):
+    failures = []
+    latency_ms = results["latency_ms"]
+    for percentile in ("p50", "p95", "p99"):
+        budget = budgets[f"{percentile}_ms"]
+        if latency_ms is None or latency_ms[percentile] > budget:
+            value = None if latency_ms is None else round(latency_ms[percentile], 1)
+            failures.append(f"{percentile} latency {value} ms over budget {budget} ms")
+    nof_presses = max(results["presses"], 1)
+    for name in ("missed", "false"):
+        budget = budgets[f"{name}_fraction"]
+        if results[f"{name}_notes"] / nof_presses > budget:
+            failures.append(f"{results[f'{name}_notes']} {name} notes over budget {budget:.0%} of the presses")
+    return failures
+
+
+def main(
+    white_key_width_px,
+    nof_keys,
+    frame_size,
+    fps,
+    duration,
+    first_press,
+    press_interval,
+    press_length,
+    approach,
+    lighting,
+    seed,
+    stabilizer_backend,
+    target_latency,
+    budgets,
+):
+    template, layout = _get_piano(white_key_width_px, nof_keys, return_layout=True)
+    rng = numpy.random.default_rng(seed)
+    presses = get_scripted_presses(layout, first_press, duration, press_interval, press_length, rng)
+    # Rendered up front, so that drawing the scene does not compete with the pipeline for the CPU.
+    frames = list(
+        budgetpiano.synthetic.generate_video(
+            template,
+            layout,
+            frame_size,
+            fps,
+            duration,
+            presses=presses,
+            lighting=lighting,
+            approach=approach,
+            seed=seed,
+        )
+    )
+    camera = ScriptedCamera([frame.image for frame in frames], fps)
+    port = budgetpiano.midi_output.RecordingPort()
+
+    with tempfile.TemporaryDirectory() as directory:
+        session_path = pathlib.Path(directory) / "session.npz"
+        write_session(session_path, template, layout, frames[0], stabilizer_backend)
+        budgetpiano.cli.main(
+            camera,
+            port,
+            stabilizer_backend=stabilizer_backend,
+            target_latency=target_latency,
+            session_path=session_path,
+            auto_localize=False,
+        )
+
+    latencies, nof_missed, nof_false, nof_early = match_notes(
+        presses, camera.start_time, port.messages, port.arrival_times, max_early=approach
+    )
+    results = {
+        "scene": {
+            "white_key_width_px": white_key_width_px,
+            "nof_keys": nof_keys,
+            "frame_size": list(frame_size),
+            "fps": fps,
+            "duration": duration,
+            "approach": approach,
+            "lighting": lighting,
+            "seed": seed,
+            "stabilizer": stabilizer_backend,
+            "target_latency_ms": 1000.0 * target_latency,
+        },
+        "presses": len(presses),
+        "detected_notes": len(latencies),
+        "missed_notes": nof_missed,
+        "false_notes": nof_false,
+        "early_notes": nof_early,
+        "latency_ms": (
+            None
+            if len(latencies) == 0
+            else {f"p{p}": float(v) for p, v in zip((50, 95, 99), numpy.percentile(1000.0 * latencies, (50, 95, 99)))}
+        ),
+        "budgets": budgets,
+    }
+    results["failures"] = get_failures(results, budgets)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--white-key-width", type=int, default=10, help="White key width of the template in pixels")
+    parser.add_argument("--keys", type=int, default=61, help="Number of keys of the template")
+    parser.add_argument("--frame-width", type=int, default=960)
+    parser.add_argument("--frame-height", type=int, default=540)
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--duration", type=float, default=12.0, help="Length of the scripted video in seconds")
+    parser.add_argument("--first-press", type=float, default=3.0, help="Seconds before the first press, for warmup")
+    parser.add_argument("--press-interval", type=float, default=0.75, help="Seconds from one press to the next")
+    parser.add_argument("--press-length", type=float, default=0.35, help="Seconds a key is held")
+    parser.add_argument("--approach", type=float, default=0.3, help="Seconds a finger slides in before a press")
+    parser.add_argument("--lighting", type=float, default=0.1, help="Amplitude of the slow lighting change")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stabilizer", choices=budgetpiano.matcher.STABILIZER_BACKENDS, default="optical-flow")
+    parser.add_argument("--target-latency", type=float, default=0.1, help="Latency target of the scheduler, seconds")
+    for name, default in DEFAULT_BUDGETS.items():
+        parser.add_argument(f"--max-{name.replace('_', '-')}", type=float, default=default, dest=name)
+    parser.add_argument("--output", type=str, default=None, help="Write JSON results here instead of stdout")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    results = main(
+        args.white_key_width,
+        args.keys,
+        (args.frame_width, args.frame_height),
+        args.fps,
+        args.duration,
+        args.first_press,
+        args.press_interval,
+        args.press_length,
+        args.approach,
+        args.lighting,
+        args.seed,
+        args.stabilizer,
+        args.target_latency,
+        {name: getattr(args, name) for name in DEFAULT_BUDGETS},
+    )
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    for failure in results["failures"]:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(1 if results["failures"] else 0)
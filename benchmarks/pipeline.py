@@ -0,0 +1,242 @@
+import argparse
+import json
+import resource
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy
+
+import budgetpiano.frame_context
+import budgetpiano.homography
+import budgetpiano.matcher
+import budgetpiano.refinement
+import budgetpiano.synthetic
+import budgetpiano.tracking
+from budgetpiano.piano import _get_piano
+
+
+def perturb(homography, size, rng, amplitude):
+    width, height = size
+    corners = numpy.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    frame_corners = cv2.perspectiveTransform(corners[None], numpy.linalg.inv(homography))[0]
+    frame_corners += rng.normal(0.0, amplitude, frame_corners.shape).astype(numpy.float32)
+    return cv2.getPerspectiveTransform(frame_corners, corners).astype(numpy.float64), frame_corners
+
+
+class StabilizationStage:
+    def __init__(self, template, backend):
+        self.video_stabilizer = budgetpiano.matcher.VideoStabilizer(backend)
+
+    def process(self, frame):
+        return self.video_stabilizer.get_homography(frame.image), frame.stabilization_homography, frame.image.shape
+
+
+class FindHomographyStage:
+    def __init__(self, template, corner_noise=3.0):
+        self.template = template
+        self.corner_noise = corner_noise
+        self.rng = numpy.random.default_rng(0)
+
+    def process(self, frame):
+        _, polygon = perturb(frame.homography, self.size, self.rng, self.corner_noise)
+        # The user clicks the corners in order around the polygon, starting anywhere and in either direction.
+        polygon = numpy.roll(polygon, self.rng.integers(4), axis=0)[:: self.rng.choice([-1, 1])]
+        homography = budgetpiano.homography.find_homography(frame.image, self.template, polygon)
+        return homography, frame.homography, self.template.shape
+
+    @property
+    def size(self):
+        return (self.template.shape[1], self.template.shape[0])
+
+
+class RefinementStage:
+    def __init__(self, template, layout, corner_noise=3.0, time_budget=None):
+        self.template = template
+        self.layout = layout
+        self.template_pyramid = budgetpiano.refinement.build_template_pyramid(template, layout)
+        self.corner_noise = corner_noise
+        self.time_budget = time_budget
+        self.rng = numpy.random.default_rng(0)
+
+    def process(self, frame):
+        size = (self.template.shape[1], self.template.shape[0])
+        initial_homography, _ = perturb(frame.homography, size, self.rng, self.corner_noise)
+        homography = budgetpiano.refinement.refine_homography(
+            frame.image,
+            self.template,
+            initial_homography,
+            self.layout,
+            time_budget=self.time_budget,
+            template_pyramid=self.template_pyramid,
+        )
+        return homography, frame.homography, self.template.shape
+
+
+class TrackingStage:
+    def __init__(self, template, layout, backend="sift", time_budget=0.02):
+        self.template = template
+        self.layout = layout
+        self.video_stabilizer = budgetpiano.matcher.VideoStabilizer(backend)
+        self.time_budget = time_budget
+        self.homography_tracker = None
+
+    def process(self, frame):
+        size = (self.template.shape[1], self.template.shape[0])
+        frame_context = budgetpiano.frame_context.FrameContext(frame.image, self.video_stabilizer.buffer_pool)
+        stabilization_homography = self.video_stabilizer.get_homography(frame_context)
+        if self.homography_tracker is None:
+            self.homography_tracker = budgetpiano.tracking.HomographyTracker(
+                self.template, self.layout, time_budget=self.time_budget
+            )
+            self.homography_tracker.reset(frame.homography @ numpy.linalg.inv(stabilization_homography))
+        # Same as cli.main: track on a crop around the keyboard, sharing the frame's grayscale with the stabilizer,
+        # and compose the homographies instead of warping.
+        x, y, width, height = budgetpiano.tracking.get_roi(
+            size, self.homography_tracker.homography @ stabilization_homography, frame.image.shape
+        )
+        homography = self.homography_tracker.update(
+            frame_context.crop(x, y, width, height),
+            stabilization_homography @ budgetpiano.tracking.get_translation(x, y),
+        )
+        return homography @ stabilization_homography, frame.homography, self.template.shape
+
+    def get_stats(self):
+        return self.homography_tracker.get_stats()
+
+
+class ForegroundStage:
+    def __init__(self, template, history=300):
+        self.size = (template.shape[1], template.shape[0])
+        self.bg_model = cv2.createBackgroundSubtractorMOG2(history=history, detectShadows=False)
+
+    def process(self, frame):
+        instrument_image = cv2.warpPerspective(frame.image, frame.homography, self.size)
+        self.bg_model.apply(instrument_image)
+        return None, None, None
+
+
+def get_stages(template, layout, stabilizers):
+    stages = {f"stabilization/{backend}": (StabilizationStage, (template, backend)) for backend in stabilizers}
+    stages["find_homography"] = (FindHomographyStage, (template,))
+    stages["refinement"] = (RefinementStage, (template, layout))
+    stages["tracking"] = (TrackingStage, (template, layout))
+    stages["foreground"] = (ForegroundStage, (template,))
+    return stages
+
+
+def get_percentiles(values, percentiles=(50, 90, 95, 99)):
+    if len(values) == 0:
+        return None
+    return {f"p{p}": float(v) for p, v in zip(percentiles, numpy.percentile(values, percentiles))}
+
+
+def run_stage(stage_factory, stage_args, scene, nof_memory_frames):
+    stage = stage_factory(*stage_args)
+    latencies = []
+    errors = []
+    for frame in budgetpiano.synthetic.generate_video(**scene):
+        start = time.perf_counter()
+        homography, true_homography, reference_shape = stage.process(frame)
+        latencies.append(time.perf_counter() - start)
+        if true_homography is not None:
+            if homography is None:
+                errors.append(float("inf"))
+            else:
+                reference_size = (reference_shape[1], reference_shape[0])
+                errors.append(budgetpiano.synthetic.get_corner_error(reference_size, homography, true_homography))
+    stats = stage.get_stats() if hasattr(stage, "get_stats") else None
+
+    # Peak memory is traced in a separate pass so that tracing does not skew the latencies.
+    stage = stage_factory(*stage_args)
+    peak_memory = 0
+    tracemalloc.start()
+    for frame_no, frame in enumerate(budgetpiano.synthetic.generate_video(**scene)):
+        if frame_no >= nof_memory_frames:
+            break
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        else:
+            # Python 3.8 has no reset_peak, restarting the trace resets the peak as well.
+            tracemalloc.stop()
+            tracemalloc.start()
+        current_before, _ = tracemalloc.get_traced_memory()
+        stage.process(frame)
+        _, peak = tracemalloc.get_traced_memory()
+        peak_memory = max(peak_memory, peak - current_before)
+    tracemalloc.stop()
+
+    latencies = numpy.asarray(latencies)
+    return {
+        "frames": len(latencies),
+        "fps": float(len(latencies) / latencies.sum()) if latencies.sum() > 0 else None,
+        "latency_ms": get_percentiles(1000.0 * latencies),
+        "peak_memory_bytes": int(peak_memory),
+        "corner_error_px": (
+            None
+            if not errors
+            else {
+                "mean": float(numpy.mean(errors)),
+                "max": float(numpy.max(errors)),
+                **get_percentiles(errors, (50, 95)),
+            }
+        ),
+        **({} if stats is None else {"stats": stats}),
+    }
+
+
+def main(white_key_width_px, frame_size, fps, duration, seed, stabilizers, stage_names, nof_memory_frames):
+    template, layout = _get_piano(white_key_width_px, return_layout=True)
+    scene = dict(template=template, layout=layout, frame_size=frame_size, fps=fps, duration=duration, seed=seed)
+    stages = get_stages(template, layout, stabilizers)
+    results = {
+        "scene": {
+            "white_key_width_px": white_key_width_px,
+            "template_size": [template.shape[1], template.shape[0]],
+            "frame_size": list(frame_size),
+            "fps": fps,
+            "duration": duration,
+            "seed": seed,
+        },
+        "stages": {},
+    }
+    for name, (stage_factory, stage_args) in stages.items():
+        if stage_names and not any(name.startswith(stage_name) for stage_name in stage_names):
+            continue
+        results["stages"][name] = run_stage(stage_factory, stage_args, scene, nof_memory_frames)
+    results["max_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--white-key-width", type=int, default=10, help="White key width of the template in pixels")
+    parser.add_argument("--frame-width", type=int, default=1280)
+    parser.add_argument("--frame-height", type=int, default=720)
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--duration", type=float, default=3.0, help="Length of the synthetic video in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--stabilizers", nargs="+", default=list(budgetpiano.matcher.STABILIZER_BACKENDS), help="Backends to run"
+    )
+    parser.add_argument("--stages", nargs="*", default=[], help="Only run stages whose name starts with these")
+    parser.add_argument("--memory-frames", type=int, default=5, help="Frames traced for peak memory")
+    parser.add_argument("--output", type=str, default=None, help="Write JSON results here instead of stdout")
+    args = parser.parse_args()
+    results = main(
+        args.white_key_width,
+        (args.frame_width, args.frame_height),
+        args.fps,
+        args.duration,
+        args.seed,
+        args.stabilizers,
+        args.stages,
+        args.memory_frames,
+    )
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,57 @@
+import numpy
+
+import budgetpiano.instrumentation
+
+
+class BufferPool:
+    # Named scratch arrays that live from one frame to the next, to be passed as dst= to OpenCV and as out= to
+    # numpy. A buffer handed out under a name is valid until the same name is asked for again, usually in the next
+    # frame. The memory behind a name only grows, with some slack, so that sizes that jitter from frame to frame,
+    # like a region of interest, stop allocating once the largest has been seen.
+    def __init__(self, slack=0.25):
+        self.slack = slack
+        self.buffers = dict()
+        self.nof_requests = 0
+        self.nof_allocations = 0
+        self.nof_frame_allocations = 0
+        self.nof_frames = 0
+        self.nof_steady_frames = 0
+        self.peak_bytes = 0
+
+    def get(self, name, shape, dtype=numpy.uint8):
+        dtype = numpy.dtype(dtype)
+        shape = tuple(int(size) for size in shape)
+        nof_bytes = int(numpy.prod(shape)) * dtype.itemsize
+        memory = self.buffers.get(name)
+        self.nof_requests += 1
+        if memory is None or memory.nbytes < nof_bytes:
+            memory = numpy.empty(int(nof_bytes * (1.0 + self.slack)) + dtype.itemsize, numpy.uint8)
+            self.buffers[name] = memory
+            self.nof_allocations += 1
+            self.nof_frame_allocations += 1
+            self.peak_bytes = max(self.peak_bytes, self.get_nof_bytes())
+        # numpy.empty aligns the memory for any dtype, and the view starts at its beginning.
+        return memory[:nof_bytes].view(dtype).reshape(shape)
+
+    def get_nof_bytes(self):
+        return sum(memory.nbytes for memory in self.buffers.values())
+
+    def finish_frame(self):
+        # A frame without allocations means the pool has reached its steady state.
+        self.nof_frames += 1
+        if self.nof_frame_allocations == 0:
+            self.nof_steady_frames += 1
+        budgetpiano.instrumentation.count("buffer_allocations", self.nof_frame_allocations)
+        budgetpiano.instrumentation.gauge("buffer_pool_bytes", self.get_nof_bytes())
+        self.nof_frame_allocations = 0
+
+    def get_stats(self):
+        return {
+            "buffers": len(self.buffers),
+            "bytes": self.get_nof_bytes(),
+            "peak_bytes": self.peak_bytes,
+            "requests": self.nof_requests,
+            "allocations": self.nof_allocations,
+            "frames": self.nof_frames,
+            "steady_frames": self.nof_steady_frames,
+        }
@@ -0,0 +1,164 @@
+import collections
+import contextlib
+import logging
+import threading
+import time
+
+import cv2
+
+import budgetpiano.instrumentation
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop-oldest"
+DROP_NEWEST = "drop-newest"
+BLOCK = "block"
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+CapturedFrame = collections.namedtuple("CapturedFrame", ["frame_no", "timestamp", "image"])
+
+
+class FrameRate:
+    def __init__(self):
+        self.count = 0
+        self.start = None
+
+    def tick(self, timestamp=None):
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        if self.start is None:
+            self.start = timestamp
+        self.count += 1
+
+    def get(self):
+        if self.start is None:
+            return 0.0
+        elapsed = time.monotonic() - self.start
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+
+class FrameRing:
+    def __init__(self, maxsize=4, policy=DROP_OLDEST, on_drop=None):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.frames = collections.deque()
+        self.condition = threading.Condition()
+        self.nof_dropped = 0
+        self.is_closed = False
+        # Called with every frame that is dropped, e.g. to reuse its image.
+        self.on_drop = on_drop
+
+    def _drop(self, frame):
+        self.nof_dropped += 1
+        if self.on_drop is not None:
+            self.on_drop(frame)
+
+    def put(self, frame):
+        with self.condition:
+            if len(self.frames) >= self.maxsize:
+                if self.policy == DROP_OLDEST:
+                    self._drop(self.frames.popleft())
+                elif self.policy == DROP_NEWEST:
+                    self._drop(frame)
+                    return False
+                else:
+                    self.condition.wait_for(lambda: len(self.frames) < self.maxsize or self.is_closed)
+                    if self.is_closed:
+                        return False
+            self.frames.append(frame)
+            self.condition.notify_all()
+            return True
+
+    def get_latest(self, timeout=None):
+        with self.condition:
+            self.condition.wait_for(lambda: self.frames or self.is_closed, timeout)
+            if not self.frames:
+                return None
+            frame = self.frames.pop()
+            while self.frames:
+                self._drop(self.frames.popleft())
+            self.condition.notify_all()
+            return frame
+
+    def close(self):
+        with self.condition:
+            self.is_closed = True
+            self.condition.notify_all()
+
+
+class CaptureThread(threading.Thread):
+    def __init__(self, cap, maxsize=4, policy=DROP_OLDEST, recycle_images=False):
+        super().__init__(name="CaptureThread", daemon=True)
+        self.cap = cap
+        # With recycling, images of dropped frames and of the frame returned by the previous get_latest call are
+        # decoded into again, so the consumer must be done with a frame when it asks for the next one. The number
+        # of images then settles at the ring size plus two.
+        self.recycle_images = recycle_images
+        self.free_images = collections.deque()
+        self.current_frame = None
+        self.nof_image_allocations = 0
+        self.ring = FrameRing(maxsize, policy, self._recycle if recycle_images else None)
+        self.decode_rate = FrameRate()
+        self.process_rate = FrameRate()
+        self.stop_event = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set() and self.cap.isOpened():
+                free_image = self.free_images.popleft() if self.free_images else None
+                with budgetpiano.instrumentation.span("decode"):
+                    ret, image = self.cap.read(free_image)
+                if not ret:
+                    break
+                if image is not free_image:
+                    self.nof_image_allocations += 1
+                timestamp = time.monotonic()
+                frame_no = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+                self.decode_rate.tick(timestamp)
+                self.ring.put(CapturedFrame(frame_no, timestamp, image))
+        finally:
+            self.ring.close()
+
+    def _recycle(self, frame):
+        self.free_images.append(frame.image)
+
+    def get_latest(self, timeout=None):
+        if self.recycle_images and self.current_frame is not None:
+            self._recycle(self.current_frame)
+        frame = self.ring.get_latest(timeout)
+        self.current_frame = frame
+        return frame
+
+    def mark_processed(self):
+        # Called by the consumer for the frames it works on, so that frames it skips do not count as processed.
+        self.process_rate.tick()
+
+    def stop(self, timeout=1.0):
+        # A camera that blocks in read must not hang the application at shutdown. The thread is a daemon, so one that
+        # is still stuck is left behind.
+        self.stop_event.set()
+        self.ring.close()
+        self.join(timeout)
+        if self.is_alive():
+            logger.warning("Capture did not stop within %.1f s, the camera may be blocked", timeout)
+
+    def get_stats(self):
+        return {
+            "decode_fps": self.decode_rate.get(),
+            "processed_fps": self.process_rate.get(),
+            "dropped_frames": self.ring.nof_dropped,
+            "image_allocations": self.nof_image_allocations,
+        }
+
+
+@contextlib.contextmanager
+def threaded_capture(cap, maxsize=4, policy=DROP_OLDEST, recycle_images=False):
+    capture_thread = CaptureThread(cap, maxsize, policy, recycle_images)
+    capture_thread.start()
+    try:
+        yield capture_thread
+    finally:
+        capture_thread.stop()
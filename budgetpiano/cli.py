@@ -1,16 +1,32 @@
 import argparse
+import concurrent.futures
 import contextlib
-import itertools
+import logging
+import time
 
+import budgetpiano.buffers
+import budgetpiano.capture
+import budgetpiano.feature_cache
+import budgetpiano.frame_context
 import budgetpiano.gui
+import budgetpiano.homography
+import budgetpiano.instrument
+import budgetpiano.instrumentation
+import budgetpiano.localization
 import budgetpiano.matcher
+import budgetpiano.midi_output
+import budgetpiano.press
+import budgetpiano.processes
+import budgetpiano.refinement
+import budgetpiano.scheduler
+import budgetpiano.session
+import budgetpiano.tracking
 
 import cv2
 import mido
 import numpy
-import scipy, scipy.optimize
 
-import contextlib
+logger = logging.getLogger(__name__)
 
 
 @contextlib.contextmanager
@@ -23,145 +39,571 @@ def managed_resource(resource):
 
 @contextlib.contextmanager
 def open_midi_port(port_name):
+    # An already open port, e.g. a recording one in a test harness, is used as is and left open.
+    if isinstance(port_name, mido.ports.BaseOutput):
+        yield port_name
+        return
     with mido.open_output(port_name) as port:
         yield port
 
 
 @contextlib.contextmanager
 def video_capture(video_source):
-    cap = cv2.VideoCapture(video_source)
+    # Anything that reads like a cv2.VideoCapture, e.g. a scripted camera, is used as is.
+    cap = video_source if hasattr(video_source, "read") else cv2.VideoCapture(video_source)
     try:
         yield cap
     finally:
         cap.release()
 
 
-def get_corners(image):
-    height, width = image.shape[:2]
-    corners = [[0, 0], [width, 0], [width, height], [0, height]]
-    return corners
-
-
-def find_homography(img, template, image_points):
-    template_pts = get_corners(template)
-    smallest = None
-    homography = None
-    for template_corners in list(itertools.permutations(template_pts)):
-        H, _ = cv2.findHomography(image_points, numpy.asarray(template_corners))
-        warped_img = cv2.warpPerspective(img, H, (template.shape[1], template.shape[0]))
-        l2_distance = cv2.norm(warped_img, template, cv2.RANSAC, 1.0)
-        if (smallest is None) or (l2_distance < smallest):
-            smallest = l2_distance
-            homography = H
-        else:
-            pass
-    return homography
-
-
-def find_homography_manual(img, template, img_pts):
-    template_pts = get_corners(template)
-    homography = None
-    for template_corners in list(itertools.permutations(template_pts)):
-        H, _ = cv2.findHomography(img_pts, numpy.asarray(template_corners))
+def find_homography_manual(img, template, img_pts, allow_mirrored=False):
+    img_pts = budgetpiano.homography.get_quadrilateral(img_pts)
+    template_pts = budgetpiano.homography.get_corners(template)
+    if not allow_mirrored:
+        img_pts = budgetpiano.homography.get_same_winding(img_pts, template_pts)
+    for template_corners in budgetpiano.homography.get_corner_orderings(template_pts, allow_mirrored):
+        H, _ = cv2.findHomography(img_pts, numpy.asarray(template_corners, numpy.float32))
+        if H is None:
+            continue
         warped_img = cv2.warpPerspective(img, H, (template.shape[1], template.shape[0]))
         if budgetpiano.gui.ask_image_question(warped_img):
-            return homography
+            return H
     raise ValueError("No template match good enough")
 
 
-def cost_function(params, *args):
-    homography = params.reshape((3, 3))
-    source = args[0]
-    cost = 0.0
-    for template in args[1:]:
-        destination = cv2.warpPerspective(source, homography, (template.shape[1], template.shape[0]))
-        if numpy.allclose(destination, 0) or numpy.allclose(template, 0):
-            cost += 2.0
-        else:
-            cosine_similarity = numpy.dot(
-                destination.astype(float).ravel() / numpy.linalg.norm(destination.astype(float)),
-                template.astype(float).ravel() / numpy.linalg.norm(template.astype(float)),
-            )
-            dissimilarity_measure = (2.0 - (1.0 + cosine_similarity)) / 2.0
-            cost += dissimilarity_measure
-    return cost
-
-
-def main(video_source, midi_port):
-    instrument_template = None
-    while instrument_template is None:
-        instrument_template = budgetpiano.gui.ask_for_piano_image()
-    instrument_templates = [instrument_template]
+def main(
+    video_source,
+    midi_port,
+    queue_size=4,
+    overflow_policy=budgetpiano.capture.DROP_OLDEST,
+    stabilizer_backend="sift",
+    feature_cache=None,
+    target_latency=0.1,
+    session_path=None,
+    auto_localize=True,
+):
+    # A saved session replaces the dialogs as long as it still fits the first frame.
+    session = None if session_path is None else budgetpiano.session.load_session(session_path)
+    if session is not None:
+        instrument_template, instrument_layout = session.template, session.layout
+    else:
+        instrument_template = None
+        while instrument_template is None:
+            instrument_template, instrument_layout = budgetpiano.gui.ask_for_piano()
+    template_pyramid = budgetpiano.refinement.build_template_pyramid(instrument_template, instrument_layout)
     instrument_homography = None
+    homography_tracker = None
     video_stabilizer = None
+    press_detector = budgetpiano.press.PressDetector(instrument_layout)
+    instrument_size = (instrument_template.shape[1], instrument_template.shape[0])
+    # Scratch arrays of the frame loop are reused from frame to frame, so that it stops allocating after warmup.
+    buffer_pool = budgetpiano.buffers.BufferPool()
+    scheduler = budgetpiano.scheduler.LatencyScheduler(target_latency)
 
     with video_capture(video_source) as cap:
-        target_fps = 2.0
-        video_fps = cap.get(cv2.CAP_PROP_FPS)
-        frame_skip = round(video_fps / target_fps)
+        refinement_time_budget = 0.02
+        stats_interval = 5.0
 
-        nof_history_frames = int(cap.get(cv2.CAP_PROP_FPS) * 10.0)
+        # Some sources, e.g. many webcams, report 0 fps.
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        nof_history_frames = int(fps * 10.0)
         with managed_resource(
             cv2.createBackgroundSubtractorMOG2(history=nof_history_frames, detectShadows=False)
-        ) as bg_model:
-            while cap.isOpened():
-                if cap.grab():
-                    frame_no = cap.get(cv2.CAP_PROP_POS_FRAMES)
-                    if frame_no % frame_skip != 0:
-                        continue
-                else:
-                    break
-                ret, frame = cap.read()
-                if not ret:
+        ) as bg_model, contextlib.ExitStack() as exit_stack, budgetpiano.capture.threaded_capture(
+            cap, queue_size, overflow_policy, recycle_images=True
+        ) as capture:
+            midi = None
+            if midi_port:
+                port = exit_stack.enter_context(open_midi_port(midi_port))
+                midi = exit_stack.enter_context(budgetpiano.midi_output.midi_output(port))
+            if session_path is not None:
+
+                def save_final_session():
+                    # Saved again on the way out, with the learned background so that the next session skips most
+                    # of the background model's warmup.
+                    if homography_tracker is not None:
+                        save_session(
+                            session_path,
+                            instrument_template,
+                            instrument_layout,
+                            homography_tracker,
+                            video_stabilizer,
+                            bg_model.getBackgroundImage(),
+                        )
+
+                exit_stack.callback(save_final_session)
+            if session is not None and session.background is not None:
+                if session.background.shape[:2] == instrument_template.shape[:2]:
+                    bg_model.apply(session.background, learningRate=1.0)
+            last_stats_time = time.monotonic()
+            last_dropped_frames = 0
+            while True:
+                with budgetpiano.instrumentation.span("wait_for_frame"):
+                    captured_frame = capture.get_latest()
+                if captured_frame is None:
                     break
+                frame = captured_frame.image
+
+                if time.monotonic() - last_stats_time >= stats_interval:
+                    last_stats_time = time.monotonic()
+                    stats = capture.get_stats()
+                    logger.info(
+                        "decode %(decode_fps).1f fps, processed %(processed_fps).1f fps, dropped %(dropped_frames)d",
+                        stats,
+                    )
+                    if homography_tracker is not None:
+                        logger.info(
+                            "homography predicted %(predicted_frames)d, refined %(refined_frames)d frames",
+                            homography_tracker.get_stats(),
+                        )
+                    logger.info(
+                        "scheduler level %(level)d, latency %(latency_ms).1f ms, refresh every %(refresh_interval)d"
+                        " frames, scale %(working_scale).2f, min frame interval %(min_frame_interval_ms).0f ms",
+                        scheduler.get_stats(),
+                    )
+                    logger.info(
+                        "buffer pool %(bytes)d bytes in %(buffers)d buffers, %(allocations)d allocations,"
+                        " %(steady_frames)d of %(frames)d frames without",
+                        buffer_pool.get_stats(),
+                    )
+                    if budgetpiano.instrumentation.tracer.enabled:
+                        logger.info("\n%s", budgetpiano.instrumentation.tracer.get_summary())
+                if capture.ring.nof_dropped > last_dropped_frames:
+                    budgetpiano.instrumentation.count("dropped_frames", capture.ring.nof_dropped - last_dropped_frames)
+                    last_dropped_frames = capture.ring.nof_dropped
+
+                if not scheduler.should_process(captured_frame.timestamp):
+                    continue
+                settings = scheduler.settings
+                capture.mark_processed()
+                # Grayscale and pyramids of the frame are computed by the first stage that needs them and shared
+                # with the stages after it.
+                frame_context = budgetpiano.frame_context.FrameContext(frame, buffer_pool)
 
                 if video_stabilizer is None:
-                    video_stabilizer = budgetpiano.matcher.VideoStabilizer()
+                    video_stabilizer = budgetpiano.matcher.VideoStabilizer(stabilizer_backend, buffer_pool=buffer_pool)
+                    if session is not None and session.keyframe is not None:
+                        if session.stabilizer_backend == stabilizer_backend:
+                            video_stabilizer.set_keyframe(**session.keyframe)
+                video_stabilizer.scale = settings.working_scale
 
-                stabilization_homography = video_stabilizer.get_homography(frame)
-                if stabilization_homography is not None:
-                    unstable_frame = frame
-                    frame = cv2.warpPerspective(
-                        unstable_frame, stabilization_homography, (frame.shape[1], frame.shape[0])
-                    )
+                with scheduler.measure("stabilization"):
+                    stabilization_homography = video_stabilizer.get_homography(frame_context)
+                budgetpiano.instrumentation.gauge("tracked_points", video_stabilizer.nof_tracked_points)
+                if stabilization_homography is None:
+                    stabilization_homography = numpy.eye(3)
 
-                if instrument_homography is None:
+                is_calibrating = instrument_homography is None
+                if is_calibrating and session is not None:
+                    with budgetpiano.instrumentation.span("verify_session"):
+                        instrument_homography = budgetpiano.session.verify_session(
+                            session, frame_context, stabilization_homography
+                        )
+                    session = None
+                if instrument_homography is None and auto_localize:
+                    with budgetpiano.instrumentation.span("localize_keyboard"):
+                        localized_homography = budgetpiano.localization.localize_keyboard(
+                            frame_context, instrument_template, instrument_layout, feature_cache=feature_cache
+                        )
+                    if localized_homography is not None:
+                        instrument_homography = localized_homography @ numpy.linalg.inv(stabilization_homography)
+                    else:
+                        logger.info("Keyboard not found automatically, select its corners instead.")
+                while instrument_homography is None:
                     manual_polygon = budgetpiano.gui.ask_for_polygon(frame, "Select Piano polygon.")
-                    manual_homography = find_homography(frame, instrument_template, manual_polygon)
-                    manual_instrument = cv2.warpPerspective(
-                        frame, manual_homography, (instrument_template.shape[1], instrument_template.shape[0])
+                    try:
+                        with budgetpiano.instrumentation.span("find_homography"):
+                            manual_homography = budgetpiano.homography.find_homography(
+                                frame, instrument_template, manual_polygon
+                            )
+                    except ValueError as error:
+                        logger.warning("%s, select the four corners of the piano again.", error)
+                        continue
+                    # The instrument homography is kept in stabilized coordinates.
+                    instrument_homography = manual_homography @ numpy.linalg.inv(stabilization_homography)
+                if homography_tracker is None:
+                    homography_tracker = budgetpiano.tracking.HomographyTracker(
+                        instrument_template,
+                        instrument_layout,
+                        template_pyramid,
+                        time_budget=refinement_time_budget,
+                        buffer_pool=buffer_pool,
                     )
-                    # instrument_templates.append(manual_instrument)
-                    instrument_homography = manual_homography
-
-                max_scale_factor = max(frame.shape[:-1]) / min(instrument_template.shape[:-1])
-                bounds = [(-max_scale_factor, max_scale_factor)] * 8 + [(1, 1)]
-                result = scipy.optimize.minimize(
-                    cost_function, x0=instrument_homography.ravel(), bounds=bounds, args=(frame, *instrument_templates)
-                )
+                    homography_tracker.reset(instrument_homography)
 
-                instrument_homography = result.x.reshape((3, 3))
-                instrument_image = cv2.warpPerspective(
-                    frame, instrument_homography, (instrument_template.shape[1], instrument_template.shape[0])
-                )
+                # The raw frame is never stabilized as a whole: tracking looks at a crop around the keyboard, and a
+                # single warp composed of both homographies takes the raw frame straight into template space.
+                homography_tracker.refresh_interval = settings.refresh_interval
+                with scheduler.measure("homography_tracking"):
+                    x, y, width, height = budgetpiano.tracking.get_roi(
+                        instrument_size, instrument_homography @ stabilization_homography, frame.shape
+                    )
+                    crop_homography = stabilization_homography @ budgetpiano.tracking.get_translation(x, y)
+                    # Refinement only runs when the predicted homography stops matching the template.
+                    instrument_homography = homography_tracker.update(
+                        frame_context.crop(x, y, width, height), crop_homography
+                    )
+                with scheduler.measure("instrument_warp"):
+                    instrument_image = cv2.warpPerspective(
+                        frame,
+                        instrument_homography @ stabilization_homography,
+                        instrument_size,
+                        dst=buffer_pool.get("instrument_image", (*instrument_template.shape[:2], *frame.shape[2:])),
+                    )
+                if is_calibrating and session_path is not None:
+                    save_session(
+                        session_path, instrument_template, instrument_layout, homography_tracker, video_stabilizer
+                    )
 
                 # detect fingers
 
-                foreground = bg_model.apply(instrument_image)
-                background = bg_model.getBackgroundImage()
-                pass
+                with scheduler.measure("foreground"):
+                    foreground = bg_model.apply(
+                        instrument_image, buffer_pool.get("foreground", instrument_image.shape[:2])
+                    )
+                with scheduler.measure("press_detection"):
+                    note_ons, note_offs = press_detector.update(foreground)
 
                 # if finger points at key of piano, send midi event
-                if midi_port:
-                    with open_midi_port(midi_port) as port:
-                        port.send(mido.Message("note_on", note=60, velocity=64))
-                        port.send(mido.Message("note_off", note=60))
+                if midi is not None:
+                    with scheduler.measure("midi"):
+                        midi.send_frame(captured_frame.timestamp, note_ons, note_offs)
+
+                buffer_pool.finish_frame()
+                if is_calibrating:
+                    # Time spent in the corner selection dialog says nothing about the pipeline's cost.
+                    scheduler.discard_frame()
+                else:
+                    scheduler.finish_frame(captured_frame.timestamp)
+
+
+def main_processes(
+    video_source,
+    midi_port,
+    queue_size=8,
+    overflow_policy=budgetpiano.capture.DROP_NEWEST,
+    stabilizer_backend="sift",
+    feature_cache=None,
+    auto_localize=True,
+):
+    # Capture, stabilization, refinement and press detection each run in a worker process; this process only does
+    # the calibration up front and sends MIDI.
+    instrument_template = None
+    while instrument_template is None:
+        instrument_template, instrument_layout = budgetpiano.gui.ask_for_piano()
+
+    with video_capture(video_source) as cap:
+        ret, frame = cap.read()
+        if not ret:
+            raise ValueError(f"Could not read a frame from {video_source}")
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    instrument_homography = None
+    if auto_localize:
+        instrument_homography = budgetpiano.localization.localize_keyboard(
+            frame, instrument_template, instrument_layout, feature_cache=feature_cache
+        )
+        if instrument_homography is None:
+            logger.info("Keyboard not found automatically, select its corners instead.")
+    while instrument_homography is None:
+        manual_polygon = budgetpiano.gui.ask_for_polygon(frame, "Select Piano polygon.")
+        try:
+            instrument_homography = budgetpiano.homography.find_homography(frame, instrument_template, manual_polygon)
+        except ValueError as error:
+            logger.warning("%s, select the four corners of the piano again.", error)
+
+    stats_interval = 5.0
+    with contextlib.ExitStack() as midi_stack, budgetpiano.processes.process_pipeline(
+        video_source,
+        frame.shape,
+        instrument_template,
+        instrument_layout,
+        instrument_homography,
+        nof_slots=queue_size,
+        policy=overflow_policy,
+        stabilizer_backend=stabilizer_backend,
+        nof_history_frames=int(fps * 10.0),
+    ) as pipeline:
+        midi = None
+        if midi_port:
+            port = midi_stack.enter_context(open_midi_port(midi_port))
+            midi = midi_stack.enter_context(budgetpiano.midi_output.midi_output(port))
+        last_stats_time = time.monotonic()
+        for result in pipeline.get_results():
+            if midi is not None:
+                midi.send_frame(result.timestamp, result.note_ons, result.note_offs)
+            if time.monotonic() - last_stats_time >= stats_interval:
+                last_stats_time = time.monotonic()
+                logger.info(
+                    "processed %(processed_frames)d frames, %(processed_fps).1f fps, dropped %(dropped_frames)d",
+                    pipeline.get_stats(),
+                )
+
+
+def main_instruments(
+    video_source,
+    midi_port,
+    nof_instruments=2,
+    queue_size=4,
+    overflow_policy=budgetpiano.capture.DROP_OLDEST,
+    stabilizer_backend="sift",
+    feature_cache=None,
+    target_latency=0.1,
+    max_workers=None,
+    auto_localize=True,
+):
+    # Several keyboards in view of one camera: decoding and stabilization happen once per frame, while each
+    # instrument is tracked, warped and checked for presses on its own, in parallel, and plays on its own channel.
+    instrument_templates = []
+    for _ in range(nof_instruments):
+        instrument_template = None
+        while instrument_template is None:
+            instrument_template, instrument_layout = budgetpiano.gui.ask_for_piano()
+        instrument_templates.append((instrument_template, instrument_layout))
+    instruments = None
+    video_stabilizer = None
+    buffer_pool = budgetpiano.buffers.BufferPool()
+    scheduler = budgetpiano.scheduler.LatencyScheduler(target_latency)
+
+    with video_capture(video_source) as cap:
+        refinement_time_budget = 0.02
+        stats_interval = 5.0
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        nof_history_frames = int(fps * 10.0)
+        with contextlib.ExitStack() as exit_stack, budgetpiano.capture.threaded_capture(
+            cap, queue_size, overflow_policy, recycle_images=True
+        ) as capture, concurrent.futures.ThreadPoolExecutor(max_workers or nof_instruments) as executor:
+            port = None
+            if midi_port:
+                port = exit_stack.enter_context(open_midi_port(midi_port))
+            midi_outputs = None
+            last_stats_time = time.monotonic()
+            while True:
+                with budgetpiano.instrumentation.span("wait_for_frame"):
+                    captured_frame = capture.get_latest()
+                if captured_frame is None:
+                    break
+                frame = captured_frame.image
+
+                if time.monotonic() - last_stats_time >= stats_interval:
+                    last_stats_time = time.monotonic()
+                    logger.info(
+                        "decode %(decode_fps).1f fps, processed %(processed_fps).1f fps, dropped %(dropped_frames)d",
+                        capture.get_stats(),
+                    )
+                    logger.info("scheduler level %(level)d, latency %(latency_ms).1f ms", scheduler.get_stats())
+                    for instrument in instruments or []:
+                        logger.info(
+                            "instrument %(channel)d buffer pool %(bytes)d bytes in %(buffers)d buffers, %(allocations)d"
+                            " allocations, %(steady_frames)d of %(frames)d frames without",
+                            {"channel": instrument.channel + 1, **instrument.buffer_pool.get_stats()},
+                        )
+
+                if not scheduler.should_process(captured_frame.timestamp):
+                    continue
+                settings = scheduler.settings
+                capture.mark_processed()
+                # The stabilizer converts the frame to grayscale, which the instruments then crop from.
+                frame_context = budgetpiano.frame_context.FrameContext(frame, buffer_pool)
+
+                if video_stabilizer is None:
+                    video_stabilizer = budgetpiano.matcher.VideoStabilizer(stabilizer_backend, buffer_pool=buffer_pool)
+                video_stabilizer.scale = settings.working_scale
+                with scheduler.measure("stabilization"):
+                    stabilization_homography = video_stabilizer.get_homography(frame_context)
+                if stabilization_homography is None:
+                    stabilization_homography = numpy.eye(3)
+
+                is_calibrating = instruments is None
+                if is_calibrating:
+                    instruments = []
+                    # Keyboards that have been found are painted over, so that the next search finds another one.
+                    search_frame = frame.copy()
+                    for channel, (instrument_template, instrument_layout) in enumerate(instrument_templates):
+                        frame_homography = None
+                        if auto_localize:
+                            with budgetpiano.instrumentation.span("localize_keyboard"):
+                                frame_homography = budgetpiano.localization.localize_keyboard(
+                                    search_frame, instrument_template, instrument_layout, feature_cache=feature_cache
+                                )
+                            if frame_homography is not None:
+                                corners = cv2.perspectiveTransform(
+                                    numpy.float32([budgetpiano.homography.get_corners(instrument_template)]),
+                                    numpy.linalg.inv(frame_homography),
+                                )
+                                cv2.fillConvexPoly(search_frame, numpy.int32(corners[0]), cv2.mean(frame)[:3])
+                            else:
+                                logger.info(
+                                    "Keyboard %d not found automatically, select its corners instead.", channel + 1
+                                )
+                        while frame_homography is None:
+                            manual_polygon = budgetpiano.gui.ask_for_polygon(
+                                frame, f"Select polygon of piano {channel + 1}."
+                            )
+                            try:
+                                frame_homography = budgetpiano.homography.find_homography(
+                                    frame, instrument_template, manual_polygon
+                                )
+                            except ValueError as error:
+                                logger.warning("%s, select the four corners of the piano again.", error)
+                        instruments.append(
+                            budgetpiano.instrument.Instrument(
+                                instrument_template,
+                                instrument_layout,
+                                frame_homography @ numpy.linalg.inv(stabilization_homography),
+                                channel=channel,
+                                nof_history_frames=nof_history_frames,
+                                refinement_time_budget=refinement_time_budget,
+                            )
+                        )
+                    if port is not None:
+                        midi_outputs = [
+                            exit_stack.enter_context(
+                                budgetpiano.midi_output.midi_output(port, channel=instrument.channel)
+                            )
+                            for instrument in instruments
+                        ]
+
+                with scheduler.measure("instruments"):
+                    for instrument in instruments:
+                        instrument.homography_tracker.refresh_interval = settings.refresh_interval
+                    presses = list(
+                        executor.map(
+                            lambda instrument: instrument.update(frame_context, stabilization_homography), instruments
+                        )
+                    )
+                # The instruments are tracked side by side, so the slowest one is what the frame waits for.
+                scheduler.add_cost("homography_tracking", max(instrument.tracking_time for instrument in instruments))
+
+                if midi_outputs is not None:
+                    with scheduler.measure("midi"):
+                        for midi, (note_ons, note_offs) in zip(midi_outputs, presses):
+                            midi.send_frame(captured_frame.timestamp, note_ons, note_offs)
+
+                buffer_pool.finish_frame()
+                if is_calibrating:
+                    scheduler.discard_frame()
+                else:
+                    scheduler.finish_frame(captured_frame.timestamp)
+
+
+def save_session(
+    session_path, instrument_template, instrument_layout, homography_tracker, video_stabilizer, background=None
+):
+    budgetpiano.session.save_session(
+        session_path,
+        budgetpiano.session.Session(
+            instrument_template,
+            instrument_layout,
+            homography_tracker.homography,
+            homography_tracker.reference_residual,
+            video_stabilizer.backend_name,
+            video_stabilizer.get_keyframe(),
+            background,
+        ),
+    )
+    logger.info("Session saved to %s", session_path)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument("--video-source", type=str, help="Inumpyut source for video capture")
+    parser.add_argument("--queue-size", type=int, default=4, help="Number of decoded frames buffered ahead")
+    parser.add_argument(
+        "--overflow-policy",
+        choices=budgetpiano.capture.OVERFLOW_POLICIES,
+        default=budgetpiano.capture.DROP_OLDEST,
+        help="What the capture thread does when the frame buffer is full",
+    )
+    parser.add_argument(
+        "--stabilizer",
+        choices=list(budgetpiano.matcher.STABILIZER_BACKENDS),
+        default="sift",
+        help="Feature tracking backend used for video stabilization",
+    )
+    parser.add_argument(
+        "--no-feature-cache", action="store_true", help="Do not cache keypoints of the keyboard template"
+    )
+    parser.add_argument("--feature-cache-dir", type=str, default=None, help="Directory for cached keypoints")
+    parser.add_argument(
+        "--trace", type=str, default=None, help="Record per-stage timings and write a Chrome trace here"
+    )
+    parser.add_argument(
+        "--target-latency", type=float, default=0.1, help="End-to-end latency in seconds the scheduler aims for"
+    )
+    parser.add_argument(
+        "--processes",
+        action="store_true",
+        help="Run capture, stabilization, refinement and press detection in separate worker processes",
+    )
+    parser.add_argument(
+        "--session",
+        type=str,
+        default=None,
+        help="Calibration snapshot to start from if it still fits the video, and to save the calibration to",
+    )
+    parser.add_argument(
+        "--no-auto-localization",
+        action="store_true",
+        help="Always select the keyboard corners by hand instead of looking for the keyboard first",
+    )
+    parser.add_argument(
+        "--instruments",
+        type=int,
+        default=1,
+        help="Number of keyboards in view; each is tracked separately and plays on its own MIDI channel",
+    )
+    parser.add_argument("--midi-port", type=str, default=None, help="MIDI output port name, see mido.get_output_names")
     args = parser.parse_args()
+    if args.instruments > 1 and args.processes:
+        parser.error("--instruments is not supported with --processes")
+    if args.session is not None and (args.processes or args.instruments > 1):
+        parser.error("--session is only supported with a single instrument in a single process")
+    logging.basicConfig(level=logging.INFO)
     # midi_port = get_midi_port()
-    midi_port = None
-    main(args.video_source, midi_port)
+    midi_port = args.midi_port
+    feature_cache = budgetpiano.feature_cache.FeatureCache(args.feature_cache_dir, enabled=not args.no_feature_cache)
+    budgetpiano.instrumentation.enable(args.trace is not None)
+    try:
+        if args.instruments > 1:
+            main_instruments(
+                args.video_source,
+                midi_port,
+                args.instruments,
+                args.queue_size,
+                args.overflow_policy,
+                args.stabilizer,
+                feature_cache,
+                args.target_latency,
+                auto_localize=not args.no_auto_localization,
+            )
+        elif args.processes:
+            # Frames already handed to a worker cannot be dropped, so the newest frame is skipped instead.
+            overflow_policy = args.overflow_policy
+            if overflow_policy == budgetpiano.capture.DROP_OLDEST:
+                overflow_policy = budgetpiano.capture.DROP_NEWEST
+            main_processes(
+                args.video_source,
+                midi_port,
+                args.queue_size,
+                overflow_policy,
+                args.stabilizer,
+                feature_cache,
+                not args.no_auto_localization,
+            )
+        else:
+            main(
+                args.video_source,
+                midi_port,
+                args.queue_size,
+                args.overflow_policy,
+                args.stabilizer,
+                feature_cache,
+                args.target_latency,
+                args.session,
+                not args.no_auto_localization,
+            )
+    finally:
+        if args.trace is not None:
+            budgetpiano.instrumentation.tracer.export_chrome_trace(args.trace)
+            logger.info("\n%s", budgetpiano.instrumentation.tracer.get_summary())
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import pathlib
+import tempfile
+import zipfile
+
+import cv2
+import numpy
+
+KEYPOINT_FIELDS = ["x", "y", "size", "angle", "response", "octave", "class_id"]
+
+
+def get_default_directory():
+    cache_home = os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache"
+    return pathlib.Path(cache_home) / "budgetpiano" / "features"
+
+
+def keypoints_to_array(keypoints):
+    return numpy.float32(
+        [(kp.pt[0], kp.pt[1], kp.size, kp.angle, kp.response, kp.octave, kp.class_id) for kp in keypoints]
+    ).reshape(-1, len(KEYPOINT_FIELDS))
+
+
+def array_to_keypoints(array):
+    return tuple(
+        cv2.KeyPoint(x, y, size, angle, response, int(octave), int(class_id))
+        for x, y, size, angle, response, octave, class_id in array.tolist()
+    )
+
+
+class FeatureCache:
+    def __init__(self, directory=None, max_bytes=256 * 1024 * 1024, enabled=True):
+        self.directory = pathlib.Path(directory) if directory is not None else get_default_directory()
+        self.max_bytes = max_bytes
+        self.enabled = enabled and os.environ.get("BUDGETPIANO_FEATURE_CACHE", "1") != "0"
+
+    def get_key(self, image, detector_name, parameters):
+        digest = hashlib.sha256()
+        digest.update(json.dumps([detector_name, parameters, image.shape, str(image.dtype)], sort_keys=True).encode())
+        digest.update(numpy.ascontiguousarray(image).data)
+        return digest.hexdigest()
+
+    def get_path(self, key):
+        return self.directory / f"{key}.npz"
+
+    def load(self, key):
+        path = self.get_path(key)
+        try:
+            with numpy.load(path) as data:
+                keypoints = array_to_keypoints(data["keypoints"])
+                descriptors = data["descriptors"] if data["descriptors"].size else None
+            os.utime(path)
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            return None
+        return keypoints, descriptors
+
+    def store(self, key, keypoints, descriptors):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        descriptors = numpy.empty((0,), numpy.uint8) if descriptors is None else descriptors
+        fd, temporary_path = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as file:
+                numpy.savez(file, keypoints=keypoints_to_array(keypoints), descriptors=descriptors)
+            os.replace(temporary_path, self.get_path(key))
+        except BaseException:
+            pathlib.Path(temporary_path).unlink(missing_ok=True)
+            raise
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for path in self.directory.glob("*.npz"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total_bytes -= size
+
+    def get_or_compute(self, image, detector_name, parameters, compute):
+        if not self.enabled:
+            return compute(image)
+        key = self.get_key(image, detector_name, parameters)
+        cached = self.load(key)
+        if cached is not None:
+            return cached
+        keypoints, descriptors = compute(image)
+        try:
+            self.store(key, keypoints, descriptors)
+        except OSError:
+            pass
+        return keypoints, descriptors
@@ -0,0 +1,83 @@
+import cv2
+import numpy
+
+
+class FrameContext:
+    # Images derived from one frame, computed the first time a stage asks for them and shared by the stages after
+    # it. With a buffer pool they are written into its buffers, so a context is only valid until the next frame.
+    def __init__(self, image, buffer_pool=None, name="frame"):
+        self.image = image
+        self.buffer_pool = buffer_pool
+        self.name = name
+        self._gray = None
+        self._gray_float = None
+        self._scaled_grays = dict()
+        self._pyramid = None
+
+    @property
+    def shape(self):
+        return self.image.shape
+
+    def _get_buffer(self, suffix, shape, dtype=numpy.uint8):
+        if self.buffer_pool is None:
+            return None
+        return self.buffer_pool.get(f"{self.name}_{suffix}", shape, dtype)
+
+    @property
+    def gray(self):
+        if self._gray is None:
+            if self.image.ndim == 3:
+                dst = self._get_buffer("gray", self.image.shape[:2])
+                self._gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY, dst=dst)
+            else:
+                self._gray = self.image
+        return self._gray
+
+    @property
+    def gray_float(self):
+        if self._gray_float is None:
+            dst = self._get_buffer("gray_float", self.gray.shape, numpy.float32)
+            if dst is None:
+                self._gray_float = self.gray.astype(numpy.float32)
+            else:
+                numpy.copyto(dst, self.gray)
+                self._gray_float = dst
+        return self._gray_float
+
+    def get_scaled_gray(self, scale):
+        if scale == 1.0:
+            return self.gray
+        scaled = self._scaled_grays.get(scale)
+        if scaled is None:
+            size = (int(round(self.gray.shape[1] * scale)), int(round(self.gray.shape[0] * scale)))
+            dst = self._get_buffer(f"gray_{scale:g}", (size[1], size[0]))
+            scaled = cv2.resize(self.gray, size, dst=dst, interpolation=cv2.INTER_AREA)
+            self._scaled_grays[scale] = scaled
+        return scaled
+
+    def get_pyramid(self, nof_levels, min_size=16):
+        # Float grayscale levels, each half the size of the one before, as ECC refinement uses them. Levels are only
+        # added when a stage asks for more than have been built.
+        if self._pyramid is None:
+            self._pyramid = [self.gray_float]
+        while len(self._pyramid) < nof_levels and min(self._pyramid[-1].shape[:2]) >= 2 * min_size:
+            height, width = self._pyramid[-1].shape[:2]
+            dst = self._get_buffer(
+                f"pyramid_{len(self._pyramid)}", ((height + 1) // 2, (width + 1) // 2), numpy.float32
+            )
+            self._pyramid.append(cv2.pyrDown(self._pyramid[-1], dst=dst))
+        return self._pyramid[:nof_levels]
+
+    def crop(self, x, y, width, height, buffer_pool=None):
+        # The grayscale of a crop is a view of the frame's, so the frame is converted once however many stages crop.
+        # Crops that are worked on from other threads need a buffer pool of their own.
+        buffer_pool = self.buffer_pool if buffer_pool is None else buffer_pool
+        context = FrameContext(self.image[y : y + height, x : x + width], buffer_pool, f"{self.name}_crop")
+        context._gray = self.gray[y : y + height, x : x + width]
+        return context
+
+
+def as_frame_context(image, buffer_pool=None, name="frame"):
+    if isinstance(image, FrameContext):
+        return image
+    return FrameContext(image, buffer_pool, name)
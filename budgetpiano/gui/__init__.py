@@ -1,5 +1,5 @@
 from budgetpiano.gui.image import ask_for_image
 from budgetpiano.gui.midi import ask_for_midi_port
-from budgetpiano.gui.piano import ask_for_piano_image
+from budgetpiano.gui.piano import ask_for_piano, ask_for_piano_image
 from budgetpiano.gui.polygon import ask_for_polygon
-from budgetpiano.gui.image_question import ask_image_question
\ No newline at end of file
+from budgetpiano.gui.image_question import ask_image_question
@@ -1,119 +1,20 @@
 import cv2
-import numpy
-import math
 import tkinter.ttk as tkinter
 import tkinter.simpledialog
 import tkinter.colorchooser
 import PIL, PIL.Image, PIL.ImageTk
 
-
-def _draw_keys(*, left, top, width, height, scale, image, fill_color, border_color, border_thickness):
-    start = (int(scale * left), int(scale * top))
-    end = (start[0] + int(scale * width), start[1] + int(scale * height))
-    cv2.rectangle(image, start, end, fill_color, cv2.FILLED)
-    cv2.rectangle(image, start, end, border_color, border_thickness)
-
-
-def _get_piano(
-    white_key_width_px: int = 10,
-    nof_keys: int = 88,
-    start_key_pitchclass: int = 9,
-    white_key_color=(255, 255, 255),
-    black_key_color=(0, 0, 0),
-    red_velvet_color=(0, 0, 77),
-    border_color=(128, 128, 128),
-    background_color=(128, 128, 128),
-):
-    red_velvet_height = 0.2
-    white_key_width = 2.25
-    white_key_height = 14.6
-    white_key_narrow_space = 0.1
-    white_key_large_space = 0.125
-    black_key_width = 1.40
-    black_key_height = 9.8
-    black_key_offsets = [1.3, 1.8, 1.2, 1.6, 1.9]
-
-    white_key_starts = []
-    black_key_starts = []
-    white_key_pitchclasses = [0, 2, 4, 5, 7, 9, 11]
-    P1 = white_key_pitchclasses[0]
-    M2 = white_key_pitchclasses[1]
-    M3 = white_key_pitchclasses[2]
-    P4 = white_key_pitchclasses[3]
-    P5 = white_key_pitchclasses[4]
-    M6 = white_key_pitchclasses[5]
-    M7 = white_key_pitchclasses[6]
-    wide_space_before_pitchclass = [P1, P4]
-    black_key_pitchclasses = [P1 + 1, M2 + 1, P4 + 1, P5 + 1, M6 + 1]
-
-    white_key_start_offset = 0.0
-    for key_no in range(nof_keys):
-        key_pitchclass = (start_key_pitchclass + key_no) % 12
-        if key_pitchclass in white_key_pitchclasses:
-            space_after = (
-                white_key_large_space if key_pitchclass in wide_space_before_pitchclass else white_key_narrow_space
-            )
-            if len(white_key_starts) > 0:
-                white_key_starts.append(white_key_starts[-1] + white_key_width + space_after)
-            else:
-                white_key_starts.append(white_key_start_offset)
-        else:
-            black_key_offset = black_key_offsets[black_key_pitchclasses.index(key_pitchclass)]
-            if len(white_key_starts) > 0:
-                black_key_starts.append(white_key_starts[-1] + black_key_offset)
-            else:
-                black_key_starts.append(black_key_offset)
-                white_key_start_offset = white_key_width + white_key_narrow_space
-
-    width = 0.0
-    if len(white_key_starts) > 0:
-        width = max(width, white_key_starts[-1] + white_key_width)
-    if len(black_key_starts) > 0:
-        width = max(width, black_key_starts[-1] + black_key_width)
-    height = white_key_height + red_velvet_height
-
-    scale = white_key_width_px / white_key_width
-
-    image = numpy.ndarray((max(1, math.ceil(scale * height)), max(1, math.ceil(scale * width)), 3), numpy.uint8)
-    image[..., :] = background_color
-    width_px = image.shape[1]
-
-    cv2.rectangle(image, (0, 0), (width_px, int(scale * red_velvet_height)), red_velvet_color, cv2.FILLED)
-    for white_key_start in white_key_starts:
-        _draw_keys(
-            left=white_key_start,
-            top=red_velvet_height,
-            width=white_key_width,
-            height=white_key_height,
-            scale=scale,
-            fill_color=white_key_color,
-            image=image,
-            border_color=border_color,
-            border_thickness=1,
-        )
-        # TODO: the white keys are rounded at bottom
-
-    for black_key_start in black_key_starts:
-        _draw_keys(
-            left=black_key_start,
-            top=red_velvet_height,
-            width=black_key_width,
-            height=black_key_height,
-            scale=scale,
-            fill_color=black_key_color,
-            image=image,
-            border_color=border_color,
-            border_thickness=1,
-        )
-
-    return image
+from budgetpiano.piano import _get_piano, _get_piano_layout
 
 
 class PianoPicker(tkinter.simpledialog.Dialog):
+    update_delay_ms = 50
+
     def __init__(self, *, width: int, height: int, parent=None):
         self.width = width
         self.height = height
         self.image = None
+        self.layout = None
         if parent is None:
             self.parent = tkinter.Tk()
             self.parent.withdraw()
@@ -132,6 +33,7 @@ class PianoPicker(tkinter.simpledialog.Dialog):
     def body(self, master):
         self.image_tk = None
         self.image_tk_id = None
+        self.update_id = None
 
         # Set up left part of the window to display the image
         self.canvas_frame = tkinter.Frame(master, width=int(self.width * 0.8), height=self.height)
@@ -226,19 +128,46 @@ class PianoPicker(tkinter.simpledialog.Dialog):
         self.start_key_pitchclass_slider.set(start_key_pitchclass)
 
     def apply(self):
-        self.result = self.image
-
-    def _update_image(self, *args, **kwargs):
-        self.image = _get_piano(
+        # Only the accepted template is rendered at full resolution.
+        self.image, self.layout = _get_piano(
             self.width_slider.get(),
             self.nof_keys_slider.get(),
             self.start_key_pitchclass_slider.get(),
             **self.bgr_colors,
+            return_layout=True,
         )
+        self.result = self.image
+
+    def destroy(self):
+        if self.update_id is not None:
+            self.after_cancel(self.update_id)
+            self.update_id = None
+        super().destroy()
+
+    def _update_image(self, *args, **kwargs):
+        # Slider ticks come in bursts while dragging; only the last one in a short quiet period is drawn.
+        if self.update_id is not None:
+            self.after_cancel(self.update_id)
+        self.update_id = self.after(self.update_delay_ms, self._draw_preview)
+
+    def _draw_preview(self):
+        self.update_id = None
+        white_key_width_px = self.width_slider.get()
+        nof_keys = self.nof_keys_slider.get()
+        start_key_pitchclass = self.start_key_pitchclass_slider.get()
+        # The preview is drawn with the widest keys that still fit the canvas, rather than scaling a full image down.
+        layout = _get_piano_layout(white_key_width_px, nof_keys, start_key_pitchclass, None)
+        # Before the dialog is mapped the canvas reports a width of 1, so fall back to the requested width.
+        canvas_width = self.canvas.winfo_width()
+        if canvas_width <= 1:
+            canvas_width = int(self.canvas.cget("width"))
+        if layout.width > canvas_width:
+            white_key_width_px = max(1, white_key_width_px * canvas_width // layout.width)
+        preview = _get_piano(white_key_width_px, nof_keys, start_key_pitchclass, **self.bgr_colors)
         self.image_tk = PIL.ImageTk.PhotoImage(
             PIL.Image.fromarray(
                 cv2.cvtColor(
-                    self.image,
+                    preview,
                     cv2.COLOR_BGR2RGB,
                 )
             ),
@@ -280,6 +209,13 @@ def ask_for_piano_image():
     return PianoPicker(width=800, height=600).result
 
 
+def ask_for_piano():
+    piano_picker = PianoPicker(width=800, height=600)
+    if piano_picker.result is None:
+        return None, None
+    return piano_picker.result, piano_picker.layout
+
+
 if __name__ == "__main__":
     image = ask_for_piano_image()
     pass
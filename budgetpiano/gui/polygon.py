@@ -1,13 +1,15 @@
-import copy
 import pathlib
 
 import numpy
 import cv2
 
 
-def ask_for_polygon(image: numpy.ndarray, window_title="Select a Polygon"):
+def ask_for_polygon(image: numpy.ndarray, window_title="Select a Polygon", max_display_size=(1280, 720), wait_ms=20):
     def _mouse_callback(event, x, y, flags, params):
         params["point"] = (x, y)
+        # Moving the mouse only changes the picture while the cross follows it.
+        if event != cv2.EVENT_MOUSEMOVE or params["is_selecting"]:
+            params["is_dirty"] = True
 
         if flags & cv2.EVENT_FLAG_CTRLKEY:
             params["is_deleting"] = True
@@ -28,32 +30,53 @@ def ask_for_polygon(image: numpy.ndarray, window_title="Select a Polygon"):
                 return
 
     try:
-        params = {"is_deleting": False, "is_selecting": False, "is_finished": False, "points": [], "point": [0, 0]}
+        # Everything is drawn on a copy at display resolution; the clicked points are mapped back on return.
+        height, width = image.shape[:2]
+        scale = min(1.0, max_display_size[0] / width, max_display_size[1] / height)
+        if scale < 1.0:
+            display_image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        else:
+            display_image = image
+        image_with_overlay = numpy.empty_like(display_image)
+        polygon_overlay = numpy.empty_like(display_image)
+
+        params = {
+            "is_deleting": False,
+            "is_selecting": False,
+            "is_finished": False,
+            "is_dirty": True,
+            "points": [],
+            "point": [0, 0],
+        }
         window_name = "PolygonSelector"
         cv2.namedWindow(window_name)
         cv2.setWindowTitle(window_name, window_title)
         cv2.setMouseCallback(window_name, _mouse_callback, params)
-        cv2.imshow(window_name, image)
+        cv2.imshow(window_name, display_image)
         while cv2.getWindowProperty(window_name, cv2.WND_PROP_VISIBLE) >= 1:
+            if params["is_dirty"]:
+                # Only redrawn after a mouse event changed something.
+                params["is_dirty"] = False
+                numpy.copyto(image_with_overlay, display_image)
+                color = (0, 255, 0)
+                line_points = list(params["points"])
+                if params["is_selecting"]:
+                    cv2.drawMarker(image_with_overlay, params["point"], color, cv2.MARKER_CROSS, 10, 2)
+                    line_points.append(params["point"])
+
+                if len(line_points) < 3:
+                    cv2.polylines(image_with_overlay, [numpy.asarray(line_points, numpy.int32)], True, color, 2)
+                else:
+                    numpy.copyto(polygon_overlay, display_image)
+                    cv2.fillPoly(polygon_overlay, [numpy.asarray(line_points, numpy.int32)], color)
+                    opacity = 0.5
+                    cv2.addWeighted(
+                        polygon_overlay, opacity, image_with_overlay, 1 - opacity, 0, dst=image_with_overlay
+                    )
 
-            image_with_overlay = image.copy()
-            color = (0, 255, 0)
-            line_points = copy.deepcopy(params["points"])
-            if params["is_selecting"]:
-                cv2.drawMarker(image_with_overlay, params["point"], color, cv2.MARKER_CROSS, 10, 2)
-                line_points.append(params["point"])
-
-            if len(line_points) < 3:
-                cv2.polylines(image_with_overlay, [numpy.asarray(line_points, numpy.int32)], True, color, 2)
-            else:
-                polygon_overlay = image.copy()
-                cv2.fillPoly(polygon_overlay, [numpy.asarray(line_points, numpy.int32)], color)
-                opacity = 0.5
-                image_with_overlay = cv2.addWeighted(polygon_overlay, opacity, image_with_overlay, 1 - opacity, 0)
-
-            cv2.imshow(window_name, image_with_overlay)
-            cv2.waitKey(1)
+                cv2.imshow(window_name, image_with_overlay)
+            cv2.waitKey(wait_ms)
             if params["is_finished"]:
-                return numpy.asarray([p for p in params["points"]])
+                return numpy.asarray(params["points"], numpy.float64) / scale
     finally:
         cv2.destroyAllWindows()
@@ -0,0 +1,94 @@
+import concurrent.futures
+import logging
+
+import cv2
+import numpy
+
+import budgetpiano.refinement
+
+logger = logging.getLogger(__name__)
+
+
+def get_corners(image):
+    height, width = image.shape[:2]
+    corners = [[0, 0], [width, 0], [width, height], [0, height]]
+    return corners
+
+
+def get_corner_orderings(corners, allow_mirrored=True):
+    rotations = [corners[i:] + corners[:i] for i in range(len(corners))]
+    if not allow_mirrored:
+        return rotations
+    return rotations + [rotation[::-1] for rotation in rotations]
+
+
+def get_same_winding(points, reference_points):
+    is_positive = cv2.contourArea(points, oriented=True) > 0
+    is_reference_positive = cv2.contourArea(numpy.float32(reference_points), oriented=True) > 0
+    return points if is_positive == is_reference_positive else points[::-1].copy()
+
+
+def get_quadrilateral(points, min_area=1.0):
+    points = numpy.asarray(points, numpy.float32).reshape(-1, 2)
+    if len(points) != 4:
+        raise ValueError(f"Expected a polygon with 4 corners, got {len(points)}")
+    if not cv2.isContourConvex(points) or abs(cv2.contourArea(points)) < min_area:
+        raise ValueError("Polygon is not a convex quadrilateral")
+    return points
+
+
+def get_similarity(image, template, sigma=0.0):
+    image = budgetpiano.refinement.to_gray(image)
+    template = budgetpiano.refinement.to_gray(template)
+    if sigma > 0:
+        image = cv2.GaussianBlur(image, (0, 0), sigma)
+        template = cv2.GaussianBlur(template, (0, 0), sigma)
+    return float(cv2.matchTemplate(image, template, cv2.TM_CCOEFF_NORMED)[0, 0])
+
+
+def find_homography(
+    img, template, image_points, max_search_size=256, max_workers=None, allow_mirrored=False, search_sigma=1.0
+):
+    image_points = get_quadrilateral(image_points)
+    template_pts = get_corners(template)
+    if not allow_mirrored:
+        # A camera does not mirror the scene, so the corners can be clicked in either direction. Once the winding
+        # matches the template's, only the 4 rotations are left to try.
+        image_points = get_same_winding(image_points, template_pts)
+
+    scale = min(1.0, max_search_size / max(template.shape[:2]))
+    small_template = cv2.resize(template, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    small_size = (small_template.shape[1], small_template.shape[0])
+    scaling = numpy.diag([small_size[0] / template.shape[1], small_size[1] / template.shape[0], 1.0])
+
+    candidates = []
+    for template_corners in get_corner_orderings(template_pts, allow_mirrored):
+        H, _ = cv2.findHomography(image_points, numpy.asarray(template_corners, numpy.float32))
+        if H is not None and abs(numpy.linalg.det(H)) > 1e-12:
+            candidates.append(H)
+    if not candidates:
+        raise ValueError("No corner ordering gives a valid homography")
+
+    # Blurring makes the score tolerant to a few pixels of error in the clicked corners, which would otherwise
+    # shift the narrow keys out of phase with the template.
+    def _score(H):
+        return get_similarity(cv2.warpPerspective(img, scaling @ H, small_size), small_template, search_sigma)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        scores = list(executor.map(_score, candidates))
+    homography = candidates[int(numpy.argmax(scores))]
+
+    warped_img = cv2.warpPerspective(img, homography, (template.shape[1], template.shape[0]))
+    logger.info("Instrument homography found with similarity %.3f", get_similarity(warped_img, template))
+    return homography
+
+
+def cost_function(params, *args):
+    homography = params.reshape((3, 3))
+    source = args[0]
+    cost = 0.0
+    for template in args[1:]:
+        if not isinstance(template, budgetpiano.refinement.PreparedTemplate):
+            template = budgetpiano.refinement.PreparedTemplate(template)
+        cost += template.cost(source, homography)
+    return cost
@@ -0,0 +1,65 @@
+import time
+
+import cv2
+
+import budgetpiano.buffers
+import budgetpiano.frame_context
+import budgetpiano.press
+import budgetpiano.refinement
+import budgetpiano.tracking
+
+
+class Instrument:
+    # Everything that is tracked per keyboard: its template, homography in stabilized coordinates, background model
+    # and key state. Several instruments share the capture and stabilization of one camera.
+    def __init__(
+        self,
+        template,
+        layout,
+        instrument_homography,
+        channel=0,
+        nof_history_frames=300,
+        refinement_time_budget=0.02,
+    ):
+        self.template = template
+        self.layout = layout
+        self.channel = channel
+        self.size = (template.shape[1], template.shape[0])
+        template_pyramid = budgetpiano.refinement.build_template_pyramid(template, layout)
+        self.homography_tracker = budgetpiano.tracking.HomographyTracker(
+            template, layout, template_pyramid, time_budget=refinement_time_budget
+        )
+        self.homography_tracker.reset(instrument_homography)
+        self.bg_model = cv2.createBackgroundSubtractorMOG2(history=nof_history_frames, detectShadows=False)
+        self.press_detector = budgetpiano.press.PressDetector(layout)
+        self.instrument_image = None
+        self.foreground = None
+        self.tracking_time = 0.0
+        # Per instrument, as instruments are updated from different threads.
+        self.buffer_pool = budgetpiano.buffers.BufferPool()
+
+    @property
+    def homography(self):
+        return self.homography_tracker.homography
+
+    def update(self, frame, stabilization_homography):
+        # Only reads the shared frame, so instruments can be updated from several threads at once. A FrameContext
+        # whose grayscale has already been computed, e.g. by the stabilizer, is shared the same way.
+        start = time.perf_counter()
+        frame_context = budgetpiano.frame_context.as_frame_context(frame)
+        frame = frame_context.image
+        x, y, width, height = budgetpiano.tracking.get_roi(
+            self.size, self.homography @ stabilization_homography, frame.shape
+        )
+        instrument_homography = self.homography_tracker.update(
+            frame_context.crop(x, y, width, height, self.buffer_pool),
+            stabilization_homography @ budgetpiano.tracking.get_translation(x, y),
+        )
+        self.tracking_time = time.perf_counter() - start
+        self.instrument_image = cv2.warpPerspective(
+            frame, instrument_homography @ stabilization_homography, self.size, dst=self.instrument_image
+        )
+        self.foreground = self.bg_model.apply(self.instrument_image, self.foreground)
+        presses = self.press_detector.update(self.foreground)
+        self.buffer_pool.finish_frame()
+        return presses
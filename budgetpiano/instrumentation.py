@@ -0,0 +1,116 @@
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+import numpy
+
+NULL_SPAN = contextlib.nullcontext()
+
+
+class Span:
+    __slots__ = ("tracer", "name", "start")
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.add_span(self.name, self.start, time.perf_counter_ns())
+        return False
+
+
+class Tracer:
+    def __init__(self, enabled=False, max_events=1_000_000, window=200):
+        self.enabled = enabled
+        self.events = collections.deque(maxlen=max_events)
+        self.durations = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self.span_counts = collections.Counter()
+        self.counters = collections.Counter()
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter_ns()
+        self.pid = os.getpid()
+
+    def span(self, name):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name)
+
+    def add_span(self, name, start, end):
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": (start - self.origin) / 1000.0,
+            "dur": (end - start) / 1000.0,
+            "pid": self.pid,
+            "tid": threading.get_ident(),
+        }
+        with self.lock:
+            self.events.append(event)
+            self.durations[name].append((end - start) / 1e6)
+            self.span_counts[name] += 1
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        timestamp = (time.perf_counter_ns() - self.origin) / 1000.0
+        with self.lock:
+            self.counters[name] += value
+            self.events.append(
+                {"name": name, "ph": "C", "ts": timestamp, "pid": self.pid, "args": {name: self.counters[name]}}
+            )
+
+    def gauge(self, name, value):
+        if not self.enabled:
+            return
+        timestamp = (time.perf_counter_ns() - self.origin) / 1000.0
+        with self.lock:
+            self.counters[name] = value
+            self.events.append({"name": name, "ph": "C", "ts": timestamp, "pid": self.pid, "args": {name: value}})
+
+    def get_summary(self):
+        with self.lock:
+            durations = {name: numpy.asarray(values) for name, values in self.durations.items() if values}
+            span_counts = dict(self.span_counts)
+            counters = dict(self.counters)
+        lines = [f"{'span':<24} {'count':>8} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}"]
+        for name, values in sorted(durations.items(), key=lambda item: -item[1].mean()):
+            p50, p95 = numpy.percentile(values, [50, 95])
+            lines.append(
+                f"{name:<24} {span_counts[name]:>8} {values.mean():>9.2f} {p50:>9.2f} {p95:>9.2f} {values.max():>9.2f}"
+            )
+        for name, value in sorted(counters.items()):
+            lines.append(f"{name:<24} {value:>8}")
+        return "\n".join(lines)
+
+    def export_chrome_trace(self, path):
+        with self.lock:
+            events = list(self.events)
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+
+tracer = Tracer()
+
+
+def span(name):
+    return tracer.span(name)
+
+
+def count(name, value=1):
+    tracer.count(name, value)
+
+
+def gauge(name, value):
+    tracer.gauge(name, value)
+
+
+def enable(enabled=True):
+    tracer.enabled = enabled
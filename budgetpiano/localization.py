@@ -0,0 +1,210 @@
+import collections
+import logging
+
+import cv2
+import numpy
+
+import budgetpiano.frame_context
+import budgetpiano.matcher
+import budgetpiano.refinement
+
+logger = logging.getLogger(__name__)
+
+# A dark, filled, elongated blob in the frame: centre, unit vector along its long side, length and width.
+KeyCandidate = collections.namedtuple("KeyCandidate", ["center", "axis", "length", "width"])
+
+
+def get_key_candidates(dark, min_area=8.0, min_elongation=2.5, min_fill=0.7):
+    # Black keys in a mask of dark pixels: anything that is not a filled, elongated rectangle is dropped, which
+    # removes most of the background.
+    contours, _ = cv2.findContours(dark, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    candidates = []
+    for contour in contours:
+        area = cv2.contourArea(contour)
+        if area < min_area:
+            continue
+        center, (width, height), angle = cv2.minAreaRect(contour)
+        length, thickness = max(width, height), min(width, height)
+        if thickness <= 0 or length / thickness < min_elongation or area / (width * height) < min_fill:
+            continue
+        radians = numpy.deg2rad(angle if width >= height else angle + 90.0)
+        candidates.append(
+            KeyCandidate(
+                numpy.float64(center), numpy.float64([numpy.cos(radians), numpy.sin(radians)]), length, thickness
+            )
+        )
+    return candidates
+
+
+def get_key_row(candidates, max_length_ratio=1.6, max_angle=15.0, max_offset=0.25, max_gap=6.0):
+    # The largest group of candidates with about the same size and direction whose centres lie on a line across
+    # their long axis, as the black keys of a keyboard do. Returned in order along that line, cut at gaps much
+    # wider than the usual spacing so that stray blobs further along the same line are left out.
+    if not candidates:
+        return []
+    centers = numpy.float64([candidate.center for candidate in candidates])
+    axes = numpy.float64([candidate.axis for candidate in candidates])
+    lengths = numpy.float64([candidate.length for candidate in candidates])
+    length_ratios = lengths[None, :] / lengths[:, None]
+    offsets = numpy.abs(numpy.einsum("ijk,ik->ij", centers[None, :] - centers[:, None], axes))
+    is_member = (
+        (length_ratios >= 1.0 / max_length_ratio)
+        & (length_ratios <= max_length_ratio)
+        & (numpy.abs(axes @ axes.T) >= numpy.cos(numpy.deg2rad(max_angle)))
+        & (offsets <= max_offset * lengths[:, None])
+    )
+    seed = int(numpy.argmax(is_member.sum(axis=1)))
+    members = numpy.flatnonzero(is_member[seed])
+    across = numpy.float64([-axes[seed, 1], axes[seed, 0]])
+    positions = centers[members] @ across
+    order = numpy.argsort(positions)
+    members, positions = members[order], positions[order]
+    if len(members) < 3:
+        return [candidates[i] for i in members]
+    gaps = numpy.diff(positions)
+    runs = numpy.split(members, numpy.flatnonzero(gaps > max_gap * numpy.median(gaps)) + 1)
+    return [candidates[i] for i in max(runs, key=len)]
+
+
+def get_key_endpoints(key_row, direction):
+    # Back and front ends of each black key. The camera does not mirror the scene, so with the keys ordered along
+    # direction, the back of the keyboard is on the left of it (image y points down).
+    back = numpy.float64([direction[1], -direction[0]])
+    endpoints = []
+    for candidate in key_row:
+        axis = candidate.axis if candidate.axis @ back >= 0 else -candidate.axis
+        endpoints.append(
+            (candidate.center + 0.5 * candidate.length * axis, candidate.center - 0.5 * candidate.length * axis)
+        )
+    return numpy.float32(endpoints)
+
+
+def fit_key_row(endpoints, template_endpoints, first_key, nof_seed_keys, tolerance, nof_grow_keys=4, nof_iterations=20):
+    # Starts from the first detected keys matched to consecutive template keys from first_key on, then alternates
+    # between fitting the homography to the matches and matching the detected keys to the nearest template keys.
+    # The matches only grow by a few keys along the row at a time: a homography fitted to a short stretch of keys
+    # does not extrapolate far.
+    detected = numpy.arange(nof_seed_keys)
+    matched = first_key + detected
+    template_middles = template_endpoints.mean(axis=1)
+    middles = endpoints.mean(axis=1).reshape(-1, 1, 2)
+    homography = None
+    for _ in range(nof_iterations):
+        fitted, _ = cv2.findHomography(endpoints[detected].reshape(-1, 2), template_endpoints[matched].reshape(-1, 2))
+        if fitted is None or abs(numpy.linalg.det(fitted)) < 1e-12:
+            break
+        homography = fitted
+        start = max(0, detected.min() - nof_grow_keys)
+        stop = min(len(endpoints), detected.max() + nof_grow_keys + 1)
+        projected = cv2.perspectiveTransform(middles[start:stop], homography).reshape(-1, 2)
+        distances = numpy.linalg.norm(projected[:, None] - template_middles[None], axis=-1)
+        nearest = distances.argmin(axis=1)
+        is_matched = distances[numpy.arange(len(nearest)), nearest] < tolerance
+        if is_matched.sum() < 4 or (
+            len(detected) == is_matched.sum() and (detected == start + numpy.flatnonzero(is_matched)).all()
+        ):
+            break
+        detected, matched = start + numpy.flatnonzero(is_matched), nearest[is_matched]
+    return len(detected), homography
+
+
+def match_template_features(small, template, layout, min_check=0.9, feature_cache=None):
+    # SIFT features of the template, which are the same from run to run and therefore cached, matched to the frame.
+    # The repeating key pattern gives few distinctive features, so the result only counts if it passes the check.
+    image_matcher = budgetpiano.matcher.ImageMatcher(template, feature_cache)
+    homography = image_matcher.get_homography(small)
+    if homography is None or abs(numpy.linalg.det(homography)) < 1e-12:
+        logger.info("Template features do not match the frame")
+        return None
+    check = budgetpiano.refinement.get_black_key_check(small, homography, layout)
+    logger.info("Template features match, %.0f%% pass the check", 100.0 * check)
+    return homography if check >= min_check else None
+
+
+def match_key_row(small, layout, thresholds=(0.25, 0.5, 0.75), min_black_keys=5, max_distance=0.3, min_check=0.9):
+    # Black keys detected in the frame, matched in order to the black keys of the template.
+    # How dark black keys are depends on the lighting and on what else is in view, so a few thresholds below the
+    # Otsu level are tried; the key borders and shadows merge the keys at the higher ones.
+    otsu_level, _ = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    key_row = max(
+        (get_key_row(get_key_candidates(numpy.uint8(small < fraction * otsu_level) * 255)) for fraction in thresholds),
+        key=len,
+    )
+    black_keys = numpy.flatnonzero(layout.is_black)
+    if len(black_keys) < min_black_keys:
+        logger.info("The keyboard has too few black keys to be localized automatically")
+        return None
+    if len(key_row) < min_black_keys:
+        logger.info("Found %d black keys, not enough to localize the keyboard", len(key_row))
+        return None
+
+    template_endpoints = numpy.float32(
+        [
+            [[0.5 * (left + right), top], [0.5 * (left + right), bottom]]
+            for left, right, top, bottom in zip(
+                layout.left[black_keys], layout.right[black_keys], layout.top[black_keys], layout.bottom[black_keys]
+            )
+        ]
+    )
+    tolerance = max_distance * numpy.median(numpy.diff(template_endpoints[:, 0, 0]))
+
+    # Every way of lining up the first few detected keys with consecutive template keys, in both directions along
+    # the row, is a hypothesis, grown to all the detected keys it explains. When the keys at the ends are hidden,
+    # hypotheses an octave apart explain as many keys, and the black key check on the whole keyboard decides.
+    nof_seed_keys = min_black_keys
+    hypotheses = []
+    for ordered in (key_row, key_row[::-1]):
+        endpoints = get_key_endpoints(ordered, ordered[-1].center - ordered[0].center)
+        for first_key in range(len(black_keys) - nof_seed_keys + 1):
+            score, homography = fit_key_row(endpoints, template_endpoints, first_key, nof_seed_keys, tolerance)
+            if homography is not None:
+                hypotheses.append((score, homography))
+    if not hypotheses:
+        return None
+    best_score = max(score for score, _ in hypotheses)
+    best_check, best_homography = max(
+        (
+            (budgetpiano.refinement.get_black_key_check(small, homography, layout), homography)
+            for score, homography in hypotheses
+            if score >= best_score - 2
+        ),
+        key=lambda checked: checked[0],
+    )
+    logger.info("Matched %d of %d black keys, %.0f%% pass the check", best_score, len(black_keys), 100.0 * best_check)
+    return best_homography if best_check >= min_check else None
+
+
+def localize_keyboard(
+    image,
+    template,
+    layout,
+    max_size=640,
+    thresholds=(0.25, 0.5, 0.75),
+    min_black_keys=5,
+    max_distance=0.3,
+    min_check=0.9,
+    time_budget=None,
+    feature_cache=None,
+):
+    # Finds the keyboard in a frame without any clicks. The row of black keys and, failing that, template features
+    # are matched on a small copy of the frame; ECC then refines the result at full resolution. The key row is tried
+    # first as it is the cheaper of the two and the one that usually succeeds.
+    # Returns the image-to-template homography, or None so that the caller can fall back to manual selection.
+    context = budgetpiano.frame_context.as_frame_context(image)
+    scale = min(1.0, max_size / max(context.gray.shape[:2]))
+    small = context.get_scaled_gray(scale)
+    homography = match_key_row(small, layout, thresholds, min_black_keys, max_distance, min_check)
+    if homography is None:
+        homography = match_template_features(small, template, layout, min_check, feature_cache)
+    if homography is None:
+        return None
+
+    scaling = numpy.diag([scale, scale, 1.0])
+    homography = budgetpiano.refinement.refine_homography(
+        context, template, homography @ scaling, layout, time_budget=time_budget
+    )
+    check = budgetpiano.refinement.get_black_key_check(context.gray, homography, layout)
+    logger.info("Keyboard localized, %.0f%% pass the check", 100.0 * check)
+    if check < min_check:
+        return None
+    return homography
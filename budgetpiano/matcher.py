@@ -1,18 +1,31 @@
 import cv2
 import numpy
 
+import budgetpiano.buffers
+import budgetpiano.frame_context
+
+SIFT_PARAMETERS = dict(nfeatures=0, nOctaveLayers=3, contrastThreshold=0.04, edgeThreshold=10.0, sigma=1.6)
+ORB_PARAMETERS = dict(nfeatures=2000)
+
 
 class ImageMatcher:
-    def __init__(self, train_image):
-        self.sift = cv2.SIFT_create()
+    def __init__(self, train_image, feature_cache=None):
+        self.sift = cv2.SIFT_create(**SIFT_PARAMETERS)
         self.detector = self.sift
         self.descriptor = self.sift
         self.matcher = self._get_flann()
         self.homography = None
         self.homography_mask = None
         self.train_image = train_image
-        self.train_keypoints = self.detector.detect(train_image, None)
-        self.train_keypoints, self.train_descriptors = self.descriptor.compute(train_image, self.train_keypoints)
+        if feature_cache is None:
+            self.train_keypoints, self.train_descriptors = self._detect_and_compute(train_image)
+        else:
+            self.train_keypoints, self.train_descriptors = feature_cache.get_or_compute(
+                train_image, "SIFT", SIFT_PARAMETERS, self._detect_and_compute
+            )
+        self.train_points = numpy.float32([keypoint.pt for keypoint in self.train_keypoints]).reshape(-1, 2)
+        self.matcher.add([self.train_descriptors])
+        self.matcher.train()
 
     def _get_flann(self):
         FLANN_INDEX_KDTREE = 1
@@ -23,89 +36,315 @@ class ImageMatcher:
     def _get_brute_force(self):
         return cv2.BFMatcher(cv2.NORM_L2, crossCheck=False)
 
+    def _detect_and_compute(self, image):
+        keypoints = self.detector.detect(image, None)
+        return self.descriptor.compute(image, keypoints)
+
     def get_homography(self, query_image):
-        self.query_image = query_image
-        self.query_keypoints = self.detector.detect(self.query_image, None)
-        self.query_keypoints, self.query_descriptors = self.descriptor.compute(self.query_image, self.query_keypoints)
+        # SIFT only looks at the grayscale, which a FrameContext converts once for all stages.
+        context = budgetpiano.frame_context.as_frame_context(query_image)
+        self.query_image = context.image
+        self.query_keypoints, self.query_descriptors = self._detect_and_compute(context.gray)
+        if self.query_descriptors is None:
+            return None
 
         nof_neighbours = 2
-        matches = self.matcher.knnMatch(self.query_descriptors, self.train_descriptors, k=nof_neighbours)
-
-        is_significantly_smaller_ratio = 0.7
-        self.good_matches = []
-        for match in matches:
-            if len(match) < nof_neighbours:
-                continue
-            best_match, second_best_match = match
-            if best_match.distance < is_significantly_smaller_ratio * second_best_match.distance:
-                is_too_close = False
-                for good_match in self.good_matches:
-                    good_point = numpy.asarray(self.train_keypoints[good_match.trainIdx].pt)
-                    best_point = numpy.asarray(self.train_keypoints[best_match.trainIdx].pt)
-                    distance = cv2.norm(best_point - good_point)
-                    if distance < 1:
-                        is_too_close = True
-                if not is_too_close:
-                    self.good_matches.append(best_match)
+        matches = self.matcher.knnMatch(self.query_descriptors, k=nof_neighbours)
+        self.good_matches = self._filter_matches(matches)
         if len(self.good_matches) >= 4:
             self.src_pts = numpy.float32([self.query_keypoints[m.queryIdx].pt for m in self.good_matches]).reshape(
                 -1, 1, 2
             )
-            self.dst_pts = numpy.float32([self.train_keypoints[m.trainIdx].pt for m in self.good_matches]).reshape(
-                -1, 1, 2
-            )
+            self.dst_pts = self.train_points[[m.trainIdx for m in self.good_matches]].reshape(-1, 1, 2)
             self.homography, self.homography_mask = cv2.findHomography(self.src_pts, self.dst_pts, cv2.RANSAC, 5.0)
             return self.homography
 
         return None
 
+    def _filter_matches(self, matches, is_significantly_smaller_ratio=0.7, min_distance=1.0):
+        candidates = [match[0] for match in matches if len(match) >= 2]
+        if not candidates:
+            return []
+        distances = numpy.float32([(match[0].distance, match[1].distance) for match in matches if len(match) >= 2])
+        is_good = distances[:, 0] < is_significantly_smaller_ratio * distances[:, 1]
+        good_indices = numpy.flatnonzero(is_good)
+        train_idx = numpy.asarray([candidates[i].trainIdx for i in good_indices], numpy.intp)
+        is_kept = suppress_duplicates(self.train_points[train_idx], min_distance)
+        return [candidates[i] for i in good_indices[is_kept]]
 
-class VideoStabilizer:
-    def __init__(self):
-        self.sift = cv2.SIFT_create()
-        self.detector = self.sift
-        self.descriptor = self.sift
-        self.matcher = self._get_flann()
-        self.train_keypoints = None
-        self.train_descriptors = None
+
+def suppress_duplicates(points, min_distance=1.0):
+    # Greedy in input order: a point is dropped if it is closer than min_distance to an already kept point.
+    # Kept points are hashed into a grid with min_distance cells, so only the 3x3 neighbourhood is compared.
+    is_kept = numpy.zeros(len(points), bool)
+    cells = numpy.floor(numpy.asarray(points, numpy.float64) / min_distance).astype(numpy.int64)
+    grid = dict()
+    min_distance_sq = min_distance * min_distance
+    for i, ((x, y), (cell_x, cell_y)) in enumerate(zip(points.tolist(), cells.tolist())):
+        is_too_close = any(
+            (x - other_x) ** 2 + (y - other_y) ** 2 < min_distance_sq
+            for neighbour_x in (cell_x - 1, cell_x, cell_x + 1)
+            for neighbour_y in (cell_y - 1, cell_y, cell_y + 1)
+            for other_x, other_y in grid.get((neighbour_x, neighbour_y), ())
+        )
+        if not is_too_close:
+            is_kept[i] = True
+            grid.setdefault((cell_x, cell_y), []).append((x, y))
+    return is_kept
+
+
+def ratio_test(matches, ratio=0.7):
+    pairs = numpy.asarray(
+        [(m[0].queryIdx, m[0].trainIdx, m[0].distance, m[1].distance) for m in matches if len(m) >= 2],
+        numpy.float64,
+    ).reshape(-1, 4)
+    good = pairs[:, 2] < ratio * pairs[:, 3]
+    return pairs[good, 0].astype(numpy.intp), pairs[good, 1].astype(numpy.intp)
+
+
+def get_points(keypoints):
+    return numpy.float32(cv2.KeyPoint_convert(keypoints)).reshape(-1, 2)
+
+
+def keep_copy(buffer, gray):
+    # Frames may be reused buffers, so backends keep a copy of the last one for optical flow, in a buffer of their own.
+    if buffer is None or buffer.shape != gray.shape:
+        return gray.copy()
+    numpy.copyto(buffer, gray)
+    return buffer
+
+
+class FeatureBackend:
+    # Features are only detected and matched when the keyframe is set or tracking is lost. In between, the strongest
+    # keyframe features are found in each frame with optical flow from the keyframe itself, starting from where the
+    # previous homography puts them, which costs a fraction of a detection and does not drift.
+    def __init__(
+        self,
+        detector,
+        detector_name,
+        detector_parameters,
+        matcher,
+        ratio=0.7,
+        min_flow_points=50,
+        max_flow_points=500,
+    ):
+        self.detector = detector
+        self.detector_name = detector_name
+        self.detector_parameters = detector_parameters
+        self.matcher = matcher
+        self.ratio = ratio
+        self.min_flow_points = min_flow_points
+        self.max_flow_points = max_flow_points
+        self.keyframe_points = None
+        self.keyframe_descriptors = None
+        self.keyframe_gray = None
+        self.keyframe_mean = None
+        self.scaled_keyframe_gray = None
+        self.flow_points = None
         self.homography = None
-        self.homography_mask = None
 
-    def _get_flann(self):
+    def _detect_and_compute(self, gray):
+        return self.detector.detectAndCompute(gray, None)
+
+    def set_keyframe(self, gray):
+        keypoints, descriptors = self._detect_and_compute(gray)
+        self.set_keyframe_features(get_points(keypoints), descriptors)
+        if self.keyframe_points is not None:
+            responses = numpy.float32([keypoint.response for keypoint in keypoints])
+            self._set_flow(gray, numpy.eye(3), numpy.argsort(-responses))
+
+    def set_keyframe_features(self, points, descriptors):
+        self.matcher.clear()
+        self.keyframe_gray = None
+        self.flow_points = None
+        if descriptors is None or len(points) < 4:
+            self.keyframe_points = None
+            self.keyframe_descriptors = None
+            return
+        self.keyframe_points = points
+        self.keyframe_descriptors = descriptors
+        self.matcher.add([descriptors])
+        self.matcher.train()
+
+    def _set_flow(self, keyframe_gray, homography, order):
+        # A keyframe restored without its image gets the first matched frame warped into it instead.
+        self.keyframe_gray = keep_copy(self.keyframe_gray, keyframe_gray)
+        self.keyframe_mean = cv2.mean(self.keyframe_gray)[0]
+        self.flow_points = self.keyframe_points[order[: self.max_flow_points]].reshape(-1, 1, 2)
+        self.homography = homography
+
+    def _track_flow(self, gray):
+        guess = cv2.perspectiveTransform(self.flow_points, numpy.linalg.inv(self.homography))
+        # Optical flow assumes constant brightness, so exposure and lighting changes since the keyframe are taken out.
+        gain = cv2.mean(gray)[0] / max(self.keyframe_mean, 1.0)
+        self.scaled_keyframe_gray = cv2.convertScaleAbs(self.keyframe_gray, self.scaled_keyframe_gray, gain)
+        points, status, _ = cv2.calcOpticalFlowPyrLK(
+            self.scaled_keyframe_gray, gray, self.flow_points, guess, flags=cv2.OPTFLOW_USE_INITIAL_FLOW
+        )
+        is_tracked = status.ravel() == 1
+        if is_tracked.sum() < self.min_flow_points:
+            return None, None, 0
+        homography, mask = cv2.findHomography(points[is_tracked], self.flow_points[is_tracked], cv2.RANSAC, 5.0)
+        nof_inliers = 0 if mask is None else int(mask.sum())
+        if nof_inliers < self.min_flow_points:
+            return None, None, 0
+        self.homography = homography
+        return homography, mask, nof_inliers
+
+    def track(self, gray):
+        if self.keyframe_points is None:
+            return None, None, 0
+        if self.keyframe_gray is not None:
+            homography, mask, nof_inliers = self._track_flow(gray)
+            if homography is not None:
+                return homography, mask, nof_inliers
+        keypoints, descriptors = self._detect_and_compute(gray)
+        if descriptors is None or len(keypoints) < 2:
+            return None, None, 0
+        query_idx, train_idx = ratio_test(self.matcher.knnMatch(descriptors, k=2), self.ratio)
+        if len(query_idx) < 4:
+            return None, None, len(query_idx)
+        query_points = get_points(keypoints)[query_idx]
+        homography, mask = cv2.findHomography(query_points, self.keyframe_points[train_idx], cv2.RANSAC, 5.0)
+        nof_inliers = 0 if mask is None else int(mask.sum())
+        if nof_inliers < self.min_flow_points:
+            return homography, mask, nof_inliers
+        if self.keyframe_gray is None:
+            # Only the matched keyframe features are known to be in view, the strongest of them first.
+            is_inlier = mask.ravel() == 1
+            responses = numpy.float32([keypoints[i].response for i in query_idx[is_inlier]])
+            warped = cv2.warpPerspective(gray, homography, (gray.shape[1], gray.shape[0]))
+            self._set_flow(warped, homography, train_idx[is_inlier][numpy.argsort(-responses)])
+        self.homography = homography
+        return homography, mask, nof_inliers
+
+
+class SiftBackend(FeatureBackend):
+    def __init__(self, ratio=0.7):
         FLANN_INDEX_KDTREE = 1
         index_params = dict(algorithm=FLANN_INDEX_KDTREE, trees=5)
         search_params = dict(checks=50)
-        return cv2.FlannBasedMatcher(index_params, search_params)
+        super().__init__(
+            cv2.SIFT_create(**SIFT_PARAMETERS),
+            "SIFT",
+            SIFT_PARAMETERS,
+            cv2.FlannBasedMatcher(index_params, search_params),
+            ratio,
+        )
+
+
+class OrbBackend(FeatureBackend):
+    def __init__(self, ratio=0.8):
+        FLANN_INDEX_LSH = 6
+        index_params = dict(algorithm=FLANN_INDEX_LSH, table_number=6, key_size=12, multi_probe_level=1)
+        search_params = dict(checks=50)
+        super().__init__(
+            cv2.ORB_create(**ORB_PARAMETERS),
+            "ORB",
+            ORB_PARAMETERS,
+            cv2.FlannBasedMatcher(index_params, search_params),
+            ratio,
+        )
+
+
+class OpticalFlowBackend:
+    def __init__(self, max_corners=500, quality_level=0.01, min_distance=10):
+        self.max_corners = max_corners
+        self.quality_level = quality_level
+        self.min_distance = min_distance
+        self.keyframe_points = None
+        self.tracked_points = None
+        self.previous_gray = None
+
+    def set_keyframe(self, gray):
+        points = cv2.goodFeaturesToTrack(gray, self.max_corners, self.quality_level, self.min_distance)
+        self.keyframe_points = None if points is None else points.reshape(-1, 1, 2)
+        self.tracked_points = self.keyframe_points
+        self.previous_gray = keep_copy(self.previous_gray, gray)
+
+    def track(self, gray):
+        if self.keyframe_points is None or len(self.keyframe_points) < 4:
+            return None, None, 0
+        tracked_points, status, _ = cv2.calcOpticalFlowPyrLK(self.previous_gray, gray, self.tracked_points, None)
+        self.previous_gray = keep_copy(self.previous_gray, gray)
+        is_tracked = status.ravel() == 1
+        self.keyframe_points = self.keyframe_points[is_tracked]
+        self.tracked_points = tracked_points[is_tracked]
+        if len(self.tracked_points) < 4:
+            return None, None, len(self.tracked_points)
+        homography, mask = cv2.findHomography(self.tracked_points, self.keyframe_points, cv2.RANSAC, 5.0)
+        if mask is None:
+            return None, None, 0
+        is_inlier = mask.ravel() == 1
+        self.keyframe_points = self.keyframe_points[is_inlier]
+        self.tracked_points = self.tracked_points[is_inlier]
+        return homography, mask, int(is_inlier.sum())
 
-    def _get_brute_force(self):
-        return cv2.BFMatcher(cv2.NORM_L2, crossCheck=False)
+
+STABILIZER_BACKENDS = {"sift": SiftBackend, "orb": OrbBackend, "optical-flow": OpticalFlowBackend}
+
+
+class VideoStabilizer:
+    def __init__(self, backend="sift", min_tracked_points=50, scale=1.0, buffer_pool=None):
+        self.backend = STABILIZER_BACKENDS[backend]()
+        self.buffer_pool = budgetpiano.buffers.BufferPool() if buffer_pool is None else buffer_pool
+        self.backend_name = backend
+        self.min_tracked_points = min_tracked_points
+        self.scale = scale
+        self.keyframe_scale = None
+        self.keyframe_homography = None
+        self.homography = None
+        self.homography_mask = None
+        self.nof_tracked_points = 0
 
     def get_homography(self, query_image):
-        self._update(query_image)
+        # The query image can be a FrameContext, whose grayscale is then shared with the later stages.
+        self._update(budgetpiano.frame_context.as_frame_context(query_image, self.buffer_pool, "stabilization"))
         return self.homography
 
-    def _update(self, query_image):
-        query_keypoints = self.detector.detect(query_image, None)
-        query_keypoints, query_descriptors = self.descriptor.compute(query_image, query_keypoints)
-        if self.train_keypoints is None and self.train_descriptors is None:
-            self.train_keypoints = query_keypoints
-            self.train_descriptors = query_descriptors
-        else:
-            nof_neighbours = 2
-            matches = self.matcher.knnMatch(query_descriptors, self.train_descriptors, k=nof_neighbours)
-
-            is_significantly_smaller_ratio = 0.7
-            good_matches = []
-            for match in matches:
-                if len(match) < nof_neighbours:
-                    continue
-                best_match, second_best_match = match
-                if best_match.distance < is_significantly_smaller_ratio * second_best_match.distance:
-                    good_matches.append(best_match)
-            if len(good_matches) > 0:
-                src_pts = numpy.float32([self.train_keypoints[m.trainIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-                dst_pts = numpy.float32([query_keypoints[m.queryIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-                self.homography, self.homography_mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
-
-                self.train_keypoints = query_keypoints
-                self.train_descriptors = query_descriptors
+    def _set_keyframe(self, context):
+        self.backend.set_keyframe(context.get_scaled_gray(self.scale))
+        self.keyframe_scale = self.scale
+
+    def get_keyframe(self):
+        # Enough to restore the stabilizer in a later session, or None for backends without descriptors.
+        if self.keyframe_homography is None or getattr(self.backend, "keyframe_descriptors", None) is None:
+            return None
+        return {
+            "keyframe_points": self.backend.keyframe_points,
+            "keyframe_descriptors": self.backend.keyframe_descriptors,
+            "keyframe_homography": self.keyframe_homography,
+            "keyframe_scale": self.keyframe_scale,
+        }
+
+    def set_keyframe(self, keyframe_points, keyframe_descriptors, keyframe_homography, keyframe_scale):
+        # The next frame is tracked against the restored keyframe, so homographies stay in the old reference.
+        self.backend.set_keyframe_features(keyframe_points, keyframe_descriptors)
+        self.keyframe_homography = numpy.asarray(keyframe_homography, numpy.float64)
+        self.keyframe_scale = float(keyframe_scale)
+        self.homography = None
+
+    def _update(self, context):
+        if self.keyframe_homography is None:
+            self._set_keyframe(context)
+            self.keyframe_homography = numpy.eye(3)
+            self.homography = numpy.eye(3)
+            return
+
+        # Features are tracked at the keyframe's working scale; the homography is scaled back to full resolution.
+        homography, self.homography_mask, self.nof_tracked_points = self.backend.track(
+            context.get_scaled_gray(self.keyframe_scale)
+        )
+        if homography is not None:
+            scaling = numpy.diag([self.keyframe_scale, self.keyframe_scale, 1.0])
+            homography = numpy.linalg.inv(scaling) @ homography @ scaling
+            # The reference stays the first keyframe; later keyframes are chained onto it.
+            self.homography = self.keyframe_homography @ homography
+        if self.homography is None:
+            # A restored keyframe that does not match: start over with this frame as the reference.
+            self._set_keyframe(context)
+            self.keyframe_homography = numpy.eye(3)
+            self.homography = numpy.eye(3)
+        elif self.nof_tracked_points < self.min_tracked_points or self.keyframe_scale != self.scale:
+            self._set_keyframe(context)
+            self.keyframe_homography = self.homography
@@ -0,0 +1,124 @@
+import contextlib
+import logging
+import queue
+import threading
+import time
+
+import mido
+import mido.ports
+import numpy
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class RecordingPort(mido.ports.BaseOutput):
+    def _open(self, **kwargs):
+        self.messages = []
+        self.arrival_times = []
+
+    def _send(self, message):
+        self.arrival_times.append(time.monotonic())
+        self.messages.append(message)
+
+
+class MidiOutput(threading.Thread):
+    def __init__(self, port, channel=0, velocity=64, maxsize=256, latency=None):
+        super().__init__(name="MidiOutput", daemon=True)
+        self.port = port
+        self.channel = channel
+        self.velocity = velocity
+        self.latency = latency
+        self.batches = queue.Queue(maxsize)
+        self.is_on = numpy.zeros(128, bool)
+        self.nof_sent = 0
+        self.nof_coalesced = 0
+
+    def send_frame(self, timestamp, note_ons=(), note_offs=()):
+        # Note state is tracked on the caller's side so that redundant messages never reach the queue.
+        messages = []
+        for note in note_offs:
+            if self.is_on[note]:
+                self.is_on[note] = False
+                messages.append(mido.Message("note_off", channel=self.channel, note=int(note), time=timestamp))
+        for note in note_ons:
+            if not self.is_on[note]:
+                self.is_on[note] = True
+                messages.append(
+                    mido.Message(
+                        "note_on", channel=self.channel, note=int(note), velocity=self.velocity, time=timestamp
+                    )
+                )
+        if messages:
+            try:
+                self.batches.put_nowait((timestamp, messages))
+            except queue.Full:
+                self._coalesce(timestamp, messages)
+        return messages
+
+    def _coalesce(self, timestamp, messages):
+        # The port has stalled: rather than blocking the caller, the batches still waiting are merged into one that
+        # brings the port to the current note state. Every note off is kept; note ons are only kept for notes that
+        # are still on.
+        pending = []
+        with contextlib.suppress(queue.Empty):
+            while True:
+                pending.extend(self.batches.get_nowait()[1])
+        pending.extend(messages)
+        note_offs = {message.note: message for message in pending if message.type == "note_off"}
+        note_ons = {
+            message.note: message for message in pending if message.type == "note_on" and self.is_on[message.note]
+        }
+        self.nof_coalesced += 1
+        logger.debug(
+            "MIDI output is behind, coalesced %d messages into %d", len(pending), len(note_offs) + len(note_ons)
+        )
+        self.batches.put_nowait((timestamp, list(note_offs.values()) + list(note_ons.values())))
+
+    def all_notes_off(self, timestamp=None):
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        return self.send_frame(timestamp, note_offs=numpy.flatnonzero(self.is_on))
+
+    def run(self):
+        while True:
+            batch = self.batches.get()
+            if batch is _STOP:
+                break
+            # The messages carry the capture timestamp of their frame as their time. Without a latency target they
+            # are sent as soon as possible, so the timestamp only matters for the constant delay below.
+            timestamp, messages = batch
+            if self.latency is not None:
+                # Keep a constant capture-to-output delay instead of sending as soon as possible.
+                delay = timestamp + self.latency - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            for message in messages:
+                try:
+                    self.port.send(message)
+                    self.nof_sent += 1
+                except (OSError, ValueError) as error:
+                    logger.warning("Failed to send %s: %s", message, error)
+
+    def stop(self, timeout=1.0):
+        # A port that blocks in send, e.g. an unplugged device, must not hang the application at shutdown. The
+        # thread is a daemon, so one that is still stuck is left behind.
+        self.all_notes_off()
+        deadline = time.monotonic() + timeout
+        try:
+            self.batches.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self.join(max(0.0, deadline - time.monotonic()))
+        if self.is_alive():
+            logger.warning("MIDI output did not stop within %.1f s, the port may be blocked", timeout)
+
+
+@contextlib.contextmanager
+def midi_output(port, **kwargs):
+    output = MidiOutput(port, **kwargs)
+    output.start()
+    try:
+        yield output
+    finally:
+        output.stop()
@@ -0,0 +1,199 @@
+import collections
+import functools
+import math
+
+import numpy
+
+PianoLayout = collections.namedtuple(
+    "PianoLayout", ["width", "height", "velvet_height", "left", "top", "right", "bottom", "midi", "is_black", "labels"]
+)
+# Keys are ordered from lowest to highest, rectangles are inclusive as drawn by cv2.rectangle and labels holds the
+# key index of every template pixel, or NO_KEY.
+
+NO_KEY = -1
+
+
+def _get_start_key_midi(nof_keys, start_key_pitchclass, center_midi=64.5):
+    # Pick the octave that centers the keyboard on middle C, e.g. A0 for 88 keys and C2 for 61 keys.
+    octave = round((center_midi - (nof_keys - 1) / 2.0 - start_key_pitchclass) / 12.0)
+    start_key_midi = start_key_pitchclass + 12 * octave
+    while start_key_midi < 0:
+        start_key_midi += 12
+    while start_key_midi + nof_keys - 1 > 127 and start_key_midi >= 12:
+        start_key_midi -= 12
+    return start_key_midi
+
+
+def _fill_columns(width, left, right, key_nos):
+    # Owner of each column when the keys are drawn in order, -1 where there is none: spans are expanded into column
+    # indices with repeat and the highest (last drawn) key number wins.
+    left = numpy.clip(left, 0, width)
+    right = numpy.clip(right + 1, 0, width)
+    lengths = numpy.maximum(right - left, 0)
+    starts = numpy.repeat(left - numpy.cumsum(lengths) + lengths, lengths)
+    columns = starts + numpy.arange(lengths.sum())
+    owners = numpy.full(width, NO_KEY, numpy.int16)
+    numpy.maximum.at(owners, columns, numpy.repeat(key_nos, lengths).astype(numpy.int16))
+    return owners
+
+
+@functools.lru_cache(maxsize=32)
+def _get_piano_layout(
+    white_key_width_px: int = 10, nof_keys: int = 88, start_key_pitchclass: int = 9, start_key_midi=None
+):
+    # Memoized, so the returned arrays are read-only.
+    red_velvet_height = 0.2
+    white_key_width = 2.25
+    white_key_height = 14.6
+    white_key_narrow_space = 0.1
+    white_key_large_space = 0.125
+    black_key_width = 1.40
+    black_key_height = 9.8
+    black_key_offsets = [1.3, 1.8, 1.2, 1.6, 1.9]
+
+    white_key_starts = []
+    black_key_starts = []
+    white_key_pitchclasses = [0, 2, 4, 5, 7, 9, 11]
+    P1 = white_key_pitchclasses[0]
+    M2 = white_key_pitchclasses[1]
+    M3 = white_key_pitchclasses[2]
+    P4 = white_key_pitchclasses[3]
+    P5 = white_key_pitchclasses[4]
+    M6 = white_key_pitchclasses[5]
+    M7 = white_key_pitchclasses[6]
+    wide_space_before_pitchclass = [P1, P4]
+    black_key_pitchclasses = [P1 + 1, M2 + 1, P4 + 1, P5 + 1, M6 + 1]
+
+    keys = []
+    white_key_start_offset = 0.0
+    for key_no in range(nof_keys):
+        key_pitchclass = (start_key_pitchclass + key_no) % 12
+        if key_pitchclass in white_key_pitchclasses:
+            space_after = (
+                white_key_large_space if key_pitchclass in wide_space_before_pitchclass else white_key_narrow_space
+            )
+            if len(white_key_starts) > 0:
+                white_key_starts.append(white_key_starts[-1] + white_key_width + space_after)
+            else:
+                white_key_starts.append(white_key_start_offset)
+            keys.append((key_no, False, len(white_key_starts) - 1))
+        else:
+            black_key_offset = black_key_offsets[black_key_pitchclasses.index(key_pitchclass)]
+            if len(white_key_starts) > 0:
+                black_key_starts.append(white_key_starts[-1] + black_key_offset)
+            else:
+                black_key_starts.append(black_key_offset)
+                white_key_start_offset = white_key_width + white_key_narrow_space
+            keys.append((key_no, True, len(black_key_starts) - 1))
+
+    width = 0.0
+    if len(white_key_starts) > 0:
+        width = max(width, white_key_starts[-1] + white_key_width)
+    if len(black_key_starts) > 0:
+        width = max(width, black_key_starts[-1] + black_key_width)
+    height = white_key_height + red_velvet_height
+
+    scale = white_key_width_px / white_key_width
+    left = numpy.empty(nof_keys, numpy.int32)
+    top = numpy.empty(nof_keys, numpy.int32)
+    right = numpy.empty(nof_keys, numpy.int32)
+    bottom = numpy.empty(nof_keys, numpy.int32)
+    is_black = numpy.zeros(nof_keys, bool)
+    for key_no, key_is_black, index in keys:
+        if key_is_black:
+            key_start, key_width, key_height = black_key_starts[index], black_key_width, black_key_height
+        else:
+            key_start, key_width, key_height = white_key_starts[index], white_key_width, white_key_height
+        left[key_no] = int(scale * key_start)
+        top[key_no] = int(scale * red_velvet_height)
+        right[key_no] = left[key_no] + int(scale * key_width)
+        bottom[key_no] = top[key_no] + int(scale * key_height)
+        is_black[key_no] = key_is_black
+
+    if start_key_midi is None:
+        start_key_midi = _get_start_key_midi(nof_keys, start_key_pitchclass)
+    width_px = max(1, math.ceil(scale * width))
+    height_px = max(1, math.ceil(scale * height))
+
+    # White keys first so that black keys overlap them, as when drawing. All keys of one colour span the same rows,
+    # so the label image is a few bands of identical rows.
+    breaks = numpy.unique(numpy.concatenate([[0, height_px], top, bottom + 1]).clip(0, height_px))
+    band_labels = numpy.full((len(breaks) - 1, width_px), NO_KEY, numpy.int16)
+    for key_nos in (numpy.flatnonzero(~is_black), numpy.flatnonzero(is_black)):
+        if len(key_nos) == 0:
+            continue
+        owners = _fill_columns(width_px, left[key_nos], right[key_nos], key_nos)
+        is_covered = (breaks[:-1] >= top[key_nos[0]]) & (breaks[:-1] <= bottom[key_nos[0]])
+        band_labels[numpy.ix_(is_covered, owners != NO_KEY)] = owners[owners != NO_KEY]
+    labels = numpy.repeat(band_labels, numpy.diff(breaks), axis=0)
+
+    layout = PianoLayout(
+        width=width_px,
+        height=height_px,
+        velvet_height=int(scale * red_velvet_height),
+        left=left,
+        top=top,
+        right=right,
+        bottom=bottom,
+        midi=numpy.arange(start_key_midi, start_key_midi + nof_keys, dtype=numpy.int32),
+        is_black=is_black,
+        labels=labels,
+    )
+    for array in layout[3:]:
+        array.setflags(write=False)
+    return layout
+
+
+def _draw_piano(
+    layout,
+    white_key_color=(255, 255, 255),
+    black_key_color=(0, 0, 0),
+    red_velvet_color=(0, 0, 77),
+    border_color=(128, 128, 128),
+    background_color=(128, 128, 128),
+):
+    # Same pixels as drawing the velvet and then every key as a filled rectangle with a border, but from the label
+    # image: each pixel takes the colour of the key that owns it, or of its border. Rows only differ at the top and
+    # bottom edges of keys and the velvet, so one row per band is coloured and then repeated.
+    breaks = numpy.unique(
+        numpy.concatenate(
+            [[0, layout.velvet_height + 1, layout.height], layout.top, layout.top + 1, layout.bottom, layout.bottom + 1]
+        )
+    )
+    breaks = breaks[(breaks >= 0) & (breaks <= layout.height)]
+    rows = breaks[:-1, None]
+    columns = numpy.arange(layout.width)[None, :]
+    key_no = layout.labels[breaks[:-1]].astype(numpy.intp)
+    has_key = key_no != NO_KEY
+    key_no[~has_key] = 0
+    is_border = has_key & (
+        (columns == layout.left[key_no])
+        | (columns == layout.right[key_no])
+        | (rows == layout.top[key_no])
+        | (rows == layout.bottom[key_no])
+    )
+    color_index = numpy.where(rows <= layout.velvet_height, 1, 0)
+    color_index = numpy.where(has_key, numpy.where(layout.is_black[key_no], 3, 2), color_index)
+    color_index[is_border] = 4
+    palette = numpy.uint8([background_color, red_velvet_color, white_key_color, black_key_color, border_color])
+    # TODO: the white keys are rounded at bottom
+    return numpy.repeat(palette[color_index], numpy.diff(breaks), axis=0)
+
+
+def _get_piano(
+    white_key_width_px: int = 10,
+    nof_keys: int = 88,
+    start_key_pitchclass: int = 9,
+    white_key_color=(255, 255, 255),
+    black_key_color=(0, 0, 0),
+    red_velvet_color=(0, 0, 77),
+    border_color=(128, 128, 128),
+    background_color=(128, 128, 128),
+    start_key_midi=None,
+    return_layout=False,
+):
+    layout = _get_piano_layout(white_key_width_px, nof_keys, start_key_pitchclass, start_key_midi)
+    image = _draw_piano(layout, white_key_color, black_key_color, red_velvet_color, border_color, background_color)
+    if return_layout:
+        return image, layout
+    return image
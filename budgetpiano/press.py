@@ -0,0 +1,99 @@
+import numpy
+
+from budgetpiano.piano import NO_KEY
+
+
+def get_press_labels(layout, black_key_zone=0.5):
+    # Only the part of a key where a fingertip lands when playing it counts: the front of white keys, below the
+    # black keys, and the front half of black keys. Hands hovering further back are ignored.
+    labels = layout.labels.copy()
+    rows = numpy.arange(layout.height)[:, None]
+    if layout.is_black.any():
+        white_key_zone_top = layout.bottom[layout.is_black].max() + 1
+    else:
+        white_key_zone_top = numpy.max(layout.top + 2 * (layout.bottom - layout.top) // 3)
+    zone_top = numpy.where(
+        layout.is_black,
+        layout.top + (black_key_zone * (layout.bottom - layout.top)).astype(numpy.int32),
+        white_key_zone_top,
+    )
+    key_no = numpy.where(labels == NO_KEY, 0, labels)
+    labels[(labels != NO_KEY) & (rows < zone_top[key_no])] = NO_KEY
+    return labels
+
+
+class PressDetector:
+    def __init__(
+        self,
+        layout,
+        on_threshold=0.2,
+        off_threshold=0.08,
+        on_frames=2,
+        off_frames=2,
+        warmup_frames=30,
+        max_active_fraction=0.5,
+        max_rise=0.05,
+    ):
+        self.midi = layout.midi
+        self.nof_keys = len(layout.midi)
+        self.on_threshold = on_threshold
+        self.off_threshold = off_threshold
+        self.on_frames = on_frames
+        self.off_frames = off_frames
+        self.warmup_frames = warmup_frames
+        self.max_active_fraction = max_active_fraction
+        self.max_rise = max_rise
+        self.nof_frames = 0
+
+        press_labels = get_press_labels(layout).ravel()
+        self.pixel_index = numpy.flatnonzero(press_labels != NO_KEY)
+        self.pixel_keys = press_labels[self.pixel_index].astype(numpy.intp)
+        self.areas = numpy.maximum(numpy.bincount(self.pixel_keys, minlength=self.nof_keys), 1)
+        self.foreground_buffer = numpy.empty(len(self.pixel_index), numpy.uint8)
+        self.is_foreground_buffer = numpy.empty(len(self.pixel_index), numpy.float64)
+
+        # A finger on a black key also covers the front of the white keys on either side of it.
+        black_keys = numpy.flatnonzero(layout.is_black)
+        self.black_neighbours = numpy.stack([black_keys - 1, black_keys + 1]).clip(0, self.nof_keys - 1)
+        self.black_keys = black_keys
+        self.white_keys = numpy.flatnonzero(~layout.is_black)
+
+        self.is_pressed = numpy.zeros(self.nof_keys, bool)
+        self.on_count = numpy.zeros(self.nof_keys, numpy.int32)
+        self.off_count = numpy.zeros(self.nof_keys, numpy.int32)
+        self.occupancy = numpy.zeros(self.nof_keys)
+
+    def get_occupancy(self, foreground):
+        numpy.take(foreground.ravel(), self.pixel_index, out=self.foreground_buffer)
+        is_foreground = numpy.greater(self.foreground_buffer, 0, out=self.is_foreground_buffer)
+        return numpy.bincount(self.pixel_keys, weights=is_foreground, minlength=self.nof_keys) / self.areas
+
+    def update(self, foreground):
+        self.nof_frames += 1
+        occupancy = self.get_occupancy(foreground)
+        # Slow lighting changes bring up all keys of one colour together, hands only a few of them, so occupancy is
+        # measured from the median key of the same colour.
+        for keys in (self.black_keys, self.white_keys):
+            if len(keys) > 0:
+                occupancy[keys] -= numpy.median(occupancy[keys])
+        # A finger sliding in crosses other keys on its way, and the front of its own key before it lands. Onsets
+        # wait while a key is still filling up, and white keys also while a black key next to them is.
+        is_rising = occupancy - self.occupancy > self.max_rise
+        is_rising[self.black_neighbours[:, is_rising[self.black_keys]].ravel()] = True
+        self.occupancy = occupancy
+        is_above = self.occupancy >= self.on_threshold
+        is_below = self.occupancy < self.off_threshold
+        # While the background model is still learning, or when most of the keyboard lights up at once (a lighting
+        # change rather than hands), the frame says nothing about presses.
+        if self.nof_frames <= self.warmup_frames or is_above.mean() > self.max_active_fraction:
+            return self.midi[:0], self.midi[:0]
+        is_above[self.black_neighbours[:, is_above[self.black_keys]].ravel()] = False
+
+        self.on_count = numpy.where(~self.is_pressed & is_above, self.on_count + ~is_rising, 0)
+        self.off_count = numpy.where(self.is_pressed & is_below, self.off_count + 1, 0)
+        pressed = self.on_count >= self.on_frames
+        released = self.off_count >= self.off_frames
+        self.is_pressed = (self.is_pressed | pressed) & ~released
+        self.on_count[pressed] = 0
+        self.off_count[released] = 0
+        return self.midi[pressed], self.midi[released]
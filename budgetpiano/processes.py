@@ -0,0 +1,251 @@
+import collections
+import contextlib
+import logging
+import multiprocessing
+import multiprocessing.shared_memory
+import queue
+import time
+
+import cv2
+import numpy
+
+import budgetpiano.capture
+import budgetpiano.matcher
+import budgetpiano.press
+import budgetpiano.tracking
+
+logger = logging.getLogger(__name__)
+
+FrameMessage = collections.namedtuple("FrameMessage", ["slot", "frame_no", "timestamp", "homography"])
+PressMessage = collections.namedtuple("PressMessage", ["frame_no", "timestamp", "note_ons", "note_offs"])
+
+
+class SharedFrameRing:
+    # Fixed-size frame slots in shared memory. Processes pass slot indices around instead of pickling images, and
+    # a slot only goes back to the free queue once the last stage is done with it.
+    def __init__(self, shape, nof_slots, name=None):
+        self.shape = tuple(shape)
+        self.nof_slots = nof_slots
+        size = nof_slots * int(numpy.prod(self.shape))
+        self.is_owner = name is None
+        self.memory = multiprocessing.shared_memory.SharedMemory(name=name, create=self.is_owner, size=size)
+        self.slots = numpy.ndarray((nof_slots, *self.shape), numpy.uint8, buffer=self.memory.buf)
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def attach(self):
+        return SharedFrameRing(self.shape, self.nof_slots, self.name)
+
+    def __getstate__(self):
+        return (self.shape, self.nof_slots, self.name)
+
+    def __setstate__(self, state):
+        shape, nof_slots, name = state
+        self.__init__(shape, nof_slots, name)
+
+    def close(self):
+        del self.slots
+        self.memory.close()
+        if self.is_owner:
+            self.memory.unlink()
+
+
+def _capture_worker(video_source, ring, free_slots, output_queue, stop_event, policy, nof_dropped):
+    cap = cv2.VideoCapture(video_source)
+    try:
+        while not stop_event.is_set() and cap.isOpened():
+            ret, image = cap.read()
+            if not ret:
+                break
+            timestamp = time.monotonic()
+            frame_no = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+            if image.shape != ring.shape:
+                logger.warning("Dropping frame %d of shape %s, expected %s", frame_no, image.shape, ring.shape)
+                continue
+            if policy == budgetpiano.capture.BLOCK:
+                slot = None
+                while slot is None and not stop_event.is_set():
+                    try:
+                        slot = free_slots.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+                if slot is None:
+                    break
+            else:
+                # All slots are in flight, the workers are behind: skip this frame rather than add latency.
+                try:
+                    slot = free_slots.get_nowait()
+                except queue.Empty:
+                    with nof_dropped.get_lock():
+                        nof_dropped.value += 1
+                    continue
+            ring.slots[slot] = image
+            output_queue.put(FrameMessage(slot, frame_no, timestamp, None))
+    finally:
+        cap.release()
+        output_queue.put(None)
+        ring.close()
+        logger.info("Capture stopped, %d frames dropped", nof_dropped.value)
+
+
+def _stabilization_worker(ring, input_queue, output_queue, backend):
+    video_stabilizer = budgetpiano.matcher.VideoStabilizer(backend)
+    try:
+        for message in iter(input_queue.get, None):
+            stabilization_homography = video_stabilizer.get_homography(ring.slots[message.slot])
+            if stabilization_homography is None:
+                stabilization_homography = numpy.eye(3)
+            output_queue.put(message._replace(homography=stabilization_homography))
+    finally:
+        output_queue.put(None)
+        ring.close()
+
+
+def _refinement_worker(ring, input_queue, output_queue, template, layout, instrument_homography, time_budget):
+    size = (template.shape[1], template.shape[0])
+    homography_tracker = budgetpiano.tracking.HomographyTracker(template, layout, time_budget=time_budget)
+    homography_tracker.reset(instrument_homography)
+    try:
+        for message in iter(input_queue.get, None):
+            stabilization_homography = message.homography
+            x, y, width, height = budgetpiano.tracking.get_roi(
+                size, homography_tracker.homography @ stabilization_homography, ring.shape
+            )
+            instrument_homography = homography_tracker.update(
+                ring.slots[message.slot][y : y + height, x : x + width],
+                stabilization_homography @ budgetpiano.tracking.get_translation(x, y),
+            )
+            output_queue.put(message._replace(homography=instrument_homography @ stabilization_homography))
+    finally:
+        output_queue.put(None)
+        ring.close()
+
+
+def _press_worker(ring, input_queue, output_queue, free_slots, template_size, layout, nof_history_frames):
+    bg_model = cv2.createBackgroundSubtractorMOG2(history=nof_history_frames, detectShadows=False)
+    press_detector = budgetpiano.press.PressDetector(layout)
+    instrument_image = None
+    try:
+        for message in iter(input_queue.get, None):
+            instrument_image = cv2.warpPerspective(
+                ring.slots[message.slot], message.homography, template_size, dst=instrument_image
+            )
+            free_slots.put(message.slot)
+            note_ons, note_offs = press_detector.update(bg_model.apply(instrument_image))
+            output_queue.put(PressMessage(message.frame_no, message.timestamp, note_ons, note_offs))
+    finally:
+        output_queue.put(None)
+        ring.close()
+
+
+class ProcessPipeline:
+    def __init__(
+        self,
+        video_source,
+        frame_shape,
+        template,
+        layout,
+        instrument_homography,
+        nof_slots=8,
+        policy=budgetpiano.capture.DROP_NEWEST,
+        stabilizer_backend="sift",
+        refinement_time_budget=0.02,
+        nof_history_frames=300,
+    ):
+        if policy not in (budgetpiano.capture.DROP_NEWEST, budgetpiano.capture.BLOCK):
+            raise ValueError(f"Overflow policy {policy} is not supported with worker processes")
+        # Spawned rather than forked, so that no OpenCV or GUI threads of the parent end up in the workers.
+        context = multiprocessing.get_context("spawn")
+        self.ring = SharedFrameRing(frame_shape, nof_slots)
+        self.free_slots = context.Queue()
+        for slot in range(nof_slots):
+            self.free_slots.put(slot)
+        self.stop_event = context.Event()
+        # Written by the capture worker, so that dropped frames can be reported by the parent.
+        self.nof_dropped = context.Value("i", 0)
+        # Queues are kept on the pipeline: Process.start drops its arguments before the child has unpickled them.
+        self.queues = [context.Queue() for _ in range(4)]
+        captured, stabilized, refined, self.results = self.queues
+        template_size = (template.shape[1], template.shape[0])
+        self.processes = [
+            context.Process(
+                target=_capture_worker,
+                args=(video_source, self.ring, self.free_slots, captured, self.stop_event, policy, self.nof_dropped),
+                name="capture",
+            ),
+            context.Process(
+                target=_stabilization_worker,
+                args=(self.ring, captured, stabilized, stabilizer_backend),
+                name="stabilization",
+            ),
+            context.Process(
+                target=_refinement_worker,
+                args=(self.ring, stabilized, refined, template, layout, instrument_homography, refinement_time_budget),
+                name="refinement",
+            ),
+            context.Process(
+                target=_press_worker,
+                args=(self.ring, refined, self.results, self.free_slots, template_size, layout, nof_history_frames),
+                name="press_detection",
+            ),
+        ]
+        self.nof_results = 0
+        self.start_time = None
+
+    def start(self):
+        self.start_time = time.monotonic()
+        for process in self.processes:
+            process.start()
+
+    def get_results(self, timeout=1.0):
+        # Yields press results in frame order until the source ends; a worker that dies stops the pipeline.
+        while True:
+            try:
+                result = self.results.get(timeout=timeout)
+            except queue.Empty:
+                dead = [process.name for process in self.processes if process.exitcode not in (None, 0)]
+                if dead:
+                    raise RuntimeError(f"Pipeline worker {', '.join(dead)} exited unexpectedly")
+                continue
+            if result is None:
+                return
+            self.nof_results += 1
+            yield result
+
+    def stop(self, timeout=5.0):
+        # The capture worker sends the end-of-stream marker, which every stage forwards before it exits.
+        self.stop_event.set()
+        deadline = time.monotonic() + timeout
+        while any(process.is_alive() for process in self.processes) and time.monotonic() < deadline:
+            # Workers cannot exit while their output is still queued, so unread results are discarded.
+            with contextlib.suppress(queue.Empty):
+                while True:
+                    self.results.get_nowait()
+            for process in self.processes:
+                process.join(0.05)
+        for process in self.processes:
+            if process.is_alive():
+                logger.warning("Terminating pipeline worker %s", process.name)
+                process.terminate()
+                process.join()
+        self.ring.close()
+
+    def get_stats(self):
+        elapsed = 0.0 if self.start_time is None else time.monotonic() - self.start_time
+        return {
+            "processed_frames": self.nof_results,
+            "processed_fps": self.nof_results / elapsed if elapsed else 0.0,
+            "dropped_frames": self.nof_dropped.value,
+        }
+
+
+@contextlib.contextmanager
+def process_pipeline(*args, **kwargs):
+    pipeline = ProcessPipeline(*args, **kwargs)
+    pipeline.start()
+    try:
+        yield pipeline
+    finally:
+        pipeline.stop()
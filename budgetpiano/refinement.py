@@ -0,0 +1,193 @@
+import time
+
+import cv2
+import numpy
+
+import budgetpiano.frame_context
+import budgetpiano.instrumentation
+from budgetpiano.piano import NO_KEY
+
+
+def to_gray(image):
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return image.astype(numpy.float32)
+
+
+def build_pyramid(image, nof_levels, min_size=16):
+    pyramid = [image]
+    while len(pyramid) < nof_levels and min(pyramid[-1].shape[:2]) >= 2 * min_size:
+        pyramid.append(cv2.pyrDown(pyramid[-1]))
+    return pyramid
+
+
+def get_white_key_width(layout):
+    is_white = ~layout.is_black
+    return float(numpy.median(layout.right[is_white] - layout.left[is_white]))
+
+
+def build_template_pyramid(template, layout, nof_levels=4, min_key_width=4.0):
+    # On levels where a white key is only a few pixels wide, ECC locks onto a neighbouring key as readily as onto
+    # the right one, so levels are only added while the white keys stay min_key_width pixels wide.
+    gray = to_gray(template)
+    min_size = min_key_width * min(gray.shape[:2]) / get_white_key_width(layout)
+    return build_pyramid(gray, nof_levels, min_size)
+
+
+def get_corner_shift(size, homography, other_homography):
+    # Largest distance in the template that a template corner moves by between two image-to-template homographies.
+    width, height = size
+    corners = numpy.float32([[[0, 0], [width, 0], [width, height], [0, height]]])
+    moved = cv2.perspectiveTransform(cv2.perspectiveTransform(corners, numpy.linalg.inv(homography)), other_homography)
+    return float(numpy.linalg.norm(moved - corners, axis=-1).max())
+
+
+def get_key_means(warped, layout, top, bottom):
+    # Mean intensity of every key over the rows [top, bottom) of a frame warped into the template.
+    labels = layout.labels[top:bottom].ravel()
+    is_key = labels != NO_KEY
+    nof_keys = len(layout.midi)
+    sums = numpy.bincount(labels[is_key], weights=warped[top:bottom].ravel()[is_key], minlength=nof_keys)
+    return sums / numpy.maximum(numpy.bincount(labels[is_key], minlength=nof_keys), 1)
+
+
+def get_black_key_check(gray, homography, layout, min_contrast=30.0, min_front=0.75):
+    # Structural check, as the fraction of keys that pass: along the keyboard, every black key must be clearly
+    # darker than the white keys next to it, and the front of every white key about as bright as they are between
+    # the black keys. A homography that is off by a key breaks the periodic pattern, one that is upside down misses
+    # the fronts.
+    black_keys = numpy.flatnonzero(layout.is_black)
+    white_keys = numpy.flatnonzero(~layout.is_black)
+    if len(black_keys) == 0:
+        return 0.0
+    warped = cv2.warpPerspective(gray, homography, (layout.width, layout.height))
+    black_top, black_bottom = layout.top[black_keys].max() + 1, layout.bottom[black_keys].min()
+    means = get_key_means(warped, layout, black_top, black_bottom)
+    neighbours = numpy.clip(numpy.stack([black_keys - 1, black_keys + 1]), 0, len(layout.midi) - 1)
+    is_darker = (means[neighbours] - means[black_keys] >= min_contrast).all(axis=0)
+    front_means = get_key_means(warped, layout, layout.bottom[black_keys].max() + 2, layout.bottom[white_keys].min())
+    # The fronts are compared with the white keys between the black keys rather than just with the black keys, so
+    # that a textured background next to the keyboard does not pass for them.
+    black_level = numpy.median(means[black_keys])
+    white_level = numpy.median(means[white_keys])
+    is_brighter = front_means[white_keys] - black_level >= max(min_contrast, min_front * (white_level - black_level))
+    return float((is_darker.sum() + is_brighter.sum()) / (len(black_keys) + len(white_keys)))
+
+
+def get_scaling(from_shape, to_shape):
+    return numpy.diag([to_shape[1] / from_shape[1], to_shape[0] / from_shape[0], 1.0])
+
+
+def _normalized(homography):
+    return homography / homography[2, 2]
+
+
+def refine_homography(
+    image,
+    template,
+    homography,
+    layout,
+    nof_levels=4,
+    max_iterations=50,
+    epsilon=1e-4,
+    time_budget=None,
+    template_pyramid=None,
+    buffer_pool=None,
+    max_shift=0.5,
+    min_check=0.9,
+):
+    start = time.perf_counter()
+    if template_pyramid is None:
+        template_pyramid = build_template_pyramid(template, layout, nof_levels)
+    # The image can be a FrameContext, which keeps the pyramid for other stages that refine in the same frame.
+    image_pyramid = budgetpiano.frame_context.as_frame_context(image, buffer_pool, "refinement").get_pyramid(
+        len(template_pyramid)
+    )
+    nof_levels = min(len(template_pyramid), len(image_pyramid))
+    criteria = (cv2.TERM_CRITERIA_COUNT | cv2.TERM_CRITERIA_EPS, max_iterations, epsilon)
+
+    # ECC estimates the template-to-image warp, which is the inverse of the instrument homography.
+    warp = numpy.linalg.inv(homography)
+    for level in reversed(range(nof_levels)):
+        if time_budget is not None and level < nof_levels - 1 and time.perf_counter() - start > time_budget:
+            break
+        template_scaling = get_scaling(template_pyramid[0].shape, template_pyramid[level].shape)
+        image_scaling = get_scaling(image_pyramid[0].shape, image_pyramid[level].shape)
+        level_warp = (image_scaling @ warp @ numpy.linalg.inv(template_scaling)).astype(numpy.float32)
+        # Smoothing widens the basin of convergence on coarse levels; the finest level is left sharp for precision.
+        gauss_filter_size = 5 if level > 0 else 1
+        try:
+            _, level_warp = cv2.findTransformECC(
+                template_pyramid[level],
+                image_pyramid[level],
+                level_warp,
+                cv2.MOTION_HOMOGRAPHY,
+                criteria,
+                None,
+                gauss_filter_size,
+            )
+        except cv2.error:
+            budgetpiano.instrumentation.count("refinement_failed_levels")
+            continue
+        budgetpiano.instrumentation.count("refinement_levels")
+        warp = numpy.linalg.inv(image_scaling) @ level_warp.astype(numpy.float64) @ template_scaling
+
+    refined = _normalized(numpy.linalg.inv(warp))
+    # The periodic key pattern has local optima a key apart, which correlate about as well as the initial estimate
+    # when that is a few pixels off. A refinement that moves the keyboard by more than max_shift white keys is only
+    # kept when the keys line up with the layout.
+    size = (template_pyramid[0].shape[1], template_pyramid[0].shape[0])
+    if get_corner_shift(size, homography, refined) > max_shift * get_white_key_width(layout):
+        if get_black_key_check(image_pyramid[0], refined, layout) < min_check:
+            budgetpiano.instrumentation.count("refinement_rejected")
+            return homography
+    return refined
+
+
+class PreparedTemplate:
+    def __init__(self, template, mask=None):
+        self.template = template
+        self.size = (template.shape[1], template.shape[0])
+        if mask is None:
+            self.roi = (0, 0, *self.size)
+        else:
+            self.roi = cv2.boundingRect((mask > 0).astype(numpy.uint8))
+        x, y, width, height = self.roi
+        self.roi_size = (width, height)
+        self.roi_offset = numpy.array([[1.0, 0.0, -x], [0.0, 1.0, -y], [0.0, 0.0, 1.0]])
+
+        roi_template = template[y : y + height, x : x + width]
+        if mask is None:
+            self.mask_vector = None
+        else:
+            roi_mask = mask[y : y + height, x : x + width] > 0
+            if roi_template.ndim == 3:
+                roi_mask = numpy.repeat(roi_mask[..., None], roi_template.shape[2], axis=2)
+            self.mask_vector = roi_mask.astype(numpy.float32).ravel()
+
+        vector = roi_template.astype(numpy.float32).ravel()
+        if self.mask_vector is not None:
+            vector *= self.mask_vector
+        norm = cv2.norm(vector)
+        self.is_valid = norm > 0
+        self.vector = vector / norm if self.is_valid else vector
+
+        self.warp_buffer = numpy.empty(roi_template.shape, template.dtype)
+        self.float_buffer = numpy.empty(self.vector.shape, numpy.float32)
+
+    def warp(self, source, homography):
+        return cv2.warpPerspective(source, self.roi_offset @ homography, self.roi_size, dst=self.warp_buffer)
+
+    def cost(self, source, homography):
+        if not self.is_valid:
+            return 2.0
+        destination = self.float_buffer
+        numpy.copyto(destination, self.warp(source, homography).ravel())
+        if self.mask_vector is not None:
+            destination *= self.mask_vector
+        destination_norm = cv2.norm(destination)
+        if destination_norm == 0:
+            return 2.0
+        destination *= 1.0 / destination_norm
+        # For unit vectors (1 - cos) / 2 == |a - b|^2 / 4, which avoids cancellation when the match is close.
+        return cv2.norm(destination, self.vector, cv2.NORM_L2SQR) / 4.0
@@ -0,0 +1,135 @@
+import collections
+import time
+
+import budgetpiano.instrumentation
+
+Settings = collections.namedtuple("Settings", ["refresh_interval", "working_scale", "min_frame_interval"])
+
+# Ordered from full quality to the cheapest: refinement frequency goes first, then resolution, then frame rate.
+DEGRADATION_LEVELS = (
+    Settings(30, 1.0, 0.0),
+    Settings(60, 1.0, 0.0),
+    Settings(120, 1.0, 0.0),
+    Settings(120, 0.75, 0.0),
+    Settings(120, 0.5, 0.0),
+    Settings(120, 0.5, 1.0 / 15.0),
+    Settings(120, 0.5, 1.0 / 10.0),
+    Settings(120, 0.5, 1.0 / 5.0),
+)
+
+
+class StageTimer:
+    __slots__ = ("scheduler", "name", "span", "start")
+
+    def __init__(self, scheduler, name):
+        self.scheduler = scheduler
+        self.name = name
+        self.span = budgetpiano.instrumentation.span(name)
+        self.start = None
+
+    def __enter__(self):
+        self.span.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.scheduler.add_cost(self.name, time.perf_counter() - self.start)
+        return self.span.__exit__(*exc_info)
+
+
+class LatencyScheduler:
+    def __init__(self, target_latency=0.1, levels=DEGRADATION_LEVELS, smoothing=0.1, cooldown=15, headroom=0.7):
+        self.target_latency = target_latency
+        self.levels = levels
+        self.smoothing = smoothing
+        self.cooldown = cooldown
+        self.headroom = headroom
+        self.level = 0
+        self.costs = dict()
+        self.frame_costs = dict()
+        self.latency = None
+        self.last_processed_timestamp = None
+        self.nof_frames_since_change = 0
+        self.nof_skipped = 0
+
+    @property
+    def settings(self):
+        return self.levels[self.level]
+
+    def measure(self, name):
+        # Times a stage for the cost model and records it as an instrumentation span.
+        return StageTimer(self, name)
+
+    def add_cost(self, name, seconds):
+        self.frame_costs[name] = self.frame_costs.get(name, 0.0) + seconds
+
+    def _smooth(self, average, value):
+        return value if average is None else average + self.smoothing * (value - average)
+
+    def should_process(self, timestamp):
+        if (
+            self.last_processed_timestamp is not None
+            and timestamp - self.last_processed_timestamp < self.settings.min_frame_interval
+        ):
+            self.nof_skipped += 1
+            budgetpiano.instrumentation.count("scheduler_skipped_frames")
+            return False
+        self.last_processed_timestamp = timestamp
+        return True
+
+    def get_predicted_latency(self, level):
+        # Stabilization cost scales with the number of pixels, the amortized cost of refinement with its frequency.
+        # Everything else, including waiting for the frame, is assumed not to change.
+        current = self.settings
+        settings = self.levels[level]
+        stabilization = self.costs.get("stabilization", 0.0)
+        tracking = self.costs.get("homography_tracking", 0.0)
+        return (
+            self.latency
+            - stabilization
+            - tracking
+            + stabilization * (settings.working_scale / current.working_scale) ** 2
+            + tracking * current.refresh_interval / settings.refresh_interval
+        )
+
+    def finish_frame(self, timestamp):
+        # Called once a frame has been fully processed; timestamp is when it was captured.
+        for name, seconds in self.frame_costs.items():
+            self.costs[name] = self._smooth(self.costs.get(name), seconds)
+        self.frame_costs.clear()
+        self.latency = self._smooth(self.latency, time.monotonic() - timestamp)
+        self.nof_frames_since_change += 1
+
+        if self.nof_frames_since_change >= self.cooldown:
+            if self.latency > self.target_latency and self.level < len(self.levels) - 1:
+                self._set_level(self.level + 1)
+            elif self.level > 0 and self.get_predicted_latency(self.level - 1) < self.headroom * self.target_latency:
+                self._set_level(self.level - 1)
+        self._publish()
+
+    def discard_frame(self):
+        self.frame_costs.clear()
+
+    def _set_level(self, level):
+        self.level = level
+        self.nof_frames_since_change = 0
+
+    def _publish(self):
+        settings = self.settings
+        budgetpiano.instrumentation.gauge("scheduler_level", self.level)
+        budgetpiano.instrumentation.gauge("scheduler_latency_ms", round(1000.0 * self.latency, 2))
+        budgetpiano.instrumentation.gauge("refresh_interval", settings.refresh_interval)
+        budgetpiano.instrumentation.gauge("working_scale", settings.working_scale)
+        budgetpiano.instrumentation.gauge("min_frame_interval_ms", round(1000.0 * settings.min_frame_interval, 2))
+
+    def get_stats(self):
+        settings = self.settings
+        return {
+            "level": self.level,
+            "latency_ms": 0.0 if self.latency is None else 1000.0 * self.latency,
+            "refresh_interval": settings.refresh_interval,
+            "working_scale": settings.working_scale,
+            "min_frame_interval_ms": 1000.0 * settings.min_frame_interval,
+            "skipped_frames": self.nof_skipped,
+            **{f"{name}_ms": 1000.0 * cost for name, cost in sorted(self.costs.items())},
+        }
@@ -0,0 +1,116 @@
+import collections
+import json
+import logging
+import os
+import pathlib
+import tempfile
+import zipfile
+
+import numpy
+
+import budgetpiano.refinement
+import budgetpiano.tracking
+from budgetpiano.piano import PianoLayout
+
+logger = logging.getLogger(__name__)
+
+SESSION_VERSION = 1
+
+Session = collections.namedtuple(
+    "Session",
+    ["template", "layout", "instrument_homography", "residual", "stabilizer_backend", "keyframe", "background"],
+)
+
+
+def save_session(path, session):
+    # Everything needed to skip the dialogs and the corner search next time, as one compressed npz file.
+    path = pathlib.Path(path)
+    arrays = {
+        "metadata": numpy.array(
+            json.dumps(
+                {
+                    "version": SESSION_VERSION,
+                    "residual": session.residual,
+                    "stabilizer_backend": session.stabilizer_backend,
+                    "width": session.layout.width,
+                    "height": session.layout.height,
+                    "velvet_height": session.layout.velvet_height,
+                }
+            )
+        ),
+        "template": session.template,
+        "instrument_homography": session.instrument_homography,
+    }
+    for field in ("left", "top", "right", "bottom", "midi", "is_black", "labels"):
+        arrays[f"layout_{field}"] = getattr(session.layout, field)
+    if session.keyframe is not None:
+        arrays.update(session.keyframe)
+    if session.background is not None:
+        arrays["background"] = session.background
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temporary_path = tempfile.mkstemp(suffix=".tmp", dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb") as file:
+            numpy.savez_compressed(file, **arrays)
+        os.replace(temporary_path, path)
+    except BaseException:
+        pathlib.Path(temporary_path).unlink(missing_ok=True)
+        raise
+
+
+def load_session(path):
+    try:
+        with numpy.load(path) as data:
+            metadata = json.loads(str(data["metadata"]))
+            if metadata["version"] != SESSION_VERSION:
+                logger.warning("Ignoring session %s with version %s", path, metadata["version"])
+                return None
+            layout = PianoLayout(
+                metadata["width"],
+                metadata["height"],
+                metadata["velvet_height"],
+                *(
+                    data[f"layout_{field}"]
+                    for field in ("left", "top", "right", "bottom", "midi", "is_black", "labels")
+                ),
+            )
+            keyframe = None
+            if "keyframe_points" in data:
+                keyframe = {
+                    name: data[name]
+                    for name in ("keyframe_points", "keyframe_descriptors", "keyframe_homography", "keyframe_scale")
+                }
+            return Session(
+                data["template"],
+                layout,
+                data["instrument_homography"],
+                metadata["residual"],
+                metadata["stabilizer_backend"],
+                keyframe,
+                data["background"] if "background" in data else None,
+            )
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile) as error:
+        logger.warning("Could not load session %s: %s", path, error)
+        return None
+
+
+def verify_session(session, image, stabilization_homography, max_residual_increase=0.25):
+    # Cheap check that the saved instrument homography still fits the keyboard in this frame. A single ECC
+    # refinement is tried before giving up, which covers a camera or keyboard that was nudged between sessions.
+    # Returns the homography to use, in stabilized coordinates, or None if a full calibration is needed.
+    homography_tracker = budgetpiano.tracking.HomographyTracker(session.template, session.layout)
+    max_residual = session.residual * (1.0 + max_residual_increase)
+    homography = session.instrument_homography
+    residual = homography_tracker.get_residual(image, homography @ stabilization_homography)
+    if residual <= max_residual:
+        return homography
+    logger.info("Saved instrument homography is off by residual %.4f > %.4f, refining", residual, max_residual)
+    refined = budgetpiano.refinement.refine_homography(
+        image, session.template, homography @ stabilization_homography, session.layout, time_budget=None
+    )
+    residual = homography_tracker.get_residual(image, refined)
+    if residual <= max_residual:
+        return refined @ numpy.linalg.inv(stabilization_homography)
+    logger.info("Refined instrument homography is still off by residual %.4f, calibrating again", residual)
+    return None
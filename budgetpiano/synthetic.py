@@ -0,0 +1,156 @@
+import collections
+
+import cv2
+import numpy
+
+from budgetpiano.piano import _get_piano
+
+Press = collections.namedtuple("Press", ["start", "end", "x", "y", "note"])
+SyntheticFrame = collections.namedtuple(
+    "SyntheticFrame", ["frame_no", "timestamp", "image", "homography", "stabilization_homography", "pressed"]
+)
+
+
+def get_corners(image):
+    height, width = image.shape[:2]
+    return numpy.float32([[0, 0], [width, 0], [width, height], [0, height]])
+
+
+def get_random_placement(template, frame_size, rng, margin=0.08, perspective=0.05):
+    frame_width, frame_height = frame_size
+    template_height, template_width = template.shape[:2]
+    width = frame_width * (1.0 - 2.0 * margin)
+    height = width * template_height / template_width * rng.uniform(1.0, 2.0)
+    left = frame_width * margin
+    top = rng.uniform(0.3, 0.6) * (frame_height - height)
+    frame_corners = numpy.float32(
+        [[left, top], [left + width, top], [left + width, top + height], [left, top + height]]
+    )
+    frame_corners += rng.normal(0.0, perspective * height, frame_corners.shape).astype(numpy.float32)
+    # Maps template coordinates to scene coordinates.
+    return cv2.getPerspectiveTransform(get_corners(template), frame_corners).astype(numpy.float64)
+
+
+def get_shake(frame_size, rng, amplitude):
+    frame_width, frame_height = frame_size
+    corners = numpy.float32([[0, 0], [frame_width, 0], [frame_width, frame_height], [0, frame_height]])
+    offset = rng.normal(0.0, amplitude, 2)
+    jitter = rng.normal(0.0, amplitude / 4.0, corners.shape)
+    return cv2.getPerspectiveTransform(corners, (corners + offset + jitter).astype(numpy.float32)).astype(numpy.float64)
+
+
+def get_background(frame_size, rng):
+    frame_width, frame_height = frame_size
+    noise = (rng.random((frame_height, frame_width)) * 255).astype(numpy.uint8)
+    texture = cv2.equalizeHist(cv2.GaussianBlur(noise, (0, 0), 4))
+    return cv2.applyColorMap(texture, cv2.COLORMAP_BONE)
+
+
+def get_key_press_point(layout, key_no):
+    # Fingers land on the front of white keys, below the black keys, and halfway down black keys.
+    x = (layout.left[key_no] + layout.right[key_no]) / 2.0
+    depth = 0.6 if layout.is_black[key_no] else 0.85
+    y = layout.top[key_no] + depth * (layout.bottom[key_no] - layout.top[key_no])
+    return float(x), float(y)
+
+
+def get_random_presses(template, duration, rng, nof_presses=10, min_length=0.2, max_length=0.6, layout=None):
+    height, width = template.shape[:2]
+    starts = numpy.sort(rng.uniform(0.0, max(0.0, duration - max_length), nof_presses))
+    presses = []
+    for start in starts.tolist():
+        end = start + float(rng.uniform(min_length, max_length))
+        if layout is None:
+            presses.append(Press(start, end, float(rng.uniform(0.02, 0.98) * width), 0.8 * height, None))
+        else:
+            key_no = rng.integers(len(layout.midi))
+            presses.append(Press(start, end, *get_key_press_point(layout, key_no), int(layout.midi[key_no])))
+    return presses
+
+
+def draw_hands(image, presses, timestamp, radius, color=(120, 150, 220), approach=0.3):
+    # A press is a fingertip blob resting on (x, y). Before that it slides in from the front edge of the keyboard.
+    pressed = []
+    front = image.shape[0] + 2 * radius
+    for press in presses:
+        if press.start <= timestamp < press.end:
+            center = (press.x, press.y)
+            pressed.append(press)
+        elif press.start - approach <= timestamp < press.start:
+            progress = (timestamp - press.start + approach) / approach
+            center = (press.x, front + progress * (press.y - front))
+        else:
+            continue
+        axes = (int(radius), int(2 * radius))
+        cv2.ellipse(image, (int(center[0]), int(center[1])), axes, 0.0, 0.0, 360.0, color, cv2.FILLED)
+    return pressed
+
+
+def generate_video(
+    template=None,
+    layout=None,
+    frame_size=(1280, 720),
+    fps=30.0,
+    duration=5.0,
+    presses=None,
+    shake=2.0,
+    noise=4.0,
+    lighting=0.1,
+    lighting_period=20.0,
+    approach=0.3,
+    seed=0,
+):
+    rng = numpy.random.default_rng(seed)
+    if template is None:
+        template, layout = _get_piano(return_layout=True)
+    if presses is None:
+        presses = get_random_presses(template, duration, rng, layout=layout)
+    placement = get_random_placement(template, frame_size, rng)
+    background = get_background(frame_size, rng)
+    radius = max(2.0, template.shape[0] / 12.0)
+    lighting_phase = rng.uniform(0.0, 2.0 * numpy.pi)
+
+    for frame_no in range(int(round(duration * fps))):
+        timestamp = frame_no / fps
+        instrument = template.copy()
+        pressed = draw_hands(instrument, presses, timestamp, radius, approach=approach)
+
+        scene = background.copy()
+        cv2.warpPerspective(instrument, placement, frame_size, dst=scene, borderMode=cv2.BORDER_TRANSPARENT)
+        shake_homography = numpy.eye(3) if frame_no == 0 else get_shake(frame_size, rng, shake)
+        image = cv2.warpPerspective(scene, shake_homography, frame_size, borderMode=cv2.BORDER_REFLECT)
+
+        gain = 1.0 + lighting * numpy.sin(2.0 * numpy.pi * timestamp / lighting_period + lighting_phase)
+        image = image.astype(numpy.float32) * gain + rng.normal(0.0, noise, image.shape).astype(numpy.float32)
+        image = numpy.clip(image, 0, 255).astype(numpy.uint8)
+
+        # Ground truth: frame to template, and frame to the first (unshaken) frame.
+        homography = numpy.linalg.inv(shake_homography @ placement)
+        yield SyntheticFrame(
+            frame_no, timestamp, image, homography / homography[2, 2], numpy.linalg.inv(shake_homography), pressed
+        )
+
+
+def write_video(path, frames, fps=30.0, fourcc="MJPG"):
+    # Writes the images of generated frames to a video file, for code that reads from a path or a capture device.
+    writer = None
+    try:
+        for frame in frames:
+            if writer is None:
+                height, width = frame.image.shape[:2]
+                writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*fourcc), fps, (width, height))
+                if not writer.isOpened():
+                    raise ValueError(f"Could not open {path} for writing")
+            writer.write(frame.image)
+    finally:
+        if writer is not None:
+            writer.release()
+
+
+def get_corner_error(size, homography, true_homography):
+    # Both homographies map frame coordinates to a reference of the given size; the error is measured in the frame.
+    width, height = size
+    corners = numpy.float32([[[0, 0], [width, 0], [width, height], [0, height]]])
+    estimated = cv2.perspectiveTransform(corners, numpy.linalg.inv(homography))
+    expected = cv2.perspectiveTransform(corners, numpy.linalg.inv(true_homography))
+    return float(numpy.linalg.norm(estimated - expected, axis=-1).max())
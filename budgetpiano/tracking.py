@@ -0,0 +1,146 @@
+import cv2
+import numpy
+
+import budgetpiano.frame_context
+import budgetpiano.instrumentation
+import budgetpiano.refinement
+
+
+def to_parameters(homography):
+    return (homography / homography[2, 2]).ravel()[:8]
+
+
+def to_homography(parameters):
+    return numpy.append(parameters, 1.0).reshape(3, 3)
+
+
+def get_translation(x, y):
+    return numpy.array([[1.0, 0.0, x], [0.0, 1.0, y], [0.0, 0.0, 1.0]])
+
+
+def get_roi(size, homography, image_shape, margin=0.1):
+    # Bounding box in the image of the template (of the given size) projected through the image-to-template homography,
+    # grown by a fraction of its size so that the keyboard stays inside while it moves.
+    width, height = size
+    corners = numpy.float32([[[0, 0], [width, 0], [width, height], [0, height]]])
+    projected = cv2.perspectiveTransform(corners, numpy.linalg.inv(homography))[0]
+    low = projected.min(axis=0)
+    high = projected.max(axis=0)
+    padding = margin * (high - low)
+    left, top = numpy.maximum(numpy.floor(low - padding), 0).astype(int)
+    right, bottom = numpy.minimum(numpy.ceil(high + padding), (image_shape[1], image_shape[0])).astype(int)
+    if right <= left or bottom <= top:
+        return 0, 0, image_shape[1], image_shape[0]
+    return int(left), int(top), int(right - left), int(bottom - top)
+
+
+class HomographyTracker:
+    def __init__(
+        self,
+        template,
+        layout,
+        template_pyramid=None,
+        time_budget=None,
+        max_residual_increase=0.25,
+        refresh_interval=30,
+        velocity_damping=0.5,
+        residual_size=128,
+        buffer_pool=None,
+    ):
+        self.template = template
+        self.layout = layout
+        self.template_pyramid = template_pyramid
+        if self.template_pyramid is None:
+            self.template_pyramid = budgetpiano.refinement.build_template_pyramid(template, layout)
+        self.time_budget = time_budget
+        self.max_residual_increase = max_residual_increase
+        self.refresh_interval = refresh_interval
+        self.velocity_damping = velocity_damping
+        self.buffer_pool = buffer_pool
+
+        # The residual is measured on a small copy of the template, warping straight from the full-size frame.
+        scale = min(1.0, residual_size / max(template.shape[:2]))
+        small_template = cv2.resize(template, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        self.residual_template = budgetpiano.refinement.PreparedTemplate(small_template)
+        self.residual_scaling = budgetpiano.refinement.get_scaling(template.shape, small_template.shape)
+
+        self.parameters = None
+        self.refined_parameters = None
+        self.velocity = numpy.zeros(8)
+        self.reference_residual = None
+        self.residual = None
+        self.nof_frames_since_refinement = 0
+        self.nof_predicted = 0
+        self.nof_refined = 0
+
+    @property
+    def homography(self):
+        return None if self.parameters is None else to_homography(self.parameters)
+
+    def get_residual(self, image, homography):
+        image = budgetpiano.frame_context.as_frame_context(image).image
+        return self.residual_template.cost(image, self.residual_scaling @ homography)
+
+    def reset(self, homography):
+        self.parameters = to_parameters(homography)
+        self.refined_parameters = self.parameters
+        self.velocity = numpy.zeros(8)
+        self.reference_residual = None
+        self.nof_frames_since_refinement = 0
+
+    def predict(self):
+        return to_homography(self.parameters + self.velocity)
+
+    def update(self, image, image_homography=None):
+        # The tracked homography maps reference coordinates to the template. image_homography maps the given image
+        # into the reference, so the image can be a crop of a frame that has not been stabilized. A FrameContext crop
+        # lets the refinement reuse the grayscale of the whole frame.
+        image = budgetpiano.frame_context.as_frame_context(image, self.buffer_pool, "tracking")
+        to_reference = numpy.eye(3) if image_homography is None else image_homography
+        predicted = self.predict()
+        self.residual = self.get_residual(image, predicted @ to_reference)
+        self.nof_frames_since_refinement += 1
+        is_stale = self.nof_frames_since_refinement >= self.refresh_interval
+        if (
+            self.reference_residual is not None
+            and not is_stale
+            and self.residual <= self.reference_residual * (1.0 + self.max_residual_increase)
+        ):
+            self.nof_predicted += 1
+            budgetpiano.instrumentation.count("predicted_frames")
+            self.parameters = to_parameters(predicted)
+            return predicted
+
+        with budgetpiano.instrumentation.span("refinement"):
+            refined = budgetpiano.refinement.refine_homography(
+                image,
+                self.template,
+                predicted @ to_reference,
+                self.layout,
+                time_budget=self.time_budget,
+                template_pyramid=self.template_pyramid,
+                buffer_pool=self.buffer_pool,
+            )
+        self.nof_refined += 1
+        budgetpiano.instrumentation.count("refined_frames")
+        refined = refined @ numpy.linalg.inv(to_reference)
+        parameters = to_parameters(refined)
+        if self.reference_residual is not None:
+            # Constant velocity per frame, estimated between refinements and damped so that noise does not build up.
+            # It is measured from the last refinement, not from the last prediction, which already includes it.
+            velocity = (parameters - self.refined_parameters) / self.nof_frames_since_refinement
+            self.velocity = self.velocity_damping * velocity
+        self.parameters = parameters
+        self.refined_parameters = parameters
+        self.residual = self.get_residual(image, refined @ to_reference)
+        self.reference_residual = self.residual
+        self.nof_frames_since_refinement = 0
+        return to_homography(parameters)
+
+    def get_stats(self):
+        nof_frames = self.nof_predicted + self.nof_refined
+        return {
+            "predicted_frames": self.nof_predicted,
+            "refined_frames": self.nof_refined,
+            "predicted_fraction": self.nof_predicted / nof_frames if nof_frames else 0.0,
+        }
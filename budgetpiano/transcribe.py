@@ -0,0 +1,227 @@
+import argparse
+import concurrent.futures
+import itertools
+import json
+import logging
+import math
+import multiprocessing
+import time
+
+import cv2
+import mido
+import numpy
+
+import budgetpiano.buffers
+import budgetpiano.frame_context
+import budgetpiano.homography
+import budgetpiano.matcher
+import budgetpiano.press
+import budgetpiano.tracking
+from budgetpiano.piano import _get_piano
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = dict(
+    white_key_width_px=10,
+    nof_keys=88,
+    start_key_pitchclass=9,
+    start_key_midi=None,
+    corners=None,
+    stabilizer="sift",
+    chunk_duration=10.0,
+    overlap=2.0,
+    workers=None,
+    channel=0,
+    velocity=64,
+)
+
+
+def get_chunks(nof_frames, chunk_length, overlap):
+    # Each chunk owns the frames [start, stop) and is read from start - overlap, so that the background model and
+    # the press detector have settled by the time its own frames come.
+    return [
+        (max(0, start - overlap), start, min(start + chunk_length, nof_frames))
+        for start in range(0, nof_frames, chunk_length)
+    ]
+
+
+def transcribe_chunk(
+    video_path, template_parameters, reference_frame, instrument_homography, chunk, stabilizer_backend, fps
+):
+    first, start, stop = chunk
+    template, layout = _get_piano(**template_parameters, return_layout=True)
+    size = (template.shape[1], template.shape[0])
+    buffer_pool = budgetpiano.buffers.BufferPool()
+    video_stabilizer = budgetpiano.matcher.VideoStabilizer(stabilizer_backend, buffer_pool=buffer_pool)
+    # Every chunk is stabilized against the first frame of the video, which the instrument homography was found in.
+    video_stabilizer.get_homography(reference_frame)
+    homography_tracker = budgetpiano.tracking.HomographyTracker(template, layout, time_budget=None)
+    homography_tracker.reset(instrument_homography)
+    bg_model = cv2.createBackgroundSubtractorMOG2(history=int(fps * 10.0), detectShadows=False)
+    press_detector = budgetpiano.press.PressDetector(layout)
+    # Keys held at each owned frame; the chunks are stitched by concatenating these. A chunk without a stop runs to
+    # the end of the video, so the rows are collected as they come.
+    pressed = []
+
+    cap = cv2.VideoCapture(video_path)
+    try:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, first)
+        position = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+        if position != first:
+            # Seeking is only approximate with some codecs; the frames up to the chunk are decoded instead.
+            logger.warning("Seeking to frame %d ended at frame %d, reading from the start instead", first, position)
+            cap.release()
+            cap = cv2.VideoCapture(video_path)
+            for _ in range(first):
+                cap.grab()
+        instrument_image = None
+        for frame_no in itertools.count(first) if stop is None else range(first, stop):
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frame_context = budgetpiano.frame_context.FrameContext(frame, buffer_pool)
+            stabilization_homography = video_stabilizer.get_homography(frame_context)
+            if frame_no == first and video_stabilizer.nof_tracked_points < video_stabilizer.min_tracked_points:
+                # The camera moved too far since the first frame; the tracker's refinement has to make up for it.
+                logger.warning("Frame %d could not be stabilized against the first frame", frame_no)
+            x, y, width, height = budgetpiano.tracking.get_roi(
+                size, homography_tracker.homography @ stabilization_homography, frame.shape
+            )
+            homography = homography_tracker.update(
+                frame_context.crop(x, y, width, height),
+                stabilization_homography @ budgetpiano.tracking.get_translation(x, y),
+            )
+            instrument_image = cv2.warpPerspective(
+                frame, homography @ stabilization_homography, size, dst=instrument_image
+            )
+            press_detector.update(bg_model.apply(instrument_image))
+            if frame_no >= start:
+                pressed.append(press_detector.is_pressed.copy())
+    finally:
+        cap.release()
+    pressed = numpy.array(pressed, bool).reshape(-1, len(layout.midi))
+    if stop is not None and len(pressed) < stop - start:
+        # A short chunk would shift every later note of the stitched timeline, so the last state is held instead.
+        logger.warning("Chunk %d-%d ended after %d of its frames, holding the last state", start, stop, len(pressed))
+        last = pressed[-1:] if len(pressed) else numpy.zeros((1, len(layout.midi)), bool)
+        pressed = numpy.vstack([pressed, numpy.repeat(last, stop - start - len(pressed), axis=0)])
+    return pressed
+
+
+def to_midi_file(pressed, midi, fps, channel=0, velocity=64, ticks_per_beat=480, tempo=500000):
+    # Note events are the changes of the stitched key state; notes still held at the end are released there.
+    padded = numpy.vstack([numpy.zeros((1, pressed.shape[1]), bool), pressed, numpy.zeros((1, pressed.shape[1]), bool)])
+    changes = numpy.diff(padded.astype(numpy.int8), axis=0)
+    frame_nos, keys = numpy.nonzero(changes)
+    midi_file = mido.MidiFile(ticks_per_beat=ticks_per_beat)
+    track = mido.MidiTrack()
+    midi_file.tracks.append(track)
+    track.append(mido.MetaMessage("set_tempo", tempo=tempo, time=0))
+    last_tick = 0
+    # numpy.nonzero is row-major, so events come out in frame order; releases go before presses within a frame.
+    order = numpy.lexsort((changes[frame_nos, keys], frame_nos))
+    for frame_no, key in zip(frame_nos[order].tolist(), keys[order].tolist()):
+        tick = int(round(mido.second2tick(frame_no / fps, ticks_per_beat, tempo)))
+        note = int(midi[key])
+        if changes[frame_no, key] > 0:
+            message = mido.Message("note_on", channel=channel, note=note, velocity=velocity, time=tick - last_tick)
+        else:
+            message = mido.Message("note_off", channel=channel, note=note, time=tick - last_tick)
+        track.append(message)
+        last_tick = tick
+    return midi_file
+
+
+def transcribe(video_path, config):
+    config = {**DEFAULT_CONFIG, **config}
+    if config["corners"] is None:
+        raise ValueError("The keyboard corners in the video are needed, e.g. from a calibration config file")
+    template_parameters = {
+        name: config[name] for name in ("white_key_width_px", "nof_keys", "start_key_pitchclass", "start_key_midi")
+    }
+    template, layout = _get_piano(**template_parameters, return_layout=True)
+
+    cap = cv2.VideoCapture(video_path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        nof_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        ret, frame = cap.read()
+    finally:
+        cap.release()
+    if not ret:
+        raise ValueError(f"Could not read a frame from {video_path}")
+    corners = numpy.float32(config["corners"]).reshape(4, 2)
+    instrument_homography = budgetpiano.homography.find_homography(frame, template, corners)
+
+    if nof_frames <= 0:
+        # Without a frame count the video cannot be split; it is read in one go instead.
+        chunks = [(0, 0, None)]
+        logger.info("Transcribing a video of unknown length in one chunk")
+    else:
+        chunks = get_chunks(
+            nof_frames, max(1, int(config["chunk_duration"] * fps)), int(math.ceil(config["overlap"] * fps))
+        )
+        logger.info("Transcribing %d frames in %d chunks", nof_frames, len(chunks))
+
+    start_time = time.monotonic()
+    with concurrent.futures.ProcessPoolExecutor(
+        config["workers"], mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = [
+            executor.submit(
+                transcribe_chunk,
+                video_path,
+                template_parameters,
+                frame,
+                instrument_homography,
+                chunk,
+                config["stabilizer"],
+                fps,
+            )
+            for chunk in chunks
+        ]
+        pressed = numpy.vstack([future.result() for future in futures])
+    elapsed = time.monotonic() - start_time
+    logger.info("Transcribed %d frames in %.1f s, %.1f fps", len(pressed), elapsed, len(pressed) / elapsed)
+    return to_midi_file(pressed, layout.midi, fps, config["channel"], config["velocity"])
+
+
+def load_config(path):
+    if path is None:
+        return dict()
+    with open(path) as file:
+        return json.load(file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Transcribe a recorded video of a paper keyboard into a MIDI file without any dialogs",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("video", type=str, help="Video file to transcribe")
+    parser.add_argument("output", type=str, help="MIDI file to write")
+    parser.add_argument("--config", type=str, default=None, help="JSON file with any of the options below")
+    parser.add_argument(
+        "--corners", type=float, nargs=8, default=None, help="Keyboard corners in the first frame: x0 y0 ... x3 y3"
+    )
+    parser.add_argument("--white-key-width", dest="white_key_width_px", type=int, default=None)
+    parser.add_argument("--nof-keys", type=int, default=None)
+    parser.add_argument("--start-key-pitchclass", type=int, default=None, help="0 is C, 9 is A")
+    parser.add_argument("--start-key-midi", type=int, default=None)
+    parser.add_argument("--stabilizer", choices=list(budgetpiano.matcher.STABILIZER_BACKENDS), default=None)
+    parser.add_argument("--chunk-duration", type=float, default=None, help="Seconds of video per worker task")
+    parser.add_argument("--overlap", type=float, default=None, help="Seconds read before each chunk to settle")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes, all cores by default")
+    parser.add_argument("--channel", type=int, default=None)
+    parser.add_argument("--velocity", type=int, default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    config = load_config(args.config)
+    config.update(
+        {
+            name: value
+            for name, value in vars(args).items()
+            if name not in ("video", "output", "config") and value is not None
+        }
+    )
+    transcribe(args.video, config).save(args.output)
@@ -0,0 +1,54 @@
+import numpy
+
+import budgetpiano.buffers
+import budgetpiano.frame_context
+import budgetpiano.instrument
+import budgetpiano.synthetic
+from budgetpiano.piano import _get_piano
+
+
+def test_steady_state_reuses_buffers():
+    buffer_pool = budgetpiano.buffers.BufferPool()
+    rng = numpy.random.default_rng(0)
+    previous = None
+    for _ in range(10):
+        frame = rng.integers(0, 256, (120, 160, 3), numpy.uint8)
+        context = budgetpiano.frame_context.FrameContext(frame, buffer_pool)
+        pyramid = context.get_pyramid(3)
+        buffers = [context.gray, context.get_scaled_gray(0.5), *pyramid]
+        if previous is not None:
+            assert all(numpy.shares_memory(buffer, other) for buffer, other in zip(buffers, previous))
+        previous = buffers
+        buffer_pool.finish_frame()
+
+    stats = buffer_pool.get_stats()
+    assert stats["allocations"] == stats["buffers"] == 5
+    assert stats["frames"] == 10
+    assert stats["steady_frames"] == 9
+
+
+def test_jittering_sizes_stop_allocating():
+    buffer_pool = budgetpiano.buffers.BufferPool(slack=0.25)
+    # A region of interest that changes size a little from frame to frame fits in the slack of the first one.
+    for width in [100, 110, 90, 120, 105]:
+        buffer = buffer_pool.get("roi", (50, width), numpy.float32)
+        assert buffer.shape == (50, width)
+        assert buffer.dtype == numpy.float32
+        buffer_pool.finish_frame()
+    assert buffer_pool.nof_allocations == 1
+
+    buffer_pool.get("roi", (50, 200), numpy.float32)
+    assert buffer_pool.nof_allocations == 2
+
+
+def test_instrument_pool_reaches_steady_state():
+    template, layout = _get_piano(10, return_layout=True)
+    frames = list(budgetpiano.synthetic.generate_video(template, layout, (640, 360), 30.0, 0.5, shake=0.0))
+    instrument = budgetpiano.instrument.Instrument(template, layout, frames[0].homography)
+    for frame in frames:
+        context = budgetpiano.frame_context.FrameContext(frame.image)
+        instrument.update(context, numpy.eye(3))
+    stats = instrument.buffer_pool.get_stats()
+    assert stats["frames"] == len(frames)
+    assert stats["allocations"] > 0
+    assert stats["steady_frames"] > len(frames) // 2
@@ -0,0 +1,110 @@
+import threading
+import time
+
+import pytest
+
+import budgetpiano.capture
+
+
+def test_drop_oldest_keeps_the_newest_frames():
+    dropped = []
+    ring = budgetpiano.capture.FrameRing(2, budgetpiano.capture.DROP_OLDEST, dropped.append)
+    assert all(ring.put(frame) for frame in range(4))
+    assert dropped == [0, 1]
+    # The latest frame is returned and the ones it overtook are dropped.
+    assert ring.get_latest(timeout=0) == 3
+    assert dropped == [0, 1, 2]
+    assert ring.nof_dropped == 3
+
+
+def test_drop_newest_keeps_the_oldest_frames():
+    dropped = []
+    ring = budgetpiano.capture.FrameRing(2, budgetpiano.capture.DROP_NEWEST, dropped.append)
+    assert [ring.put(frame) for frame in range(4)] == [True, True, False, False]
+    assert dropped == [2, 3]
+    assert ring.get_latest(timeout=0) == 1
+    assert ring.nof_dropped == 3
+
+
+def test_block_waits_for_the_consumer():
+    ring = budgetpiano.capture.FrameRing(1, budgetpiano.capture.BLOCK)
+    assert ring.put(0)
+    results = []
+    producer = threading.Thread(target=lambda: results.append(ring.put(1)))
+    producer.start()
+    producer.join(0.1)
+    assert producer.is_alive()
+    assert ring.get_latest(timeout=1.0) == 0
+    producer.join(1.0)
+    assert results == [True]
+    assert ring.get_latest(timeout=0) == 1
+    assert ring.nof_dropped == 0
+
+
+def test_close_releases_a_blocked_producer_and_consumer():
+    ring = budgetpiano.capture.FrameRing(1, budgetpiano.capture.BLOCK)
+    ring.put(0)
+    results = []
+    producer = threading.Thread(target=lambda: results.append(ring.put(1)))
+    producer.start()
+    ring.close()
+    producer.join(1.0)
+    assert results == [False]
+    assert ring.get_latest(timeout=0) == 0
+    assert ring.get_latest(timeout=1.0) is None
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        budgetpiano.capture.FrameRing(2, "drop-all")
+
+
+class FakeCapture:
+    def __init__(self, nof_frames):
+        self.nof_frames = nof_frames
+        self.frame_no = 0
+
+    def isOpened(self):
+        return True
+
+    def read(self, image=None):
+        if self.frame_no >= self.nof_frames:
+            return False, None
+        self.frame_no += 1
+        return True, self.frame_no
+
+    def get(self, property_id):
+        return self.frame_no
+
+
+def test_only_marked_frames_count_as_processed():
+    with budgetpiano.capture.threaded_capture(FakeCapture(4), maxsize=1, policy=budgetpiano.capture.BLOCK) as capture:
+        frames = [capture.get_latest(timeout=1.0) for _ in range(2)]
+        capture.mark_processed()
+        assert all(frame is not None for frame in frames)
+        assert capture.process_rate.count == 1
+        assert capture.decode_rate.count >= 2
+
+
+class StalledCapture(FakeCapture):
+    def __init__(self):
+        super().__init__(1)
+        self.release = threading.Event()
+
+    def read(self, image=None):
+        self.release.wait()
+        return super().read(image)
+
+
+def test_stop_does_not_hang_on_a_stalled_camera(caplog):
+    cap = StalledCapture()
+    capture = budgetpiano.capture.CaptureThread(cap)
+    capture.start()
+    start = time.monotonic()
+    capture.stop(timeout=0.2)
+    assert time.monotonic() - start < 1.0
+    assert capture.is_alive()
+    assert "did not stop" in caplog.text
+    cap.release.set()
+    capture.join(1.0)
+    assert not capture.is_alive()
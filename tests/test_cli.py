@@ -0,0 +1,67 @@
+import cv2
+import numpy
+
+import budgetpiano.cli
+import budgetpiano.gui
+import budgetpiano.instrument
+import budgetpiano.midi_output
+import budgetpiano.synthetic
+import budgetpiano.tracking
+from benchmarks.latency import ScriptedCamera, get_scripted_presses
+from budgetpiano.piano import _get_piano
+
+
+def test_instruments_play_on_their_own_channels(monkeypatch):
+    # Two keyboards with notes of their own, one above the other in the frame, each rendered as its own synthetic
+    # scene without shake so that they stay put relative to each other.
+    fps, duration, frame_size = 30.0, 4.0, (640, 360)
+    keyboards = [_get_piano(10, 49, 0, start_key_midi=midi, return_layout=True) for midi in (24, 76)]
+    rng = numpy.random.default_rng(0)
+    presses = [get_scripted_presses(layout, 1.5, duration, 0.5, 0.3, rng) for _, layout in keyboards]
+    videos = [
+        list(
+            budgetpiano.synthetic.generate_video(
+                template, layout, frame_size, fps, duration, presses=keyboard_presses, shake=0.0, seed=seed
+            )
+        )
+        for seed, ((template, layout), keyboard_presses) in enumerate(zip(keyboards, presses))
+    ]
+    images = [numpy.vstack([top.image, bottom.image]) for top, bottom in zip(*videos)]
+    # Frame to template homographies, the bottom keyboard is frame_size[1] further down.
+    homographies = [
+        videos[0][0].homography,
+        videos[1][0].homography @ budgetpiano.tracking.get_translation(0.0, -frame_size[1]),
+    ]
+
+    monkeypatch.setattr(budgetpiano.gui, "ask_for_piano", iter(keyboards).__next__)
+    corners = iter(
+        cv2.perspectiveTransform(budgetpiano.synthetic.get_corners(template)[None], numpy.linalg.inv(homography))[0]
+        for (template, _), homography in zip(keyboards, homographies)
+    )
+    monkeypatch.setattr(budgetpiano.gui, "ask_for_polygon", lambda image, title: next(corners))
+
+    instruments = []
+    instrument_class = budgetpiano.instrument.Instrument
+    monkeypatch.setattr(
+        budgetpiano.instrument,
+        "Instrument",
+        lambda *args, **kwargs: instruments.append(instrument_class(*args, **kwargs)) or instruments[-1],
+    )
+
+    port = budgetpiano.midi_output.RecordingPort()
+    budgetpiano.cli.main_instruments(
+        ScriptedCamera(images, fps), port, stabilizer_backend="optical-flow", auto_localize=False
+    )
+
+    note_ons = [message for message in port.messages if message.type == "note_on"]
+    # The keyboards have no notes in common, so a note on the wrong channel would not be one of its presses.
+    for channel, keyboard_presses in enumerate(presses):
+        notes = {message.note for message in note_ons if message.channel == channel}
+        assert notes == {press.note for press in keyboard_presses}
+    # Each instrument tracks its own keyboard and keeps its own buffers, which stop allocating after warmup.
+    for instrument, homography in zip(instruments, homographies):
+        size = (instrument.template.shape[1], instrument.template.shape[0])
+        assert budgetpiano.synthetic.get_corner_error(size, instrument.homography, homography) < 1.0
+        stats = instrument.buffer_pool.get_stats()
+        assert stats["frames"] > 0
+        assert stats["steady_frames"] > stats["frames"] // 2
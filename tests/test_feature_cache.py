@@ -0,0 +1,95 @@
+import os
+
+import numpy
+
+import budgetpiano.feature_cache
+
+
+def get_image(seed):
+    return numpy.random.default_rng(seed).integers(0, 256, (32, 48), numpy.uint8)
+
+
+def get_compute(calls):
+    def compute(image):
+        calls.append(image)
+        keypoints = budgetpiano.feature_cache.array_to_keypoints(numpy.float32([[1.5, 2.5, 3.0, 45.0, 0.1, 2, -1]]))
+        return keypoints, numpy.full((1, 128), len(calls), numpy.float32)
+
+    return compute
+
+
+def test_key_depends_on_image_detector_and_parameters():
+    cache = budgetpiano.feature_cache.FeatureCache()
+    image = get_image(0)
+    key = cache.get_key(image, "SIFT", dict(nfeatures=0))
+    assert cache.get_key(image.copy(), "SIFT", dict(nfeatures=0)) == key
+    assert cache.get_key(get_image(1), "SIFT", dict(nfeatures=0)) != key
+    assert cache.get_key(image, "ORB", dict(nfeatures=0)) != key
+    assert cache.get_key(image, "SIFT", dict(nfeatures=100)) != key
+    assert cache.get_key(image.reshape(48, 32), "SIFT", dict(nfeatures=0)) != key
+
+
+def test_round_trip(tmp_path):
+    cache = budgetpiano.feature_cache.FeatureCache(tmp_path)
+    calls = []
+    image = get_image(0)
+    keypoints, descriptors = cache.get_or_compute(image, "SIFT", {}, get_compute(calls))
+    cached_keypoints, cached_descriptors = cache.get_or_compute(image, "SIFT", {}, get_compute(calls))
+
+    assert len(calls) == 1
+    assert [(kp.pt, kp.size, kp.angle, kp.octave) for kp in cached_keypoints] == [
+        (kp.pt, kp.size, kp.angle, kp.octave) for kp in keypoints
+    ]
+    assert numpy.array_equal(cached_descriptors, descriptors)
+
+
+def test_eviction_removes_least_recently_used(tmp_path):
+    cache = budgetpiano.feature_cache.FeatureCache(tmp_path)
+    calls = []
+    images = [get_image(seed) for seed in range(3)]
+    for i, image in enumerate(images[:2]):
+        cache.get_or_compute(image, "SIFT", {}, get_compute(calls))
+        # Modification times are the recency order, so they are spread out rather than left to timer resolution.
+        os.utime(cache.get_path(cache.get_key(image, "SIFT", {})), (i, i))
+    entry_bytes = cache.get_path(cache.get_key(images[0], "SIFT", {})).stat().st_size
+
+    # Loading the oldest entry makes it the most recent, so the other one is evicted when the third is stored.
+    cache.max_bytes = 2 * entry_bytes
+    cache.get_or_compute(images[0], "SIFT", {}, get_compute(calls))
+    cache.get_or_compute(images[2], "SIFT", {}, get_compute(calls))
+
+    assert len(calls) == 3
+    assert cache.get_path(cache.get_key(images[0], "SIFT", {})).exists()
+    assert not cache.get_path(cache.get_key(images[1], "SIFT", {})).exists()
+    assert cache.get_path(cache.get_key(images[2], "SIFT", {})).exists()
+
+
+def test_disabled(tmp_path, monkeypatch):
+    calls = []
+    image = get_image(0)
+    cache = budgetpiano.feature_cache.FeatureCache(tmp_path, enabled=False)
+    cache.get_or_compute(image, "SIFT", {}, get_compute(calls))
+    cache.get_or_compute(image, "SIFT", {}, get_compute(calls))
+
+    monkeypatch.setenv("BUDGETPIANO_FEATURE_CACHE", "0")
+    cache = budgetpiano.feature_cache.FeatureCache(tmp_path)
+    cache.get_or_compute(image, "SIFT", {}, get_compute(calls))
+
+    assert len(calls) == 3
+    assert not list(tmp_path.iterdir())
+
+
+def test_corrupt_entry_is_a_miss(tmp_path):
+    cache = budgetpiano.feature_cache.FeatureCache(tmp_path)
+    calls = []
+    image = get_image(0)
+    cache.get_or_compute(image, "SIFT", {}, get_compute(calls))
+    key = cache.get_key(image, "SIFT", {})
+    # A truncated zip, as left behind by a full disk or a crash outside of store.
+    path = cache.get_path(key)
+    path.write_bytes(path.read_bytes()[:60])
+    assert cache.load(key) is None
+    path.write_bytes(b"garbage")
+    assert cache.load(key) is None
+    cache.get_or_compute(image, "SIFT", {}, get_compute(calls))
+    assert len(calls) == 2
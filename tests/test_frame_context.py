@@ -0,0 +1,52 @@
+import cv2
+import numpy
+
+import budgetpiano.frame_context
+
+
+def get_frame(height=96, width=128):
+    return numpy.random.default_rng(0).integers(0, 256, (height, width, 3), numpy.uint8)
+
+
+def test_gray_is_converted_once(monkeypatch):
+    calls = []
+    cvt_color = cv2.cvtColor
+    monkeypatch.setattr(cv2, "cvtColor", lambda *args, **kwargs: calls.append(args) or cvt_color(*args, **kwargs))
+    frame = get_frame()
+    context = budgetpiano.frame_context.FrameContext(frame)
+
+    gray = context.gray
+    assert context.gray is gray
+    assert context.gray_float is context.gray_float
+    assert context.get_scaled_gray(0.5) is context.get_scaled_gray(0.5)
+    context.get_pyramid(3)
+    crop = context.crop(10, 20, 30, 40)
+    assert numpy.shares_memory(crop.gray, gray)
+    assert len(calls) == 1
+
+    assert numpy.array_equal(gray, cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+    assert numpy.array_equal(crop.gray, gray[20:60, 10:40])
+    assert budgetpiano.frame_context.as_frame_context(context) is context
+
+
+def test_gray_frame_is_used_as_is():
+    gray = cv2.cvtColor(get_frame(), cv2.COLOR_BGR2GRAY)
+    context = budgetpiano.frame_context.FrameContext(gray)
+    assert context.gray is gray
+    assert context.get_scaled_gray(1.0) is gray
+
+
+def test_pyramid_is_extended_on_demand():
+    context = budgetpiano.frame_context.FrameContext(get_frame(192, 256))
+    coarse = context.get_pyramid(2)
+    pyramid = context.get_pyramid(4)
+    assert all(level is other for level, other in zip(coarse, pyramid))
+
+    expected = [context.gray.astype(numpy.float32)]
+    for _ in range(3):
+        expected.append(cv2.pyrDown(expected[-1]))
+    assert [level.shape for level in pyramid] == [level.shape for level in expected]
+    assert all(numpy.array_equal(level, other) for level, other in zip(pyramid, expected))
+
+    # No level is smaller than min_size: 192, 96 and 48 rows, but not 24.
+    assert len(budgetpiano.frame_context.FrameContext(get_frame(192, 256)).get_pyramid(4, min_size=40)) == 3
@@ -0,0 +1,39 @@
+import cv2
+import numpy
+import pytest
+
+import budgetpiano.homography
+import budgetpiano.synthetic
+from budgetpiano.piano import _get_piano
+
+
+def test_corners_clicked_in_any_order():
+    template, layout = _get_piano(10, return_layout=True)
+    size = (template.shape[1], template.shape[0])
+    frame = next(budgetpiano.synthetic.generate_video(template, layout, (960, 540), 30.0, 0.1, noise=0.0))
+    corners = cv2.perspectiveTransform(
+        budgetpiano.synthetic.get_corners(template)[None], numpy.linalg.inv(frame.homography)
+    )[0]
+    # The user can start at any corner and go around the keyboard either way.
+    for direction in (1, -1):
+        for start in range(4):
+            polygon = numpy.roll(corners, -start, axis=0)[::direction]
+            homography = budgetpiano.homography.find_homography(frame.image, template, polygon)
+            assert budgetpiano.synthetic.get_corner_error(size, homography, frame.homography) < 1.0
+
+
+@pytest.mark.parametrize(
+    "polygon",
+    [
+        [[0, 0], [100, 100], [100, 0], [0, 100]],
+        [[0, 0], [50, 0], [100, 0], [0, 100]],
+        [[0, 0], [100, 0], [20, 20], [0, 100]],
+        [[0, 0], [100, 0], [100, 100]],
+    ],
+    ids=["crossed", "collinear", "concave", "triangle"],
+)
+def test_invalid_polygon(polygon):
+    template = _get_piano(10)
+    image = numpy.zeros((200, 200, 3), numpy.uint8)
+    with pytest.raises(ValueError):
+        budgetpiano.homography.find_homography(image, template, polygon)
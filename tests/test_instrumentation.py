@@ -0,0 +1,80 @@
+import json
+import os
+import threading
+
+import budgetpiano.instrumentation
+
+
+def test_disabled_tracer_records_nothing():
+    tracer = budgetpiano.instrumentation.Tracer()
+    assert tracer.span("decode") is budgetpiano.instrumentation.NULL_SPAN
+    with tracer.span("decode"):
+        pass
+    tracer.count("dropped_frames")
+    tracer.gauge("tracked_points", 10)
+    assert len(tracer.events) == 0
+    assert not tracer.counters
+    assert tracer.get_summary().splitlines()[1:] == []
+
+
+def test_counters_and_gauges():
+    tracer = budgetpiano.instrumentation.Tracer(enabled=True)
+    tracer.count("dropped_frames")
+    tracer.count("dropped_frames", 2)
+    tracer.gauge("tracked_points", 10)
+    tracer.gauge("tracked_points", 7)
+    # Counters add up, gauges keep the last value; every change is an event for the trace.
+    assert tracer.counters == {"dropped_frames": 3, "tracked_points": 7}
+    assert [event["args"] for event in tracer.events] == [
+        {"dropped_frames": 1},
+        {"dropped_frames": 3},
+        {"tracked_points": 10},
+        {"tracked_points": 7},
+    ]
+
+
+def test_summary():
+    tracer = budgetpiano.instrumentation.Tracer(enabled=True)
+    for duration in (1, 2, 3):
+        tracer.add_span("refinement", 0, duration * 1_000_000)
+    tracer.add_span("decode", 0, 10_000_000)
+    tracer.count("dropped_frames", 4)
+    header, *lines = tracer.get_summary().splitlines()
+    assert header.split() == ["span", "count", "mean", "ms", "p50", "ms", "p95", "ms", "max", "ms"]
+    # Slowest span first, then the counters.
+    assert [line.split() for line in lines] == [
+        ["decode", "1", "10.00", "10.00", "10.00", "10.00"],
+        ["refinement", "3", "2.00", "2.00", "2.90", "3.00"],
+        ["dropped_frames", "4"],
+    ]
+
+
+def test_chrome_trace(tmp_path, monkeypatch):
+    tracer = budgetpiano.instrumentation.Tracer(enabled=True)
+    monkeypatch.setattr(budgetpiano.instrumentation, "tracer", tracer)
+    # The module functions record to the active tracer.
+    with budgetpiano.instrumentation.span("decode"):
+        budgetpiano.instrumentation.count("dropped_frames")
+    path = tmp_path / "trace.json"
+    tracer.export_chrome_trace(path)
+    with open(path) as file:
+        trace = json.load(file)
+    assert trace["displayTimeUnit"] == "ms"
+    counter, span = trace["traceEvents"]
+    assert counter == {
+        "name": "dropped_frames",
+        "ph": "C",
+        "ts": counter["ts"],
+        "pid": os.getpid(),
+        "args": {"dropped_frames": 1},
+    }
+    assert span == {
+        "name": "decode",
+        "ph": "X",
+        "ts": span["ts"],
+        "dur": span["dur"],
+        "pid": os.getpid(),
+        "tid": threading.get_ident(),
+    }
+    # Microseconds since the tracer was created, and the counter was set while the span was open.
+    assert 0.0 <= span["ts"] <= counter["ts"] <= span["ts"] + span["dur"]
@@ -0,0 +1,80 @@
+import mido
+import numpy
+import pytest
+
+import budgetpiano.synthetic
+from benchmarks.latency import DEFAULT_BUDGETS, get_failures, match_notes
+
+START_TIME = 100.0
+
+
+def press(start, note=60, length=0.5):
+    return budgetpiano.synthetic.Press(start, start + length, 0.0, 0.0, note)
+
+
+def note_on(note=60, velocity=64):
+    return mido.Message("note_on", note=note, velocity=velocity)
+
+
+@pytest.mark.parametrize(
+    "presses, notes, expected",
+    [
+        # A press is pressed at 1.0 s and lifted at 1.5 s; notes are (arrival time after start, message).
+        ([press(1.0)], [(1.1, note_on())], ([0.1], 0, 0, 0)),
+        ([press(1.0)], [], ([], 1, 0, 0)),
+        # Before the finger lands: false, and early as long as it is within max_early of the press.
+        ([press(1.0)], [(0.8, note_on())], ([], 1, 1, 1)),
+        ([press(1.0)], [(0.5, note_on())], ([], 1, 1, 0)),
+        # Up to max_latency after the key is lifted.
+        ([press(1.0)], [(2.4, note_on())], ([1.4], 0, 0, 0)),
+        ([press(1.0)], [(2.6, note_on())], ([], 1, 1, 0)),
+        # Only the first note of a press counts, a repeated one is false.
+        ([press(1.0)], [(1.1, note_on()), (1.2, note_on())], ([0.1], 0, 1, 0)),
+        ([press(1.0), press(2.0)], [(1.1, note_on()), (2.2, note_on())], ([0.1, 0.2], 0, 0, 0)),
+        ([press(1.0)], [(1.1, note_on(62))], ([], 1, 1, 0)),
+        # A note on without velocity is a note off.
+        ([press(1.0)], [(1.1, note_on(velocity=0)), (1.6, mido.Message("note_off", note=60))], ([], 1, 0, 0)),
+    ],
+)
+def test_match_notes(presses, notes, expected):
+    arrival_times = [START_TIME + arrival_time for arrival_time, _ in notes]
+    messages = [message for _, message in notes]
+    latencies, nof_missed, nof_false, nof_early = match_notes(presses, START_TIME, messages, arrival_times)
+    expected_latencies, *expected_counts = expected
+    numpy.testing.assert_allclose(latencies, expected_latencies)
+    assert [nof_missed, nof_false, nof_early] == expected_counts
+
+
+def get_results(latency_ms=(100.0, 200.0, 300.0), presses=20, missed=0, false=0):
+    return {
+        "latency_ms": None if latency_ms is None else dict(zip(("p50", "p95", "p99"), latency_ms)),
+        "presses": presses,
+        "missed_notes": missed,
+        "false_notes": false,
+    }
+
+
+@pytest.mark.parametrize(
+    "results, expected",
+    [
+        (get_results(), []),
+        # Budgets are upper bounds, being right at one passes.
+        (get_results((150.0, 250.0, 350.0), missed=2, false=2), []),
+        (get_results((100.0, 260.0, 300.0)), ["p95 latency 260.0 ms over budget 250.0 ms"]),
+        (
+            get_results(None, missed=20),
+            [
+                "p50 latency None ms over budget 150.0 ms",
+                "p95 latency None ms over budget 250.0 ms",
+                "p99 latency None ms over budget 350.0 ms",
+                "20 missed notes over budget 10% of the presses",
+            ],
+        ),
+        (get_results(missed=3), ["3 missed notes over budget 10% of the presses"]),
+        (get_results(false=3), ["3 false notes over budget 10% of the presses"]),
+        # Without presses, any false note is over budget.
+        (get_results(presses=0, false=1), ["1 false notes over budget 10% of the presses"]),
+    ],
+)
+def test_get_failures(results, expected):
+    assert get_failures(results, DEFAULT_BUDGETS) == expected
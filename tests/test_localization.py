@@ -0,0 +1,53 @@
+import cv2
+import numpy
+
+import budgetpiano.localization
+import budgetpiano.synthetic
+from budgetpiano.piano import _get_piano
+
+
+def spy(monkeypatch, name):
+    calls = []
+    function = getattr(budgetpiano.localization, name)
+    monkeypatch.setattr(
+        budgetpiano.localization, name, lambda *args, **kwargs: calls.append(args) or function(*args, **kwargs)
+    )
+    return calls
+
+
+def test_key_row_finds_the_keyboard(monkeypatch):
+    template, layout = _get_piano(10, return_layout=True)
+    size = (template.shape[1], template.shape[0])
+    template_matches = spy(monkeypatch, "match_template_features")
+    for seed in range(3):
+        frame = next(budgetpiano.synthetic.generate_video(template, layout, (960, 540), 30.0, 0.1, seed=seed))
+        homography = budgetpiano.localization.localize_keyboard(frame.image, template, layout)
+        assert budgetpiano.synthetic.get_corner_error(size, homography, frame.homography) < 1.0
+    assert template_matches == []
+
+
+def test_template_features_when_the_key_row_fails(monkeypatch):
+    # The plain template has too few distinctive features to be matched reliably, a textured one is printed instead.
+    rng = numpy.random.default_rng(0)
+    template, layout = _get_piano(10, return_layout=True)
+    noise = cv2.GaussianBlur((rng.random(template.shape[:2]) * 255).astype(numpy.uint8), (0, 0), 1)
+    template = cv2.addWeighted(template, 0.7, cv2.cvtColor(noise, cv2.COLOR_GRAY2BGR), 0.3, 0)
+    corners = budgetpiano.synthetic.get_corners(template)
+    frame_corners = corners + numpy.float32([40, 150]) + rng.normal(0, 2, corners.shape).astype(numpy.float32)
+    placement = cv2.getPerspectiveTransform(corners, frame_corners)
+    image = budgetpiano.synthetic.get_background((640, 360), rng)
+    cv2.warpPerspective(template, placement, (640, 360), dst=image, borderMode=cv2.BORDER_TRANSPARENT)
+
+    template_matches = spy(monkeypatch, "match_template_features")
+    # More black keys than the keyboard has can never be found in a row.
+    homography = budgetpiano.localization.localize_keyboard(image, template, layout, min_black_keys=100)
+    assert len(template_matches) == 1
+    size = (template.shape[1], template.shape[0])
+    assert budgetpiano.synthetic.get_corner_error(size, homography, numpy.linalg.inv(placement)) < 1.0
+
+
+def test_blank_frame():
+    template, layout = _get_piano(10, return_layout=True)
+    for value in (0, 128):
+        image = numpy.full((540, 960, 3), value, numpy.uint8)
+        assert budgetpiano.localization.localize_keyboard(image, template, layout) is None
@@ -0,0 +1,101 @@
+import numpy
+import pytest
+
+import budgetpiano.matcher
+import budgetpiano.synthetic
+from benchmarks.get_homography import get_scene, legacy_filter_matches
+from budgetpiano.piano import _get_piano
+
+FRAME_SIZE = (640, 360)
+
+
+def get_shaky_frames(duration=1.0, seed=0):
+    template, layout = _get_piano(10, return_layout=True)
+    return list(
+        budgetpiano.synthetic.generate_video(template, layout, FRAME_SIZE, 30.0, duration, shake=3.0, seed=seed)
+    )
+
+
+def get_stabilization_error(video_stabilizer, frame):
+    homography = video_stabilizer.get_homography(frame.image)
+    return budgetpiano.synthetic.get_corner_error(FRAME_SIZE, homography, frame.stabilization_homography)
+
+
+def force_point_loss(backend):
+    # Keeps too few points for the backend to rely on, spread out as if most of the scene had been covered.
+    if isinstance(backend, budgetpiano.matcher.OpticalFlowBackend):
+        kept = numpy.linspace(0, len(backend.keyframe_points) - 1, 30).astype(int)
+        backend.keyframe_points = backend.keyframe_points[kept]
+        backend.tracked_points = backend.tracked_points[kept]
+    else:
+        backend.flow_points = backend.flow_points[numpy.linspace(0, len(backend.flow_points) - 1, 30).astype(int)]
+
+
+def test_suppress_duplicates_matches_pairwise_check():
+    rng = numpy.random.default_rng(0)
+    # Clusters of points closer than the minimum distance, around cell borders as well as inside cells.
+    centres = rng.uniform(0, 20, (50, 2))
+    points = (centres[rng.integers(0, len(centres), 500)] + rng.normal(0, 0.5, (500, 2))).astype(numpy.float32)
+
+    is_kept = numpy.zeros(len(points), bool)
+    for i, point in enumerate(points):
+        is_kept[i] = not any(numpy.hypot(*(point - points[j])) < 1.0 for j in numpy.flatnonzero(is_kept))
+
+    assert is_kept.sum() < len(points)
+    assert numpy.array_equal(budgetpiano.matcher.suppress_duplicates(points, 1.0), is_kept)
+
+
+def test_filter_matches_matches_legacy_filter():
+    template, query = get_scene(20)
+    image_matcher = budgetpiano.matcher.ImageMatcher(template)
+    _, query_descriptors = image_matcher.sift.detectAndCompute(query, None)
+    matches = image_matcher.matcher.knnMatch(query_descriptors, k=2)
+
+    legacy = legacy_filter_matches(image_matcher, matches)
+    vectorized = image_matcher._filter_matches(matches)
+    assert len(legacy) >= 4
+    assert [(m.queryIdx, m.trainIdx) for m in vectorized] == [(m.queryIdx, m.trainIdx) for m in legacy]
+
+
+@pytest.mark.parametrize("backend", list(budgetpiano.matcher.STABILIZER_BACKENDS))
+def test_stabilizer_recovers_the_shake(backend):
+    video_stabilizer = budgetpiano.matcher.VideoStabilizer(backend)
+    errors = [get_stabilization_error(video_stabilizer, frame) for frame in get_shaky_frames()]
+    assert max(errors) < 1.0
+    assert video_stabilizer.nof_tracked_points >= video_stabilizer.min_tracked_points
+
+
+@pytest.mark.parametrize("backend", list(budgetpiano.matcher.STABILIZER_BACKENDS))
+def test_stabilizer_redetects_lost_points(backend, monkeypatch):
+    frames = get_shaky_frames()
+    video_stabilizer = budgetpiano.matcher.VideoStabilizer(backend)
+    for frame in frames[:10]:
+        video_stabilizer.get_homography(frame.image)
+    detections = []
+    # Feature backends match fresh detections against the keyframe, optical flow starts over with a new keyframe
+    # that is chained onto the first.
+    name = "set_keyframe" if backend == "optical-flow" else "_detect_and_compute"
+    method = getattr(video_stabilizer.backend, name)
+    monkeypatch.setattr(video_stabilizer.backend, name, lambda gray: detections.append(gray) or method(gray))
+    force_point_loss(video_stabilizer.backend)
+    errors = [get_stabilization_error(video_stabilizer, frames[10])]
+    assert len(detections) == 1
+    errors += [get_stabilization_error(video_stabilizer, frame) for frame in frames[11:]]
+    # ORB keypoints are coarser than optical flow, so matching alone is a little less accurate.
+    assert numpy.median(errors) < 1.0
+    assert max(errors) < 3.0
+
+
+@pytest.mark.parametrize("backend", ["sift", "orb"])
+def test_stabilizer_keyframe_restore(backend):
+    frames = get_shaky_frames()
+    video_stabilizer = budgetpiano.matcher.VideoStabilizer(backend)
+    for frame in frames[:5]:
+        video_stabilizer.get_homography(frame.image)
+    keyframe = video_stabilizer.get_keyframe()
+    # A restored stabilizer tracks against the old keyframe, so its homographies keep the first frame as reference.
+    restored_stabilizer = budgetpiano.matcher.VideoStabilizer(backend)
+    restored_stabilizer.set_keyframe(**keyframe)
+    errors = [get_stabilization_error(restored_stabilizer, frame) for frame in frames[5:]]
+    assert max(errors) < 1.0
+    assert budgetpiano.matcher.VideoStabilizer("optical-flow").get_keyframe() is None
@@ -0,0 +1,83 @@
+import threading
+import time
+
+import budgetpiano.midi_output
+
+
+def test_send_frame_tracks_note_state():
+    output = budgetpiano.midi_output.MidiOutput(budgetpiano.midi_output.RecordingPort(), channel=2, velocity=90)
+    messages = output.send_frame(1.0, note_ons=[60, 64])
+    assert [(message.type, message.note, message.channel, message.velocity) for message in messages] == [
+        ("note_on", 60, 2, 90),
+        ("note_on", 64, 2, 90),
+    ]
+    # Notes that are already on, or already off, are not sent again.
+    assert output.send_frame(2.0, note_ons=[60], note_offs=[62]) == []
+    messages = output.send_frame(3.0, note_ons=[67], note_offs=[60])
+    assert [(message.type, message.note) for message in messages] == [("note_off", 60), ("note_on", 67)]
+    assert output.is_on.nonzero()[0].tolist() == [64, 67]
+
+
+def test_batches_reach_the_port_in_order():
+    port = budgetpiano.midi_output.RecordingPort()
+    with budgetpiano.midi_output.midi_output(port) as output:
+        output.send_frame(1.0, note_ons=[60, 64])
+        output.send_frame(2.0, note_offs=[60])
+        output.send_frame(3.0)
+    # Stopping releases the notes still held.
+    assert [(message.type, message.note, message.time) for message in port.messages[:3]] == [
+        ("note_on", 60, 1.0),
+        ("note_on", 64, 1.0),
+        ("note_off", 60, 2.0),
+    ]
+    assert [(message.type, message.note) for message in port.messages[3:]] == [("note_off", 64)]
+    assert output.nof_sent == len(port.messages) == len(port.arrival_times) == 4
+    assert not output.is_on.any()
+
+
+def test_stalled_port_does_not_block_the_caller():
+    # Without the output thread running nothing leaves the queue, as with a port that has stalled.
+    port = budgetpiano.midi_output.RecordingPort()
+    output = budgetpiano.midi_output.MidiOutput(port, maxsize=2)
+    output.send_frame(1.0, note_ons=[60])
+    output.send_frame(2.0, note_ons=[62])
+    output.send_frame(3.0, note_ons=[64], note_offs=[60])
+    output.send_frame(4.0, note_ons=[60], note_offs=[62])
+    output.send_frame(5.0, note_offs=[64])
+    assert output.nof_coalesced == 2
+    output.start()
+    output.stop()
+    # Every note off still reaches the port, and the port ends up with the same notes on as the caller.
+    assert sorted(message.note for message in port.messages if message.type == "note_off") == [60, 60, 62, 64]
+    is_on = set()
+    for message in port.messages:
+        if message.type == "note_on":
+            is_on.add(message.note)
+        else:
+            is_on.discard(message.note)
+    assert not is_on
+
+
+class BlockingPort(budgetpiano.midi_output.RecordingPort):
+    def _open(self, **kwargs):
+        super()._open(**kwargs)
+        self.release = threading.Event()
+
+    def _send(self, message):
+        self.release.wait()
+        super()._send(message)
+
+
+def test_stop_does_not_hang_on_a_blocked_port(caplog):
+    port = BlockingPort()
+    output = budgetpiano.midi_output.MidiOutput(port, maxsize=2)
+    output.start()
+    output.send_frame(1.0, note_ons=[60])
+    start = time.monotonic()
+    output.stop(timeout=0.2)
+    assert time.monotonic() - start < 1.0
+    assert output.is_alive()
+    assert "did not stop" in caplog.text
+    port.release.set()
+    output.join(1.0)
+    assert not output.is_alive()
@@ -0,0 +1,31 @@
+import numpy
+import pytest
+
+from budgetpiano.piano import NO_KEY, _get_piano_layout
+
+
+@pytest.mark.parametrize("white_key_width_px, nof_keys, start_key_pitchclass", [(10, 88, 9), (7, 61, 0), (23, 25, 1)])
+def test_labels_match_drawn_rectangles(white_key_width_px, nof_keys, start_key_pitchclass):
+    layout = _get_piano_layout(white_key_width_px, nof_keys, start_key_pitchclass)
+    expected = numpy.full((layout.height, layout.width), NO_KEY, numpy.int16)
+    # White keys first so that black keys overlap them, each one an inclusive rectangle.
+    for key_no in numpy.concatenate([numpy.flatnonzero(~layout.is_black), numpy.flatnonzero(layout.is_black)]):
+        expected[layout.top[key_no] : layout.bottom[key_no] + 1, layout.left[key_no] : layout.right[key_no] + 1] = (
+            key_no
+        )
+
+    assert layout.labels.shape == (layout.height, layout.width)
+    assert numpy.array_equal(layout.labels, expected)
+    assert not layout.labels.flags.writeable
+
+
+@pytest.mark.parametrize(
+    "nof_keys, start_key_pitchclass, start_key_midi, lowest, highest",
+    [(88, 9, None, 21, 108), (61, 0, None, 36, 96), (49, 0, None, 36, 84), (25, 0, 60, 60, 84)],
+)
+def test_midi(nof_keys, start_key_pitchclass, start_key_midi, lowest, highest):
+    layout = _get_piano_layout(10, nof_keys, start_key_pitchclass, start_key_midi)
+    assert layout.midi[0] == lowest
+    assert layout.midi[-1] == highest
+    assert numpy.array_equal(numpy.diff(layout.midi), numpy.ones(nof_keys - 1))
+    assert numpy.array_equal(layout.is_black, numpy.isin(layout.midi % 12, [1, 3, 6, 8, 10]))
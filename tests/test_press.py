@@ -0,0 +1,92 @@
+import numpy
+
+import budgetpiano.press
+from budgetpiano.piano import _get_piano
+
+
+def get_foreground(layout, key_nos, fraction):
+    # Marks the given fraction of the press zone of each key as foreground, from the front of the key.
+    labels = budgetpiano.press.get_press_labels(layout)
+    foreground = numpy.zeros(labels.shape, numpy.uint8)
+    for key_no in key_nos:
+        rows, columns = numpy.nonzero(labels == key_no)
+        order = numpy.argsort(-rows, kind="stable")[: int(round(fraction * len(rows)))]
+        foreground[rows[order], columns[order]] = 255
+    return foreground
+
+
+def test_hysteresis():
+    template, layout = _get_piano(10, return_layout=True)
+    press_detector = budgetpiano.press.PressDetector(layout, warmup_frames=0)
+    key_no = int(numpy.flatnonzero(~layout.is_black)[20])
+    note = int(layout.midi[key_no])
+
+    def update(fraction):
+        pressed, released = press_detector.update(get_foreground(layout, [key_no], fraction))
+        return pressed.tolist(), released.tolist()
+
+    # A press takes on_frames frames above the on threshold once the key has stopped filling up.
+    assert update(0.5) == ([], [])
+    assert update(0.5) == ([], [])
+    assert update(0.5) == ([note], [])
+    assert press_detector.is_pressed[key_no]
+    # Between the thresholds the key stays down, and a single frame below the off threshold is not enough.
+    assert update(0.12) == ([], [])
+    assert update(0.0) == ([], [])
+    assert update(0.12) == ([], [])
+    assert update(0.0) == ([], [])
+    assert update(0.0) == ([], [note])
+    assert not press_detector.is_pressed.any()
+
+
+def test_warmup_and_global_changes_are_ignored():
+    template, layout = _get_piano(10, return_layout=True)
+    press_detector = budgetpiano.press.PressDetector(layout, warmup_frames=2)
+    key_no = int(numpy.flatnonzero(~layout.is_black)[20])
+    for _ in range(4):
+        press_detector.update(get_foreground(layout, [key_no], 0.5))
+    assert press_detector.is_pressed.nonzero()[0].tolist() == [key_no]
+
+    # Most of the keyboard lighting up at once is a lighting change, not hands.
+    press_detector = budgetpiano.press.PressDetector(layout, warmup_frames=0)
+    for _ in range(4):
+        press_detector.update(get_foreground(layout, range(len(layout.midi)), 0.5))
+    assert not press_detector.is_pressed.any()
+
+
+def test_finger_sliding_onto_a_black_key():
+    # On its way to a black key, a finger first crosses the fronts of the white keys on either side of it.
+    template, layout = _get_piano(10, return_layout=True)
+    press_detector = budgetpiano.press.PressDetector(layout, warmup_frames=0)
+    black_key_no = int(numpy.flatnonzero(layout.is_black)[10])
+    white_key_nos = [black_key_no - 1, black_key_no + 1]
+    frames = [
+        get_foreground(layout, white_key_nos, 0.2),
+        get_foreground(layout, white_key_nos, 0.4),
+        get_foreground(layout, white_key_nos, 0.5),
+        get_foreground(layout, white_key_nos, 0.3) | get_foreground(layout, [black_key_no], 0.4),
+        get_foreground(layout, white_key_nos, 0.1) | get_foreground(layout, [black_key_no], 0.8),
+    ] + [get_foreground(layout, [black_key_no], 0.8)] * 3
+    notes = []
+    for foreground in frames:
+        pressed, _ = press_detector.update(foreground)
+        notes.extend(pressed.tolist())
+    assert notes == [int(layout.midi[black_key_no])]
+
+
+def test_slow_lighting_change_is_ignored():
+    # The white keys come up together, a little more every frame and each at its own rate, so that only some of
+    # them are over the on threshold at a time, while a hand holds down a single key.
+    template, layout = _get_piano(10, return_layout=True)
+    press_detector = budgetpiano.press.PressDetector(layout, warmup_frames=0)
+    white_key_nos = numpy.flatnonzero(~layout.is_black)
+    rates = numpy.random.default_rng(0).uniform(0.7, 1.3, len(white_key_nos))
+    key_no = int(white_key_nos[20])
+    notes = []
+    for fraction in numpy.linspace(0.0, 0.25, 20):
+        foreground = get_foreground(layout, [key_no], 0.8)
+        for white_key_no, rate in zip(white_key_nos, rates):
+            foreground |= get_foreground(layout, [white_key_no], rate * fraction)
+        pressed, _ = press_detector.update(foreground)
+        notes.extend(pressed.tolist())
+    assert notes == [int(layout.midi[key_no])]
@@ -0,0 +1,82 @@
+import multiprocessing.shared_memory
+
+import pytest
+
+import budgetpiano.capture
+import budgetpiano.processes
+import budgetpiano.synthetic
+from budgetpiano.piano import _get_piano
+
+FRAME_SIZE = (640, 360)
+NOF_FRAMES = 20
+NOF_SLOTS = 3
+
+
+def start_pipeline(tmp_path, policy):
+    template, layout = _get_piano(10, return_layout=True)
+    frames = list(budgetpiano.synthetic.generate_video(template, layout, FRAME_SIZE, 10.0, NOF_FRAMES / 10.0))
+    video_path = tmp_path / "video.avi"
+    budgetpiano.synthetic.write_video(video_path, frames, 10.0)
+    pipeline = budgetpiano.processes.ProcessPipeline(
+        str(video_path),
+        frames[0].image.shape,
+        template,
+        layout,
+        frames[0].homography,
+        nof_slots=NOF_SLOTS,
+        policy=policy,
+        stabilizer_backend="optical-flow",
+    )
+    pipeline.start()
+    return pipeline
+
+
+def assert_stopped(pipeline):
+    assert [process.exitcode for process in pipeline.processes] == [0] * len(pipeline.processes)
+    with pytest.raises(FileNotFoundError):
+        multiprocessing.shared_memory.SharedMemory(pipeline.ring.name)
+
+
+def get_free_slots(pipeline):
+    return sorted(pipeline.free_slots.get(timeout=5.0) for _ in range(NOF_SLOTS))
+
+
+def test_block_processes_every_frame(tmp_path):
+    pipeline = start_pipeline(tmp_path, budgetpiano.capture.BLOCK)
+    try:
+        frame_nos = [result.frame_no for result in pipeline.get_results(timeout=10.0)]
+        # The end-of-stream marker came through every stage, and every slot was handed back.
+        assert frame_nos == list(range(1, NOF_FRAMES + 1))
+        assert get_free_slots(pipeline) == list(range(NOF_SLOTS))
+    finally:
+        pipeline.stop()
+    assert pipeline.get_stats()["processed_frames"] == NOF_FRAMES
+    assert pipeline.get_stats()["dropped_frames"] == 0
+    assert_stopped(pipeline)
+
+
+def test_drop_newest_accounts_for_every_frame(tmp_path):
+    pipeline = start_pipeline(tmp_path, budgetpiano.capture.DROP_NEWEST)
+    try:
+        frame_nos = [result.frame_no for result in pipeline.get_results(timeout=10.0)]
+        assert frame_nos == sorted(frame_nos)
+        assert frame_nos[0] == 1
+        assert get_free_slots(pipeline) == list(range(NOF_SLOTS))
+    finally:
+        pipeline.stop()
+    # Each frame was either processed or dropped for lack of a free slot.
+    stats = pipeline.get_stats()
+    assert stats["processed_frames"] == len(frame_nos)
+    assert stats["processed_frames"] + stats["dropped_frames"] == NOF_FRAMES
+    assert_stopped(pipeline)
+
+
+def test_stop_before_the_end(tmp_path):
+    pipeline = start_pipeline(tmp_path, budgetpiano.capture.BLOCK)
+    try:
+        results = pipeline.get_results(timeout=10.0)
+        next(results)
+        next(results)
+    finally:
+        pipeline.stop()
+    assert_stopped(pipeline)
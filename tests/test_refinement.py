@@ -0,0 +1,86 @@
+import numpy
+import pytest
+
+import budgetpiano.refinement
+import budgetpiano.synthetic
+import budgetpiano.tracking
+from benchmarks.cost_function import get_scene, legacy_cost_function
+from benchmarks.pipeline import perturb
+from budgetpiano.piano import NO_KEY, _get_piano
+
+
+def test_pyramid_stops_at_narrow_keys():
+    template, layout = _get_piano(10, return_layout=True)
+    pyramid = budgetpiano.refinement.build_template_pyramid(template, layout, 4, min_key_width=4.0)
+    assert [level.shape for level in pyramid] == [(66, 545), (33, 273)]
+    template, layout = _get_piano(40, return_layout=True)
+    assert len(budgetpiano.refinement.build_template_pyramid(template, layout, 4, min_key_width=4.0)) == 4
+
+
+def test_refinement_accuracy():
+    # Starting a few pixels off, refinement ends up close to the keyboard, and never a key or more away from where
+    # it started.
+    template, layout = _get_piano(10, return_layout=True)
+    size = (template.shape[1], template.shape[0])
+    template_pyramid = budgetpiano.refinement.build_template_pyramid(template, layout)
+    errors = []
+    for seed in range(5):
+        rng = numpy.random.default_rng(seed)
+        for frame in budgetpiano.synthetic.generate_video(template, layout, (960, 540), 30.0, 0.5, seed=seed):
+            initial_homography, _ = perturb(frame.homography, size, rng, 2.0)
+            homography = budgetpiano.refinement.refine_homography(
+                frame.image, template, initial_homography, layout, template_pyramid=template_pyramid
+            )
+            error = budgetpiano.synthetic.get_corner_error(size, homography, frame.homography)
+            initial_error = budgetpiano.synthetic.get_corner_error(size, initial_homography, frame.homography)
+            assert error <= max(initial_error, 1.0)
+            errors.append(error)
+    assert numpy.median(errors) < 0.5
+    assert numpy.mean(numpy.array(errors) > 1.0) < 0.1
+
+
+def test_prepared_template_matches_legacy_cost():
+    frame, template, true_homography = get_scene(10, (960, 540))
+    prepared_template = budgetpiano.refinement.PreparedTemplate(template)
+    rng = numpy.random.default_rng(0)
+    size = (template.shape[1], template.shape[0])
+    homographies = [true_homography] + [perturb(true_homography, size, rng, 3.0)[0] for _ in range(5)]
+    for homography in homographies:
+        assert numpy.isclose(
+            prepared_template.cost(frame, homography),
+            legacy_cost_function(homography.ravel(), frame, template),
+            atol=1e-5,
+        )
+    # A warp that leaves the frame has nothing to compare.
+    assert prepared_template.cost(frame, budgetpiano.tracking.get_translation(-1e4, 0.0)) == 2.0
+
+
+def test_masked_cost_only_scores_key_pixels():
+    template, layout = _get_piano(10, return_layout=True)
+    is_key = layout.labels != NO_KEY
+    prepared_template = budgetpiano.refinement.PreparedTemplate(template, is_key.astype(numpy.uint8))
+    rng = numpy.random.default_rng(0)
+    # In template coordinates, so that the identity puts every source pixel on the template pixel it replaces.
+    source = numpy.clip(template.astype(int) + rng.integers(-20, 20, template.shape), 0, 255).astype(numpy.uint8)
+    cost = prepared_template.cost(source, numpy.eye(3))
+    assert 0.0 < cost < 0.01
+
+    outside = source.copy()
+    outside[~is_key] = rng.integers(0, 256, outside[~is_key].shape)
+    assert prepared_template.cost(outside, numpy.eye(3)) == pytest.approx(cost, abs=1e-6)
+    inside = source.copy()
+    inside[is_key] = rng.integers(0, 256, inside[is_key].shape)
+    assert prepared_template.cost(inside, numpy.eye(3)) > 10.0 * cost
+
+
+def test_prepared_template_reuses_its_buffers():
+    frame, template, true_homography = get_scene(10, (960, 540))
+    prepared_template = budgetpiano.refinement.PreparedTemplate(template)
+    shifted_homography = budgetpiano.tracking.get_translation(3.0, 1.0) @ true_homography
+    cost = prepared_template.cost(frame, true_homography)
+    shifted_cost = prepared_template.cost(frame, shifted_homography)
+    assert shifted_cost > cost
+    assert prepared_template.cost(frame, true_homography) == cost
+    assert prepared_template.cost(frame, shifted_homography) == shifted_cost
+    warped = prepared_template.warp(frame, true_homography)
+    assert warped is prepared_template.warp_buffer
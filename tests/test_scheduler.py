@@ -0,0 +1,60 @@
+import time
+
+import budgetpiano.scheduler
+
+
+def finish_frames(scheduler, nof_frames, latency, costs=None):
+    # Latency is measured from the capture timestamp, so frames are finished as if captured that long ago.
+    levels = []
+    for _ in range(nof_frames):
+        for name, seconds in (costs or {}).items():
+            scheduler.add_cost(name, seconds)
+        scheduler.finish_frame(time.monotonic() - latency)
+        levels.append(scheduler.level)
+    return levels
+
+
+def test_degradation_order():
+    levels = budgetpiano.scheduler.DEGRADATION_LEVELS
+    cheapest = levels[-1]
+    for previous, settings in zip(levels, levels[1:]):
+        # Each level degrades exactly one setting, and a setting only degrades once the ones before it are exhausted.
+        changes = [previous[i] != settings[i] for i in range(3)]
+        assert sum(changes) == 1
+        assert settings.refresh_interval >= previous.refresh_interval
+        assert settings.working_scale <= previous.working_scale
+        assert settings.min_frame_interval >= previous.min_frame_interval
+        first_changed = changes.index(True)
+        assert all(settings[i] == cheapest[i] for i in range(first_changed))
+
+
+def test_levels_up_once_per_cooldown():
+    scheduler = budgetpiano.scheduler.LatencyScheduler(target_latency=0.1, smoothing=1.0, cooldown=3)
+    assert finish_frames(scheduler, 7, 0.2) == [0, 0, 1, 1, 1, 2, 2]
+    finish_frames(scheduler, 100, 0.2)
+    assert scheduler.level == len(budgetpiano.scheduler.DEGRADATION_LEVELS) - 1
+
+
+def test_levels_down_only_with_headroom():
+    scheduler = budgetpiano.scheduler.LatencyScheduler(target_latency=0.1, smoothing=1.0, cooldown=3, headroom=0.7)
+    finish_frames(scheduler, 6, 0.2)
+    assert scheduler.level == 2
+    costs = {"homography_tracking": 0.02}
+
+    # Below the target, but going back to refreshing twice as often is predicted to cost 0.085 s, above the headroom.
+    assert finish_frames(scheduler, 6, 0.065, costs) == [2] * 6
+    # At 0.06 s predicted the level goes down at once, as the cooldown has passed, and then again only after it.
+    assert finish_frames(scheduler, 6, 0.04, costs) == [1, 1, 1, 0, 0, 0]
+
+
+def test_frame_rate_limit():
+    levels = (budgetpiano.scheduler.Settings(30, 1.0, 0.1),)
+    scheduler = budgetpiano.scheduler.LatencyScheduler(levels=levels)
+    assert [scheduler.should_process(timestamp) for timestamp in [0.0, 0.05, 0.1, 0.15, 0.25]] == [
+        True,
+        False,
+        True,
+        False,
+        True,
+    ]
+    assert scheduler.nof_skipped == 2
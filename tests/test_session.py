@@ -0,0 +1,64 @@
+import numpy
+
+import budgetpiano.session
+from budgetpiano.piano import _get_piano
+
+
+def test_round_trip(tmp_path):
+    template, layout = _get_piano(10, nof_keys=61, return_layout=True)
+    rng = numpy.random.default_rng(0)
+    keyframe = {
+        "keyframe_points": rng.random((50, 2)).astype(numpy.float32),
+        "keyframe_descriptors": rng.integers(0, 256, (50, 32), dtype=numpy.uint8),
+        "keyframe_homography": numpy.eye(3),
+        "keyframe_scale": 0.5,
+    }
+    session = budgetpiano.session.Session(
+        template,
+        layout,
+        numpy.array([[1.0, 0.1, -20.0], [0.0, 1.2, -30.0], [0.0, 0.0, 1.0]]),
+        0.125,
+        "orb",
+        keyframe,
+        rng.integers(0, 256, (66, 545), dtype=numpy.uint8),
+    )
+    path = tmp_path / "sessions" / "session.npz"
+    budgetpiano.session.save_session(path, session)
+    assert [child.name for child in path.parent.iterdir()] == ["session.npz"]
+
+    loaded = budgetpiano.session.load_session(path)
+    numpy.testing.assert_array_equal(loaded.template, session.template)
+    for field in layout._fields:
+        numpy.testing.assert_array_equal(getattr(loaded.layout, field), getattr(layout, field))
+    numpy.testing.assert_array_equal(loaded.instrument_homography, session.instrument_homography)
+    assert loaded.residual == session.residual
+    assert loaded.stabilizer_backend == session.stabilizer_backend
+    assert loaded.keyframe.keys() == keyframe.keys()
+    for name, value in keyframe.items():
+        numpy.testing.assert_array_equal(loaded.keyframe[name], value)
+    numpy.testing.assert_array_equal(loaded.background, session.background)
+
+
+def test_round_trip_without_keyframe_and_background(tmp_path):
+    template, layout = _get_piano(10, nof_keys=61, return_layout=True)
+    session = budgetpiano.session.Session(template, layout, numpy.eye(3), 0.1, "optical-flow", None, None)
+    budgetpiano.session.save_session(tmp_path / "session.npz", session)
+    loaded = budgetpiano.session.load_session(tmp_path / "session.npz")
+    assert loaded.keyframe is None
+    assert loaded.background is None
+
+
+def test_unreadable_session(tmp_path):
+    path = tmp_path / "session.npz"
+    assert budgetpiano.session.load_session(path) is None
+    path.write_bytes(b"not a session")
+    assert budgetpiano.session.load_session(path) is None
+
+
+def test_corrupt_session(tmp_path):
+    template, layout = _get_piano(10, nof_keys=61, return_layout=True)
+    session = budgetpiano.session.Session(template, layout, numpy.eye(3), 0.1, "optical-flow", None, None)
+    path = tmp_path / "session.npz"
+    budgetpiano.session.save_session(path, session)
+    path.write_bytes(path.read_bytes()[:60])
+    assert budgetpiano.session.load_session(path) is None
@@ -0,0 +1,82 @@
+import cv2
+import numpy
+
+import budgetpiano.refinement
+import budgetpiano.synthetic
+import budgetpiano.tracking
+from budgetpiano.piano import _get_piano
+
+
+def test_velocity_is_measured_between_refinements(monkeypatch):
+    # The keyboard moves 2 px to the left every frame. Refinement finds it exactly, and the residual grows with the
+    # distance of the homography from the true one, so that predictions that fall behind trigger a refinement.
+    # Without damping, the predictions are exact until a refinement is forced every refresh_interval frames.
+    true_homographies = [budgetpiano.tracking.get_translation(-2.0 * i, 0.0) for i in range(40)]
+    frame_no = 0
+    monkeypatch.setattr(
+        budgetpiano.refinement,
+        "refine_homography",
+        lambda image, template, homography, layout, **kwargs: true_homographies[frame_no],
+    )
+    template, layout = _get_piano(10, return_layout=True)
+    homography_tracker = budgetpiano.tracking.HomographyTracker(
+        template, layout, refresh_interval=10, velocity_damping=1.0
+    )
+    homography_tracker.get_residual = lambda image, homography: (
+        abs(homography[0, 2] - true_homographies[frame_no][0, 2]) + 0.1
+    )
+    homography_tracker.reset(true_homographies[0])
+    image = numpy.zeros((10, 10, 3), numpy.uint8)
+    for frame_no in range(1, 40):
+        homography_tracker.update(image)
+        assert numpy.allclose(homography_tracker.homography, true_homographies[frame_no])
+    # Measured from the refined homographies rather than from the predictions, which already include it.
+    assert numpy.isclose(homography_tracker.velocity[2], -2.0)
+    assert numpy.allclose(homography_tracker.predict(), budgetpiano.tracking.get_translation(-80.0, 0.0))
+    assert homography_tracker.get_stats() == {
+        "predicted_frames": 34,
+        "refined_frames": 5,
+        "predicted_fraction": 34 / 39,
+    }
+
+
+def test_reset_clears_the_velocity():
+    homography_tracker = budgetpiano.tracking.HomographyTracker(*_get_piano(10, return_layout=True))
+    homography_tracker.velocity[:] = 1.0
+    homography = budgetpiano.tracking.get_translation(5.0, -3.0)
+    homography_tracker.reset(homography)
+    assert numpy.allclose(homography_tracker.predict(), homography)
+    assert numpy.allclose(homography_tracker.homography, homography)
+
+
+def test_composed_warp_matches_two_step_warp():
+    template, layout = _get_piano(10, return_layout=True)
+    size = (template.shape[1], template.shape[0])
+    frames = budgetpiano.synthetic.generate_video(template, layout, (960, 540), 30.0, 0.2, shake=4.0, noise=0.0)
+    frame = list(frames)[-1]
+    frame_size = (frame.image.shape[1], frame.image.shape[0])
+    stabilization_homography = frame.stabilization_homography
+    # The instrument homography is kept in stabilized coordinates.
+    instrument_homography = frame.homography @ numpy.linalg.inv(stabilization_homography)
+
+    stable_frame = cv2.warpPerspective(frame.image, stabilization_homography, frame_size)
+    two_step = cv2.warpPerspective(stable_frame, instrument_homography, size)
+    composed = cv2.warpPerspective(frame.image, instrument_homography @ stabilization_homography, size)
+    # Only the second interpolation of the two-step warp is missing.
+    assert numpy.abs(composed.astype(int) - two_step.astype(int)).mean() < 2.0
+
+    # A crop around the keyboard, with its offset folded into the homography, gives the same image and tracks the
+    # same homography as the whole frame.
+    x, y, width, height = budgetpiano.tracking.get_roi(
+        size, instrument_homography @ stabilization_homography, frame.image.shape
+    )
+    assert width < frame_size[0] or height < frame_size[1]
+    crop = frame.image[y : y + height, x : x + width]
+    crop_homography = stabilization_homography @ budgetpiano.tracking.get_translation(x, y)
+    cropped = cv2.warpPerspective(crop, instrument_homography @ crop_homography, size)
+    assert numpy.abs(cropped.astype(int) - composed.astype(int)).max() <= 1
+
+    homography_tracker = budgetpiano.tracking.HomographyTracker(template, layout)
+    homography_tracker.reset(instrument_homography)
+    homography = homography_tracker.update(crop, crop_homography)
+    assert budgetpiano.synthetic.get_corner_error(size, homography @ stabilization_homography, frame.homography) < 0.5
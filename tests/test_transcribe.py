@@ -0,0 +1,58 @@
+import mido
+import numpy
+
+import budgetpiano.synthetic
+import budgetpiano.transcribe
+from budgetpiano.piano import _get_piano
+
+
+def test_chunks_cover_every_frame_once():
+    chunks = budgetpiano.transcribe.get_chunks(250, 100, 30)
+    assert chunks == [(0, 0, 100), (70, 100, 200), (170, 200, 250)]
+    # The owned ranges of the chunks tile the video, so their rows stitch together by concatenation.
+    owned = numpy.concatenate([numpy.arange(start, stop) for first, start, stop in chunks])
+    assert owned.tolist() == list(range(250))
+
+
+def test_to_midi_file():
+    midi = numpy.array([60, 62, 64])
+    # Key 0 is held over a chunk boundary, key 1 is pressed twice, key 2 is still held at the end.
+    chunks = [
+        numpy.array([[0, 0, 0], [1, 1, 0], [1, 0, 0]], bool),
+        numpy.array([[1, 1, 0], [0, 1, 1], [0, 0, 1]], bool),
+    ]
+    midi_file = budgetpiano.transcribe.to_midi_file(numpy.vstack(chunks), midi, fps=10.0, channel=1, velocity=80)
+    tempo, *messages = midi_file.tracks[0]
+    assert tempo.type == "set_tempo"
+    ticks = numpy.cumsum([message.time for message in messages])
+    events = [
+        (round(mido.tick2second(tick, midi_file.ticks_per_beat, tempo.tempo), 3), message.type, message.note)
+        for tick, message in zip(ticks.tolist(), messages)
+    ]
+    assert events == [
+        (0.1, "note_on", 60),
+        (0.1, "note_on", 62),
+        (0.2, "note_off", 62),
+        (0.3, "note_on", 62),
+        (0.4, "note_off", 60),
+        (0.4, "note_on", 64),
+        (0.5, "note_off", 62),
+        (0.6, "note_off", 64),
+    ]
+    assert all(message.channel == 1 for message in messages)
+    assert all(message.velocity == 80 for message in messages if message.type == "note_on")
+
+
+def test_short_chunk_keeps_its_length(tmp_path, caplog):
+    template_parameters = dict(white_key_width_px=10, nof_keys=88, start_key_pitchclass=9, start_key_midi=None)
+    template, layout = _get_piano(**template_parameters, return_layout=True)
+    frames = list(budgetpiano.synthetic.generate_video(template, layout, (640, 360), 10.0, 1.0))
+    video_path = tmp_path / "video.avi"
+    budgetpiano.synthetic.write_video(video_path, frames, 10.0)
+    # The chunk claims frames past the end of the video, e.g. after a wrong frame count.
+    pressed = budgetpiano.transcribe.transcribe_chunk(
+        str(video_path), template_parameters, frames[0].image, frames[0].homography, (2, 5, 15), "optical-flow", 10.0
+    )
+    assert pressed.shape == (10, len(layout.midi))
+    assert (pressed[5:] == pressed[4]).all()
+    assert "ended after 5 of its frames" in caplog.text